@@ -0,0 +1,97 @@
+import time
+import tempfile
+import argparse
+
+import pandas as pd
+
+import numpy as np
+
+from notebooks.analysis_utils import transform_df, module_usage, libraries_in_repos, libraries_in_files, modules_in_repos, modules_in_files, module_component_counts, component_in_files, component_counts, \
+    specific_component_type_in_files, specific_component_type_counts, get_corr_table, top_partners, cube_for
+
+
+# The previous row-by-row implementations, kept as the baseline of the comparison.
+def transform_df_rowwise(df):
+    df = df.copy()
+    df['repo'] = df['filename'].str.split('/').str[5]
+    df['filename'] = df.apply(lambda row: row['filename'].split(row['repo'])[-1], axis=1).str[1:]
+    df = df[['repo', 'filename', 'module', 'component_type', 'component_name', 'count']]
+    df['library'] = df['module'].str.split('.').str[0]
+    return df
+
+
+def regrouping_helpers(df):
+    libraries = df.drop(['module'], axis=1).drop_duplicates()
+    return [libraries.groupby('library')['repo'].nunique(), df.drop(['module'], axis=1).drop_duplicates().groupby('library')['filename'].nunique(),
+            df.groupby('module')['repo'].nunique(), df.groupby('module')['filename'].nunique()]
+
+
+def dense_corr_table(df, top_n):
+    top = df.groupby('component_name')['filename'].nunique().sort_values(ascending=False).head(top_n).index
+    pivot_df = df[df['component_name'].isin(top)].pivot_table(index='filename', columns='component_name', values='count', fill_value=0)
+    pivot_df[pivot_df > 0] = 1
+    return pivot_df.corr()
+
+
+def render_notebook(df, modules):
+    # The counting cells of the analysis notebooks, run on a frame or on a cube.
+    results = [helper(df) for helper in (libraries_in_repos, libraries_in_files, modules_in_repos, modules_in_files, module_component_counts)]
+    for module in modules:
+        results += [component_in_files(df, module), component_counts(df, module)]
+        results += [helper(df, module, component_type) for component_type in ('function', 'class', 'attribute') for helper in (specific_component_type_in_files, specific_component_type_counts)]
+    return results
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the vectorized transform_df and shared-intermediate helpers of analysis_utils with the row-wise versions.")
+    parser.add_argument("--parquet_path", default="./data/py_component_counter_jupyter_repos.parquet", help="Flat component counts produced by src.main")
+    args = parser.parse_args()
+
+    raw = pd.read_parquet(args.parquet_path)
+    print(f"Rows: {len(raw)}")
+
+    rowwise_time, rowwise = timed(transform_df_rowwise, raw)
+    vectorized_time, vectorized = timed(transform_df, raw)
+    print(f"transform_df row-wise:   {rowwise_time:8.3f} s")
+    print(f"transform_df vectorized: {vectorized_time:8.3f} s  (x{rowwise_time / vectorized_time:.1f})")
+    # The row-wise version cuts the filename after the last occurrence of the repo name anywhere in the path
+    # (e.g. 'Absolut/scripts/...AbsolutPoseOutput.py' became 'PoseOutput.py'), so those rows differ.
+    print(f"Rows with the same repo: {(rowwise['repo'] == vectorized['repo']).mean():.2%}, same filename: {(rowwise['filename'] == vectorized['filename']).mean():.2%}")
+
+    regrouping_time, _ = timed(regrouping_helpers, vectorized)
+    start = time.perf_counter()
+    usage = module_usage(vectorized)
+    results = [helper(usage) for helper in (libraries_in_repos, libraries_in_files, modules_in_repos, modules_in_files)]
+    shared_time = time.perf_counter() - start
+    print(f"libraries_in_*/modules_in_* regrouping the frame:     {regrouping_time:8.3f} s")
+    print(f"libraries_in_*/modules_in_* sharing module_usage:     {shared_time:8.3f} s  (x{regrouping_time / shared_time:.1f})")
+    print(f"Helpers on the full frame equal the shared versions: {all(helper(vectorized).equals(result) for helper, result in zip((libraries_in_repos, libraries_in_files, modules_in_repos, modules_in_files), results))}")
+
+    for top_n in (24, 200):
+        dense_time, dense = timed(dense_corr_table, vectorized, top_n)
+        sparse_time, sparse_table = timed(get_corr_table, vectorized, 'filename', 'component_name', True, top_n)
+        print(f"get_corr_table top {top_n:4d}: dense pivot {dense_time:7.3f} s, sparse {sparse_time:7.3f} s  (same: {np.allclose(dense.values, sparse_table.values, equal_nan=True)})")
+    partners_time, partners = timed(top_partners, vectorized, 'filename', 'component_name', 10)
+    print(f"top_partners of all {partners['component_name'].nunique()} components: {partners_time:.3f} s")
+
+    modules = vectorized['module'].value_counts().index[:10]
+    with tempfile.TemporaryDirectory() as directory:
+        parquet_path = f"{directory}/counts.parquet"
+        raw.to_parquet(parquet_path)
+        frame_time, frame_results = timed(lambda: render_notebook(transform_df(pd.read_parquet(parquet_path)), modules))
+        build_time, _ = timed(cube_for, parquet_path)
+        cube_time, cube_results = timed(lambda: render_notebook(cube_for(parquet_path), modules))
+    same = all(np.array_equal(a.to_numpy(), b.to_numpy()) for a, b in zip(frame_results, cube_results))
+    print(f"Notebook counting cells from the parquet file: {frame_time:8.3f} s")
+    print(f"Building the cube (first render):              {build_time:8.3f} s")
+    print(f"Notebook counting cells from the cube:         {cube_time:8.3f} s  (x{frame_time / cube_time:.1f}, same: {same})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import os
+import io
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import statistics
+from contextlib import redirect_stdout
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+
+from benchmarks.synthetic_corpus import generate_corpus
+from src.utils import setup_logger, find_python_files, load_library_reference, convert_notebook_to_python
+from src.lib_elements_counter import process_file, process_files_in_parallel, concatenate_and_save
+from notebooks.analysis_utils import transform_df, build_cube, libraries_in_repos, modules_in_files, component_counts, get_corr_table, top_partners
+
+DEFAULT_BASELINE = "benchmarks/baseline.json"
+# Cases slower than their baseline by more than this fraction, and by more than MIN_REGRESSION_SECONDS, are regressions.
+DEFAULT_TOLERANCE = 0.25
+MIN_REGRESSION_SECONDS = 0.005
+CORPUS_SIZES = {
+    "small": {"n_repos": 20, "files_per_repo": 10, "notebooks_per_repo": 2, "huge_files": 1, "syntax_error_files": 5},
+    "default": {"n_repos": 50, "files_per_repo": 20, "notebooks_per_repo": 4, "huge_files": 3, "syntax_error_files": 20},
+    "large": {"n_repos": 200, "files_per_repo": 40, "notebooks_per_repo": 8, "huge_files": 10, "syntax_error_files": 80},
+}
+
+
+def measure(func: Callable[[], object], repeat: int) -> Dict[str, float]:
+    # Output printed by the measured functions (row counts...) would be mixed with the report.
+    seconds = []
+    for _ in range(repeat):
+        with redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            seconds.append(time.perf_counter() - start)
+    return {"best": min(seconds), "median": statistics.median(seconds)}
+
+
+def run_suite(corpus_directory: str, lib_dict: Dict, repeat: int = 3, workers: int = 2, cases: Optional[List[str]] = None) -> Dict[str, Dict[str, float]]:
+    """
+    Time the stages of the pipeline, from file discovery to the notebook helpers, on a corpus.
+
+    Parameters:
+    corpus_directory: Directory of the repositories (see synthetic_corpus.generate_corpus).
+    lib_dict: API reference used to count the components.
+    repeat: Number of runs of every case, the best and the median are reported.
+    workers: Number of workers of process_files_in_parallel.
+    cases: Names of the cases to run, None for all; the cases needing the output of a skipped one still run it once.
+
+    Returns:
+    A dictionary mapping the names of the cases to their best and median times in seconds.
+    """
+    logger = setup_logger()
+    results = {}
+
+    def run(name: str, func: Callable[[], object]):
+        if cases is None or name in cases:
+            results[name] = measure(func, repeat)
+            print(f"{name:40s} {results[name]['best']:9.4f} s")
+
+    code_files = sorted(find_python_files(corpus_directory, ".py"))
+    notebook_files = sorted(find_python_files(corpus_directory, ".ipynb"))
+    notebooks = []
+    for notebook_file in notebook_files:
+        with open(notebook_file, "r", encoding="utf-8") as f:
+            notebooks.append(f.read())
+
+    run("find_python_files", lambda: find_python_files(corpus_directory, ".py"))
+    run("find_python_files_notebooks", lambda: find_python_files(corpus_directory, (".py", ".ipynb")))
+    for mode in ("full", "imports"):
+        run(f"process_file_{mode}", lambda: [process_file(logger, lib_dict, code_file, mode) for code_file in code_files])
+    run("process_file_imports_lenient", lambda: [process_file(logger, lib_dict, code_file, "imports", lenient_imports=True) for code_file in code_files])
+    run("process_file_full_notebooks", lambda: [process_file(logger, lib_dict, notebook_file, "full") for notebook_file in notebook_files])
+    run("convert_notebook_to_python", lambda: [convert_notebook_to_python(notebook, logger) for notebook in notebooks])
+    run("process_files_in_parallel", lambda: list(process_files_in_parallel(process_file, lib_dict, code_files + notebook_files, logger, "full", workers=workers)))
+
+    with tempfile.TemporaryDirectory() as output_directory:
+        output_file = os.path.join(output_directory, "components.parquet")
+        with redirect_stdout(io.StringIO()):
+            counters = list(process_files_in_parallel(process_file, lib_dict, code_files + notebook_files, logger, "full", workers=workers))
+            concatenate_and_save(counters, output_file)
+        run("concatenate_and_save", lambda: concatenate_and_save(counters, output_file))
+        raw = pd.read_parquet(output_file)
+
+    df = transform_df(raw, root=corpus_directory)
+    run("transform_df", lambda: transform_df(raw, root=corpus_directory))
+    run("build_cube", lambda: build_cube(df))
+    run("count_helpers", lambda: (libraries_in_repos(df), modules_in_files(df), component_counts(df, "os")))
+    run("get_corr_table", lambda: get_corr_table(df))
+    run("top_partners", lambda: top_partners(df))
+    return results
+
+
+def compare_results(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """
+    Compare the best times of a run with those of a baseline.
+
+    Returns:
+    The names of the cases slower than their baseline by more than tolerance (a fraction) and MIN_REGRESSION_SECONDS.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name in baseline:
+            before, after = baseline[name]["best"], result["best"]
+            if after > before * (1 + tolerance) and after - before > MIN_REGRESSION_SECONDS:
+                regressions.append(name)
+    return regressions
+
+
+def environment() -> Dict[str, object]:
+    return {"python": platform.python_version(), "platform": platform.platform(), "machine": platform.machine(), "cpu_count": os.cpu_count(), "pandas": pd.__version__}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the pipeline stages on a deterministic synthetic corpus and compare them with a saved baseline.")
+    parser.add_argument("--library_pickle_path", default="./api_reference_pickles/standard_library.pickle", help="Path to the API reference pickle")
+    parser.add_argument("--size", default="default", choices=sorted(CORPUS_SIZES), help="Size of the synthetic corpus")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic corpus")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs of every case")
+    parser.add_argument("--workers", type=int, default=2, help="Number of workers of process_files_in_parallel")
+    parser.add_argument("--cases", nargs="+", default=None, help="Names of the cases to run, all by default")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="JSON baseline the run is compared with, if it exists")
+    parser.add_argument("--save_baseline", action="store_true", help="Save the run as the baseline instead of comparing it (merged into the existing baseline with --cases)")
+    parser.add_argument("--output", default=None, help="JSON file receiving the results of the run")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Slowdown, as a fraction of the baseline, reported as a regression")
+    args = parser.parse_args()
+
+    settings = {"size": args.size, "seed": args.seed, "workers": args.workers, "library_pickle_path": os.path.basename(args.library_pickle_path), **CORPUS_SIZES[args.size]}
+    lib_dict = load_library_reference(args.library_pickle_path)
+    with tempfile.TemporaryDirectory() as corpus_directory:
+        n_files = generate_corpus(corpus_directory, seed=args.seed, **CORPUS_SIZES[args.size])
+        print(f"Corpus: {n_files} files ({args.size}, seed {args.seed})")
+        results = run_suite(corpus_directory, lib_dict, args.repeat, args.workers, args.cases)
+
+    run = {"settings": settings, "environment": environment(), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(run, f, indent=2)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if args.save_baseline:
+        if baseline is not None and baseline["settings"] == settings and args.cases is not None:
+            run["results"] = {**baseline["results"], **results}
+        with open(args.baseline, "w") as f:
+            json.dump(run, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return
+    if baseline is None:
+        print(f"No baseline at {args.baseline}, save one with --save_baseline")
+        return
+    if baseline["settings"] != settings:
+        print(f"The baseline was run with other settings ({baseline['settings']}), not comparing")
+        return
+    if baseline["environment"] != run["environment"]:
+        print(f"Warning: the baseline was run in another environment ({baseline['environment']})")
+
+    print(f"{'case':40s} {'baseline':>9s} {'run':>9s} {'change':>8s}")
+    for name, result in results.items():
+        if name in baseline["results"]:
+            before = baseline["results"][name]["best"]
+            print(f"{name:40s} {before:9.4f} {result['best']:9.4f} {result['best'] / before - 1:+8.1%}")
+    regressions = compare_results(results, baseline["results"], args.tolerance)
+    if regressions:
+        print(f"Regressions (more than {args.tolerance:.0%} slower): {', '.join(regressions)}")
+        sys.exit(1)
+    print("No regression")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import os
+import time
+import logging
+import argparse
+import tempfile
+
+from benchmarks.synthetic_corpus import generate_corpus
+from src.utils import discover_files
+from src.corpus_archives import ARCHIVE_FORMATS, pack_repositories, find_archives
+from src.lib_elements_counter import process_file, process_files_in_parallel
+
+
+def drop_caches():
+    # Linux only, as root: the measured runs then read the corpus from the disk instead of the page cache.
+    os.sync()
+    with open("/proc/sys/vm/drop_caches", "w") as f:
+        f.write("3\n")
+
+
+def count_rows(code_files, **kwargs):
+    return sum(len(counter) for counter in process_files_in_parallel(process_file, {}, code_files, logging.getLogger("benchmark"), "imports", **kwargs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare an imports run over checked out repositories with one over the same repositories packed into corpus archives.")
+    parser.add_argument("--n_repos", type=int, default=400, help="Number of synthetic repositories")
+    parser.add_argument("--files_per_repo", type=int, default=50, help="Number of Python files per synthetic repository")
+    parser.add_argument("--repos_per_archive", type=int, default=25, help="Number of repositories per archive")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--directory", default=None, help="Directory for the corpus and the archives, on the disk to measure (a temporary directory by default)")
+    parser.add_argument("--drop_caches", action="store_true", help="Drop the page cache before each measured run (Linux, root only)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+        corpus_directory = os.path.join(directory, "repos")
+        n_files = generate_corpus(corpus_directory, args.n_repos, args.files_per_repo)
+        print(f"Corpus: {n_files} files in {args.n_repos} repositories")
+
+        if args.drop_caches:
+            drop_caches()
+        start = time.perf_counter()
+        file_info = discover_files(corpus_directory)
+        rows = count_rows(list(file_info), workers=args.workers, file_sizes={path: size for path, (size, _) in file_info.items()})
+        checkout_time = time.perf_counter() - start
+        print(f"checkouts:       {checkout_time:7.2f} s  {rows} rows")
+
+        for archive_format, suffix in ARCHIVE_FORMATS.items():
+            archive_directory = os.path.join(directory, suffix.strip("."))
+            start = time.perf_counter()
+            pack_repositories(corpus_directory, archive_directory, args.repos_per_archive, archive_format)
+            pack_time = time.perf_counter() - start
+            if args.drop_caches:
+                drop_caches()
+            start = time.perf_counter()
+            archive_sizes = find_archives(archive_directory)
+            rows = count_rows(list(archive_sizes), workers=args.workers, file_sizes=archive_sizes, archive_root=corpus_directory)
+            archive_time = time.perf_counter() - start
+            print(f"{archive_format + ' archives:':16s} {archive_time:7.2f} s  {rows} rows  ({len(archive_sizes)} archives, {sum(archive_sizes.values()) / 1e6:.1f} MB, packed in {pack_time:.2f} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import time
+import sysconfig
+import argparse
+
+from src.utils import setup_logger, find_python_files, load_library_reference
+from src.lib_elements_counter import process_file, init_worker, process_batch_in_worker
+
+
+def timed_batch(code_files, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        process_batch_in_worker(code_files)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cost of the per-stage instrumentation of the workers, off, on and with cProfile.")
+    parser.add_argument("--library_pickle_path", default="./api_reference_pickles/standard_library.pickle", help="Path to the API reference pickle")
+    parser.add_argument("--input_python_files_path", default=sysconfig.get_paths()["stdlib"], help="Path to the analysed files, defaults to the stdlib sources of the running interpreter")
+    parser.add_argument("--limit", type=int, default=500, help="Maximum number of files to process")
+    parser.add_argument("--repeats", type=int, default=3, help="Number of runs of each variant, the fastest one is reported")
+    args = parser.parse_args()
+
+    logger = setup_logger()
+    lib_dict = load_library_reference(args.library_pickle_path)
+    code_files = sorted(find_python_files(args.input_python_files_path, filetype=".py"))[:args.limit]
+    print(f"Files: {len(code_files)}")
+
+    results = {}
+    for name, slowest_files, profile in (("disabled", None, False), ("metrics", 20, False), ("profile", None, True)):
+        init_worker(process_file, lib_dict, logger, "full", slowest_files=slowest_files, profile=profile)
+        results[name] = timed_batch(code_files, args.repeats)
+        print(f"{name:10s} {results[name]:8.3f} s  ({results[name] / results['disabled'] - 1:+.1%})")
+
+
+if __name__ == "__main__":
+    main()
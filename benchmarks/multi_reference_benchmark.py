@@ -0,0 +1,46 @@
+import time
+import sysconfig
+import argparse
+from collections import Counter
+
+from src.utils import setup_logger, find_python_files, load_library_reference, reference_name, combine_library_references
+from src.lib_elements_counter import process_file
+
+
+def count_all(logger, lib_dict, code_files):
+    counter = Counter()
+    start = time.perf_counter()
+    for code_file in code_files:
+        counter.update(process_file(logger, lib_dict, code_file, "full"))
+    return time.perf_counter() - start, counter
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare one pass per reference with a single pass over several references combined.")
+    parser.add_argument("--library_pickle_path", nargs="+", default=["./api_reference_pickles/standard_library.pickle", "./api_reference_pickles/pandas.pickle"], help="Paths to the API reference pickles")
+    parser.add_argument("--input_python_files_path", default=sysconfig.get_paths()["stdlib"], help="Path to the analysed files, defaults to the stdlib sources of the running interpreter")
+    parser.add_argument("--limit", type=int, default=1000, help="Maximum number of files to process")
+    args = parser.parse_args()
+
+    logger = setup_logger()
+    references = {reference_name(path): load_library_reference(path) for path in args.library_pickle_path}
+    code_files = sorted(find_python_files(args.input_python_files_path, filetype=".py"))[:args.limit]
+    print(f"Files: {len(code_files)}, references: {', '.join(references)}")
+
+    sequential_time, sequential_counter = 0.0, Counter()
+    for name, lib_dict in references.items():
+        elapsed, counter = count_all(logger, lib_dict, code_files)
+        sequential_time += elapsed
+        sequential_counter.update(counter)
+        print(f"{name:20s} {elapsed:8.2f} s")
+
+    lib_dict, _ = combine_library_references(references)
+    combined_time, combined_counter = count_all(logger, lib_dict, code_files)
+    print(f"Sequential passes:   {sequential_time:8.2f} s")
+    print(f"Single pass:         {combined_time:8.2f} s  (saved {sequential_time - combined_time:.2f} s, {1 - combined_time / sequential_time:.0%})")
+    # A module shared by references is counted in each of their passes but once in the single pass, so only the rows are compared.
+    print(f"Same rows: {set(combined_counter) == set(sequential_counter)}")
+
+
+if __name__ == "__main__":
+    main()
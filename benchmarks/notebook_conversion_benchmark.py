@@ -0,0 +1,39 @@
+import ast
+import glob
+import time
+import argparse
+
+from src.lib_elements_counter import get_imported_modules
+from src.utils import extract_notebook_code, convert_notebook_with_nbconvert
+
+
+def time_conversion(convert, notebooks, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        scripts = [convert(notebook_json) for notebook_json in notebooks]
+    return (time.perf_counter() - start) / repeat, scripts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare notebook-to-Python conversion with extract_notebook_code and nbconvert.")
+    parser.add_argument("--notebooks_glob", default="./notebooks/**/*.ipynb", help="Glob pattern of the notebooks to convert")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of timed repetitions")
+    args = parser.parse_args()
+
+    notebooks = []
+    for path in sorted(glob.glob(args.notebooks_glob, recursive=True)):
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            notebooks.append(f.read())
+    print(f"Notebooks: {len(notebooks)} ({sum(map(len, notebooks)) / 1e6:.1f} MB)")
+
+    fast_time, fast_scripts = time_conversion(lambda notebook_json: extract_notebook_code(notebook_json)[0], notebooks, args.repeat)
+    nbconvert_time, nbconvert_scripts = time_conversion(convert_notebook_with_nbconvert, notebooks, args.repeat)
+    print(f"extract_notebook_code: {fast_time * 1000:8.1f} ms")
+    print(f"nbconvert:             {nbconvert_time * 1000:8.1f} ms  (x{nbconvert_time / fast_time:.1f})")
+
+    same_imports = sum(get_imported_modules(ast.parse(fast)) == get_imported_modules(ast.parse(slow)) for fast, slow in zip(fast_scripts, nbconvert_scripts))
+    print(f"Notebooks with identical imports: {same_imports}/{len(notebooks)}")
+
+
+if __name__ == "__main__":
+    main()
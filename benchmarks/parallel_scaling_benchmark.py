@@ -0,0 +1,40 @@
+import os
+import time
+import argparse
+import tempfile
+
+from benchmarks.synthetic_corpus import generate_corpus
+from src.utils import DEFAULT_CHUNK_BYTES, setup_logger, find_python_files, load_library_reference
+from src.lib_elements_counter import process_file, process_files_in_parallel
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure throughput of process_files_in_parallel for 1..N workers on a synthetic corpus.")
+    parser.add_argument("--library_pickle_path", default="./api_reference_pickles/standard_library.pickle", help="Path to the pickle file containing API reference")
+    parser.add_argument("--max_workers", type=int, default=os.cpu_count(), help="Largest number of workers to measure")
+    parser.add_argument("--chunk_bytes", "--chunk-bytes", type=int, default=DEFAULT_CHUNK_BYTES, help="Target total size in bytes of one task")
+    parser.add_argument("--n_repos", type=int, default=50, help="Number of synthetic repositories")
+    parser.add_argument("--files_per_repo", type=int, default=20, help="Number of Python files per synthetic repository")
+    parser.add_argument("--mode", default="full", choices=["full", "imports", "both"], help="Mode of operation passed to process_file")
+    args = parser.parse_args()
+
+    logger = setup_logger()
+    lib_dict = load_library_reference(args.library_pickle_path)
+
+    with tempfile.TemporaryDirectory() as corpus_directory:
+        generate_corpus(corpus_directory, args.n_repos, args.files_per_repo)
+        code_files = find_python_files(corpus_directory)
+
+        workers_to_measure = sorted({1, 2, 4, 8, 16, 32, args.max_workers} & set(range(1, args.max_workers + 1)))
+        single_worker_rate = None
+        for workers in workers_to_measure:
+            start = time.perf_counter()
+            for _ in process_files_in_parallel(process_file, lib_dict, code_files, logger, args.mode, workers=workers, chunk_bytes=args.chunk_bytes):
+                pass
+            rate = len(code_files) / (time.perf_counter() - start)
+            single_worker_rate = single_worker_rate or rate
+            print(f"workers={workers:3d}  {rate:8.1f} files/sec  speedup x{rate / single_worker_rate:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import time
+import sysconfig
+import argparse
+
+from src.utils import setup_logger, find_python_files, load_library_reference
+from src.lib_elements_counter import process_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure single-process throughput of process_file (files/sec).")
+    parser.add_argument("--library_pickle_path", default="./api_reference_pickles/standard_library.pickle", help="Path to the pickle file containing API reference")
+    parser.add_argument("--input_python_files_path", default=sysconfig.get_paths()["stdlib"], help="Path to the analysed files, defaults to the stdlib sources of the running interpreter")
+    parser.add_argument("--mode", default="full", choices=["full", "imports", "both"], help="Mode of operation passed to process_file")
+    parser.add_argument("--lenient_imports", action="store_true", help="Passed to process_file, finds imports without parsing whole files in 'imports' mode")
+    parser.add_argument("--limit", type=int, default=300, help="Maximum number of files to process")
+    args = parser.parse_args()
+
+    logger = setup_logger()
+    lib_dict = load_library_reference(args.library_pickle_path)
+    code_files = sorted(find_python_files(args.input_python_files_path, filetype=".py"))[:args.limit]
+    total_bytes = 0
+    for code_file in code_files:
+        with open(code_file, "rb") as f:
+            total_bytes += len(f.read())
+
+    start = time.perf_counter()
+    for code_file in code_files:
+        process_file(logger, lib_dict, code_file, args.mode, lenient_imports=args.lenient_imports)
+    elapsed = time.perf_counter() - start
+
+    print(f"Files: {len(code_files)} ({total_bytes / 1e6:.1f} MB), mode: {args.mode}{', lenient imports' if args.lenient_imports else ''}")
+    print(f"Elapsed: {elapsed:.2f} s, throughput: {len(code_files) / elapsed:.1f} files/sec")
+
+
+if __name__ == "__main__":
+    main()
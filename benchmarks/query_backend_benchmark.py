@@ -0,0 +1,59 @@
+import time
+import argparse
+import resource
+import tempfile
+import multiprocessing
+
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import pandas as pd
+
+from src.partitioned import partition_tables
+from notebooks.analysis_utils import PartitionedDataset, transform_df, modules_in_repos, component_counts, specific_component_type_in_files
+
+
+def write_scaled_copy(parquet_path, output_file, root, scale):
+    # Repeats the rows of the output under renamed repositories, to see how memory grows with the dataset.
+    table = pq.read_table(parquet_path)
+    with pq.ParquetWriter(output_file, table.schema) as writer:
+        for copy in range(scale):
+            filenames = pc.replace_substring_regex(table.column("filename"), r"^(?:/[^/]*){4}/([^/]+)/", rf"{root}/copy{copy}_\1/")
+            writer.write_table(table.set_column(table.schema.get_field_index("filename"), "filename", filenames))
+
+
+def run_queries(backend, source, root, module, results):
+    start = time.perf_counter()
+    df = transform_df(pd.read_parquet(source), root=root) if backend == "pandas" else PartitionedDataset(source)
+    tables = [modules_in_repos(df), component_counts(df, module), specific_component_type_in_files(df, module, "function")]
+    results.put((backend, time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, [table.to_numpy().tolist() for table in tables]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the pandas helpers of analysis_utils on a flat output with the DuckDB queries on a partitioned dataset.")
+    parser.add_argument("--parquet_path", default="./data/py_component_counter_jupyter_repos.parquet", help="Flat component counts produced by src.main")
+    parser.add_argument("--module", default="os", help="Module queried by the per-module helpers")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 4], help="Numbers of copies of the output making up the measured datasets")
+    args = parser.parse_args()
+
+    root = "/corpus"
+    for scale in args.scales:
+        with tempfile.TemporaryDirectory() as directory:
+            flat_path = f"{directory}/counts.parquet"
+            write_scaled_copy(args.parquet_path, flat_path, root, scale)
+            partition_tables({"components": flat_path}, f"{directory}/partitioned", root)
+            measured = {}
+            for backend, source in (("pandas", flat_path), ("duckdb", f"{directory}/partitioned")):
+                # Each backend runs in a fresh process, so its peak memory is not hidden by the other one.
+                results = multiprocessing.get_context("spawn").Queue()
+                process = multiprocessing.get_context("spawn").Process(target=run_queries, args=(backend, source, root, args.module, results))
+                process.start()
+                measured[backend] = results.get()
+                process.join()
+            print(f"{pq.ParquetFile(flat_path).metadata.num_rows} rows:")
+            for backend, elapsed, peak_mb, _ in measured.values():
+                print(f"  {backend:7s} {elapsed:7.2f} s, peak memory {peak_mb:7.1f} MB")
+            print(f"  Same results: {measured['pandas'][3] == measured['duckdb'][3]}")
+
+
+if __name__ == "__main__":
+    main()
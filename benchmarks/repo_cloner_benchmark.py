@@ -0,0 +1,76 @@
+import os
+import time
+import pickle
+import random
+import argparse
+import tempfile
+import subprocess
+
+from src.repo_acquisition.repo_cloner import KEPT_SUFFIXES, clone_repos
+
+
+def git(*args, cwd=None):
+    subprocess.run(["git", "-c", "user.name=benchmark", "-c", "user.email=benchmark@example.com", *args], cwd=cwd, check=True, capture_output=True)
+
+
+def make_repo(work_directory, bare_directory, rng, n_commits, asset_bytes):
+    # A repository with some history, a few Python files and binary assets rewritten in every commit.
+    os.makedirs(os.path.join(work_directory, "assets"))
+    git("init", "--quiet", cwd=work_directory)
+    for commit in range(n_commits):
+        for i in range(20):
+            with open(os.path.join(work_directory, f"module_{i}.py"), "w") as f:
+                f.write(f"import os\n\nVALUE = {commit}\n" * 50)
+        with open(os.path.join(work_directory, "assets", "data.bin"), "wb") as f:
+            f.write(rng.randbytes(asset_bytes))
+        git("add", "--all", cwd=work_directory)
+        git("commit", "--quiet", "-m", f"commit {commit}", cwd=work_directory)
+    git("clone", "--quiet", "--bare", work_directory, bare_directory)
+    git("config", "uploadpack.allowFilter", "true", cwd=bare_directory)
+
+
+def clone_sequentially(repos, base_url, directory):
+    # The previous cloner: a full clone per repository, then every other file is deleted.
+    for repo in repos:
+        repo_dir = f"{directory}/{repo.split('/')[-1]}"
+        subprocess.run(["git", "clone", "--quiet", f"{base_url}/{repo}.git", repo_dir], check=True, capture_output=True)
+        for root, _, files in os.walk(repo_dir):
+            for file in files:
+                if not file.endswith(KEPT_SUFFIXES):
+                    os.remove(os.path.join(root, file))
+
+
+def directory_bytes(directory):
+    return sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(directory) for file in files)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare sequential full clones with the concurrent shallow, filtered and sparse clones of repo_cloner on local bare repositories.")
+    parser.add_argument("--n_repos", type=int, default=16, help="Number of repositories")
+    parser.add_argument("--n_commits", type=int, default=10, help="Number of commits per repository")
+    parser.add_argument("--asset_kb", type=int, default=500, help="Size of the binary asset rewritten in each commit")
+    parser.add_argument("--workers", type=int, default=8, help="Number of concurrent clones")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        repos = [f"owner/repo{i}" for i in range(args.n_repos)]
+        for repo in repos:
+            make_repo(f"{directory}/work/{repo}", f"{directory}/bare/{repo}.git", rng, args.n_commits, args.asset_kb * 1024)
+        with open(f"{directory}/repos.pickle", "wb") as f:
+            pickle.dump(repos, f)
+        base_url = f"file://{directory}/bare"
+
+        start = time.perf_counter()
+        clone_sequentially(repos, base_url, f"{directory}/sequential")
+        sequential_time = time.perf_counter() - start
+        start = time.perf_counter()
+        clone_repos(f"{directory}/repos.pickle", f"{directory}/concurrent", args.workers, base_url, f"{directory}/repo_files.pickle")
+        concurrent_time = time.perf_counter() - start
+
+        print(f"Sequential full clones: {sequential_time:7.2f} s, {directory_bytes(f'{directory}/sequential') / 2**20:7.1f} MB left on disk")
+        print(f"Concurrent filtered:    {concurrent_time:7.2f} s, {directory_bytes(f'{directory}/concurrent') / 2**20:7.1f} MB left on disk (x{sequential_time / concurrent_time:.1f})")
+
+
+if __name__ == "__main__":
+    main()
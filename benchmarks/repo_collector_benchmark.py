@@ -0,0 +1,59 @@
+import time
+import random
+import asyncio
+import argparse
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+from src.repo_acquisition.repo_collector import PER_PAGE, collect_repositories, repo_record
+from tests.github_mock_server import MockGitHub, fake_repo
+
+
+def collect_per_day(api_url, start, days, delay):
+    # The previous collector: one request per day with a new client each time and a fixed delay, without pagination.
+    repos = {}
+    for day in range(days):
+        date = start + timedelta(days=day)
+        with httpx.Client() as client:
+            response = client.get(f"{api_url}/search/repositories", params={"q": f"stars:>50 created:{date:%Y-%m-%d}", "sort": "stars", "order": "desc", "per_page": PER_PAGE})
+            repos.update({repo["id"]: repo_record(repo) for repo in response.json()["items"]})
+        time.sleep(delay)
+    return repos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the per-day serial collection with the concurrent collector against a local mock of the search API.")
+    parser.add_argument("--years", type=int, default=4, help="Number of years collected")
+    parser.add_argument("--repos_per_day", type=float, default=20, help="Average number of matching repositories created per day")
+    parser.add_argument("--latency", type=float, default=0.05, help="Response time of the mock server in seconds")
+    parser.add_argument("--delay", type=float, default=2.0, help="Fixed delay after each request of the per-day collection")
+    parser.add_argument("--serial_days", type=int, default=30, help="Number of days timed for the per-day collection, extrapolated to the whole range")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    days = 365 * args.years
+    # A few viral days exceed the search cap, the per-day collection misses results above the first page on many days.
+    n_repos = int(days * args.repos_per_day)
+    repos = [fake_repo(i, start + timedelta(seconds=rng.randrange(days * 86400)), stars=rng.randrange(50, 5000)) for i in range(n_repos)]
+    repos += [fake_repo(n_repos + i, start + timedelta(days=100, seconds=rng.randrange(86400))) for i in range(1500)]
+
+    with MockGitHub(repos, latency=args.latency) as mock:
+        serial_start = time.perf_counter()
+        serial = collect_per_day(mock.url, start, args.serial_days, args.delay)
+        serial_time = (time.perf_counter() - serial_start) * days / args.serial_days
+        n_serial_requests = len(mock.requests)
+        mock.requests.clear()
+
+        concurrent_start = time.perf_counter()
+        collected = asyncio.run(collect_repositories(start, start + timedelta(days=days), None, "stars:>50", api_url=mock.url))
+        concurrent_time = time.perf_counter() - concurrent_start
+
+    print(f"Repositories: {len(repos)}")
+    print(f"Per-day serial:  ~{serial_time:8.1f} s (extrapolated from {n_serial_requests} requests over {args.serial_days} days), {len(serial)} repositories in those days")
+    print(f"Concurrent:       {concurrent_time:8.1f} s, {len(mock.requests)} requests, {len(collected)} repositories (x{serial_time / concurrent_time:.0f})")
+
+
+if __name__ == "__main__":
+    main()
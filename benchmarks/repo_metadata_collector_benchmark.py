@@ -0,0 +1,38 @@
+import time
+import asyncio
+import argparse
+from datetime import datetime, timezone
+
+from src.repo_acquisition.repo_metadata_collector import collect_metadata
+from tests.github_mock_server import MockGitHub, fake_repo
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare one request per repository with batched GraphQL collection against a local mock of the API.")
+    parser.add_argument("--n_repos", type=int, default=20000, help="Number of repositories")
+    parser.add_argument("--latency", type=float, default=0.2, help="Response time of the mock server in seconds")
+    parser.add_argument("--delay", type=float, default=2.0, help="Fixed delay after each request of the per-repository collection")
+    parser.add_argument("--serial_repos", type=int, default=20, help="Number of repositories timed one request at a time, extrapolated to all")
+    args = parser.parse_args()
+
+    repos = [fake_repo(i, datetime(2021, 1, 1, tzinfo=timezone.utc)) for i in range(args.n_repos)]
+    names = [repo["full_name"] for repo in repos]
+    with MockGitHub(repos, latency=args.latency) as mock:
+        # One repository per request, one request at a time, as the previous collector did.
+        start = time.perf_counter()
+        for name in names[:args.serial_repos]:
+            asyncio.run(collect_metadata([name], "token", api_url=mock.url, batch_size=1, concurrency=1))
+            time.sleep(args.delay)
+        serial_time = (time.perf_counter() - start) * args.n_repos / args.serial_repos
+        mock.requests.clear()
+
+        start = time.perf_counter()
+        collected = asyncio.run(collect_metadata(names, "token", api_url=mock.url))
+        batched_time = time.perf_counter() - start
+
+    print(f"One request per repository: ~{serial_time:9.1f} s (extrapolated from {args.serial_repos} repositories)")
+    print(f"Batched GraphQL:             {batched_time:9.1f} s, {len(mock.requests)} requests, {len(collected)} repositories (x{serial_time / batched_time:.0f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import os
+import json
+import random
+import argparse
+
+
+IMPORTS = [
+    "import os", "import re", "import sys", "import json", "import math", "import time", "import random",
+    "import logging", "import collections", "from os import path, listdir", "from collections import defaultdict, Counter",
+    "from json import loads, dumps, JSONDecodeError", "from math import sqrt, floor", "import numpy as np", "import pandas as pd",
+]
+
+STATEMENTS = [
+    "files = os.listdir(os.getcwd())",
+    "full_path = os.path.join(path.dirname(__file__), name)",
+    "pattern = re.compile(r'[a-z]+')",
+    "matches = re.findall(r'\\d+', text)",
+    "data = json.loads(raw)",
+    "raw = dumps(data, indent=2)",
+    "value = math.sqrt(x) + sqrt(y) + math.pi",
+    "counts = Counter(words)",
+    "groups = defaultdict(list)",
+    "logger = logging.getLogger(__name__)",
+    "logger.info('processing %s', name)",
+    "items.append(random.choice(values))",
+    "start = time.time()",
+    "sys.stdout.write(line)",
+    "frame = pd.DataFrame(rows)",
+    "array = np.zeros(10)",
+]
+
+
+def generate_python_file(rng: random.Random, n_functions: int) -> str:
+    lines = rng.sample(IMPORTS, rng.randint(1, 6)) + [""]
+    for i in range(n_functions):
+        lines.append(f"def function_{i}(name, text, raw, data, x, y, words, items, values, line, rows):")
+        lines.append("    try:")
+        lines.extend(f"        {statement}" for statement in rng.choices(STATEMENTS, k=rng.randint(2, 8)))
+        lines.append("    except JSONDecodeError:")
+        lines.append("        raise ValueError(name)")
+        lines.append("    return name")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def generate_notebook(rng: random.Random, n_cells: int) -> str:
+    # nbformat 4 notebook alternating markdown and code cells, with the IPython-only lines converted by extract_notebook_code.
+    cells = [{"cell_type": "code", "metadata": {}, "execution_count": None, "outputs": [], "source": [f"{line}\n" for line in rng.sample(IMPORTS, rng.randint(1, 6))] + ["%matplotlib inline"]}]
+    for i in range(n_cells):
+        cells.append({"cell_type": "markdown", "metadata": {}, "source": [f"## Step {i}"]})
+        source = [f"{statement}\n" for statement in rng.choices(STATEMENTS, k=rng.randint(2, 8))]
+        if rng.random() < 0.2:
+            source.insert(0, "!pip install requests\n")
+        cells.append({"cell_type": "code", "metadata": {}, "execution_count": i + 1, "outputs": [], "source": source})
+    return json.dumps({"cells": cells, "metadata": {"language_info": {"name": "python"}}, "nbformat": 4, "nbformat_minor": 5}, indent=1)
+
+
+def _write_file(root_directory: str, repo: int, path: str, content: str) -> None:
+    file_path = os.path.join(root_directory, f"repo_{repo:04d}", path)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "w") as f:
+        f.write(content)
+
+
+def generate_corpus(root_directory: str, n_repos: int = 50, files_per_repo: int = 20, seed: int = 0, notebooks_per_repo: int = 0, huge_files: int = 0, syntax_error_files: int = 0) -> int:
+    """
+    Write a deterministic synthetic corpus of repositories with Python files into root_directory.
+
+    The Python files of the repositories are the same whatever the other kinds of files requested, those are drawn
+    from their own random generator and spread over the repositories.
+
+    Parameters:
+    root_directory: Directory in which one subdirectory per repository is created.
+    n_repos: Number of repositories.
+    files_per_repo: Number of Python files per repository.
+    seed: Seed of the random generator, the same seed always gives the same corpus.
+    notebooks_per_repo: Number of Jupyter notebooks per repository.
+    huge_files: Number of Python files of a few thousand functions (about 1.5 MB).
+    syntax_error_files: Number of Python files that fail to parse.
+
+    Returns:
+    The number of generated files.
+    """
+    rng = random.Random(seed)
+    n_files = 0
+    for repo in range(n_repos):
+        for file in range(files_per_repo):
+            directory = os.path.join(root_directory, f"repo_{repo:04d}", f"package_{file % 3}")
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, f"module_{file:04d}.py"), "w") as f:
+                f.write(generate_python_file(rng, rng.choice((1, 2, 5, 10, 40))))
+            n_files += 1
+
+    rng = random.Random(f"{seed}-extra")
+    for repo in range(n_repos):
+        for notebook in range(notebooks_per_repo):
+            _write_file(root_directory, repo, f"notebooks/notebook_{notebook:04d}.ipynb", generate_notebook(rng, rng.choice((2, 5, 10, 30))))
+    for file in range(huge_files):
+        _write_file(root_directory, file % n_repos, f"huge/huge_{file:04d}.py", generate_python_file(rng, 4000))
+    for file in range(syntax_error_files):
+        _write_file(root_directory, file % n_repos, f"broken/broken_{file:04d}.py", generate_python_file(rng, 2) + "\ndef broken(:\n    pass\n")
+    return n_files + n_repos * notebooks_per_repo + huge_files + syntax_error_files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic corpus of repositories.")
+    parser.add_argument("output_directory", help="Directory for the generated repositories")
+    parser.add_argument("--n_repos", type=int, default=50, help="Number of repositories")
+    parser.add_argument("--files_per_repo", type=int, default=20, help="Number of Python files per repository")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator")
+    parser.add_argument("--notebooks_per_repo", type=int, default=0, help="Number of Jupyter notebooks per synthetic repository")
+    parser.add_argument("--huge_files", type=int, default=0, help="Number of Python files of about 1.5 MB")
+    parser.add_argument("--syntax_error_files", type=int, default=0, help="Number of Python files that fail to parse")
+    args = parser.parse_args()
+
+    n_files = generate_corpus(args.output_directory, args.n_repos, args.files_per_repo, args.seed, args.notebooks_per_repo, args.huge_files, args.syntax_error_files)
+    print(f"Generated {n_files} files in {args.output_directory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,10 @@
+import os
+import re
+
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import seaborn as sns
 import matplotlib.pyplot as plt
 from matplotlib.colors import LinearSegmentedColormap
@@ -18,54 +23,231 @@ COLOR_MAP = {
 }
 
 
-def transform_df(df, imports_only=False):
+def map_distinct(series, func):
+    # Applies a vectorized string function once per distinct value and broadcasts the result back to the rows.
+    codes, uniques = pd.factorize(series)
+    return func(pd.Series(uniques)).take(codes).set_axis(series.index)
+
+
+def transform_df(df, imports_only=False, root=None):
+    # Splits the absolute filenames into the repository (the directory below root) and the path inside it.
+    # Without root, repositories are expected at the depth of /media/<user>/<disk>/<corpus>/<repo>.
     df = df.copy()
-    df['repo'] = df['filename'].str.split('/').str[5]
-    df['filename'] = df.apply(lambda row: row['filename'].split(row['repo'])[-1], axis=1).str[1:]
+    if 'repo' not in df.columns:
+        pattern = r'^(?:/[^/]*){4}/([^/]+)/(.*)$' if root is None else '^' + re.escape(root.rstrip('/')) + r'/([^/]+)/(.*)$'
+        parts = map_distinct(df['filename'], lambda filenames: filenames.str.extract(pattern))
+        df['repo'], df['filename'] = parts[0], parts[1]
     if imports_only:
         df = df[['repo', 'filename', 'module']]
     else:
         df = df[['repo', 'filename', 'module', 'component_type', 'component_name', 'count']]
-    df['library'] = df['module'].str.split('.').str[0]
+    df['library'] = map_distinct(df['module'], lambda modules: modules.str.split('.').str[0])
     return df
 
 
+def load_normalized(directory, table='components'):
+    # Reads a dataset written by src.normalize_output (or src.main --normalized_directory) into the frame transform_df returns,
+    # with categorical columns built from the integer ids, so no string is materialized per row.
+    repos = pq.read_table(os.path.join(directory, 'repos.parquet'))
+    files = pq.read_table(os.path.join(directory, 'files.parquet'))
+    facts = pq.read_table(os.path.join(directory, f'{table}.parquet'))
+    file_id = facts.column('file_id').combine_chunks()
+    paths = files.column('path').combine_chunks().dictionary_encode()
+    facts = facts.drop_columns(['file_id'])
+    facts = facts.add_column(0, 'repo', pa.DictionaryArray.from_arrays(files.column('repo_id').combine_chunks().take(file_id), repos.column('repo').combine_chunks()))
+    facts = facts.add_column(1, 'filename', pa.DictionaryArray.from_arrays(paths.indices.take(file_id), paths.dictionary))
+    df = facts.to_pandas()
+    for column in df.select_dtypes('category'):
+        df[column] = df[column].cat.reorder_categories(df[column].cat.categories.sort_values())
+
+    libraries = df['module'].cat.categories.str.split('.').str[0]
+    library_categories = pd.Index(libraries.unique())
+    df['library'] = pd.Categorical.from_codes(library_categories.get_indexer(libraries)[df['module'].cat.codes], library_categories)
+    return df
+
+
+def module_usage(df):
+    # Distinct (library, module, repo, filename) rows with categorical columns. The libraries_in_* and modules_in_* helpers
+    # accept it in place of the full frame, so it can be computed once and shared by all of them.
+    usage = df[['library', 'module', 'repo', 'filename']]
+    usage = usage.astype({column: 'category' for column in usage.columns if not isinstance(usage[column].dtype, pd.CategoricalDtype)})
+    return usage.drop_duplicates()
+
+
+class AggregateCube:
+    # Aggregates of a transformed frame, small enough to load in a moment, accepted by the counting helpers in place of the frame:
+    # - components: module, component_type, component_name, count (total uses), files and repos (distinct ones using it),
+    # - modules: library, module, files, repos,
+    # - libraries: library, files, repos.
+    # Files are counted by their filename column, as the helpers do on the frame. Frames without components (imports) have no components table.
+    # modules is written last, its file marks a complete cube.
+    TABLES = ('components', 'libraries', 'modules')
+
+    def __init__(self, components, libraries, modules):
+        self.components = components
+        self.modules = modules
+        self.libraries = libraries
+
+
+def build_cube(df):
+    usage = module_usage(df)
+    distinct_counts = []
+    for keys in (['library', 'module'], ['library']):
+        files = usage[keys + ['filename']].dropna().drop_duplicates().groupby(keys, observed=True).size().rename('files')
+        repos = usage[keys + ['repo']].dropna().drop_duplicates().groupby(keys, observed=True).size().rename('repos')
+        distinct_counts.append(pd.concat([files, repos], axis=1).fillna(0).astype('int64').reset_index())
+    modules, libraries = distinct_counts
+    components = None
+    if 'component_type' in df.columns:
+        grouped = df.groupby(['module', 'component_type', 'component_name'], observed=True)
+        components = pd.DataFrame({'count': grouped['count'].sum().astype('int64'), 'files': grouped['filename'].nunique(), 'repos': grouped['repo'].nunique()}).reset_index()
+    tables = [components, libraries, modules]
+    for table in tables:
+        if table is not None:
+            for column in table.select_dtypes(exclude='number'):
+                table[column] = table[column].astype(str)
+    return AggregateCube(*tables)
+
+
+def save_cube(cube, directory):
+    os.makedirs(directory, exist_ok=True)
+    for table in AggregateCube.TABLES:
+        path = os.path.join(directory, f'{table}.parquet')
+        if getattr(cube, table) is not None:
+            getattr(cube, table).to_parquet(path, index=False)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+def load_cube(directory):
+    paths = [os.path.join(directory, f'{table}.parquet') for table in AggregateCube.TABLES]
+    return AggregateCube(*(pd.read_parquet(path) if os.path.exists(path) else None for path in paths))
+
+
+def cube_for(path, imports_only=False, root=None, table='components'):
+    # Loads the cube of a counter output (a flat parquet file or a normalized dataset directory), building it on the first call
+    # and whenever the output is newer than the cube, so re-rendering a notebook reads only the aggregates.
+    cube_directory = os.path.join(path, f'cube.{table}') if os.path.isdir(path) else f"{path.removesuffix('.parquet')}.cube"
+    marker = os.path.join(cube_directory, 'modules.parquet')
+    sources = [os.path.join(path, name) for name in ('repos.parquet', 'files.parquet', f'{table}.parquet')] if os.path.isdir(path) else [path]
+    if os.path.exists(marker) and os.path.getmtime(marker) >= max(os.path.getmtime(source) for source in sources):
+        return load_cube(cube_directory)
+    df = load_normalized(path, table) if os.path.isdir(path) else transform_df(pd.read_parquet(path), imports_only, root)
+    cube = build_cube(df)
+    save_cube(cube, cube_directory)
+    return cube
+
+
+class PartitionedDataset:
+    # A table of the hive-partitioned datasets written by src.partition_output (or src.main --partitioned_directory), accepted by the
+    # counting helpers in place of the frame. They run as DuckDB queries reading only the needed columns, and the partitions and row
+    # groups of the requested module, so memory follows the size of the query rather than of the dataset.
+    VALUES = {'count': 'CAST(sum("count") AS BIGINT)', 'filename': 'count(DISTINCT filename)', 'repo': 'count(DISTINCT repo)'}
+
+    def __init__(self, directory, table='components'):
+        directory = os.path.join(directory, table)
+        partitions = {name.partition('=')[0] for name in os.listdir(directory) if '=' in name}
+        if len(partitions) != 1:
+            raise ValueError(f'{directory} is not a dataset partitioned by a single column')
+        self.partition_by = partitions.pop()
+        # Imported here, so the notebooks that don't query partitioned datasets don't need DuckDB.
+        import duckdb
+        self.source = f"read_parquet('{os.path.join(directory, '**', '*.parquet')}', hive_partitioning = true, hive_types_autocast = false)"
+        self.connection = duckdb.connect()
+        self.connection.execute('SET enable_progress_bar = false')
+
+    def aggregate(self, keys, value, module=None, component_type=None):
+        # Aggregates the value ('count', or 'filename' and 'repo' for distinct counts) by the keys, sorted by the keys as groupby does.
+        library = 'library' if self.partition_by == 'library' else "split_part(module, '.', 1)"
+        conditions, parameters = [], []
+        if module is not None:
+            conditions.append('module = ?')
+            parameters.append(module)
+            if self.partition_by == 'library':
+                conditions.append('library = ?')
+                parameters.append(module.split('.')[0])
+        if component_type is not None:
+            conditions.append('component_type = ?')
+            parameters.append(component_type)
+        columns = ', '.join(f'{library} AS library' if key == 'library' else key for key in keys)
+        query = f"SELECT {columns}, {self.VALUES[value]} AS count FROM {self.source}"
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += f" GROUP BY ALL ORDER BY {', '.join(keys)}"
+        return self.connection.execute(query, parameters).fetchdf()
+
+
+def count_distinct(df, by, of):
+    if isinstance(df, PartitionedDataset):
+        return df.aggregate([by], of)
+    if isinstance(df, AggregateCube):
+        table = df.modules if by == 'module' else df.libraries
+        return pd.DataFrame({by: table[by].to_numpy(), 'count': table['repos' if of == 'repo' else 'files'].to_numpy()})
+    pairs = module_usage(df)[[by, of]].dropna().drop_duplicates()
+    counts = pairs.groupby(by, observed=True).size()
+    return pd.DataFrame({by: counts.index.astype(str), 'count': counts.to_numpy()})
+
+
 def libraries_in_repos(df):
-    df = df.drop(['module'], axis=1).drop_duplicates()
-    return df.groupby('library')['repo'].nunique().reset_index().rename(columns={'repo': 'count'})
+    return count_distinct(df, 'library', 'repo')
 
 
 def libraries_in_files(df):
-    df = df.drop(['module'], axis=1).drop_duplicates()
-    return df.groupby('library')['filename'].nunique().reset_index().rename(columns={'filename': 'count'})
+    return count_distinct(df, 'library', 'filename')
 
 
 def modules_in_repos(df):
-    return df.groupby('module')['repo'].nunique().reset_index().rename(columns={'repo': 'count'})
+    return count_distinct(df, 'module', 'repo')
 
 
 def modules_in_files(df):
-    return df.groupby('module')['filename'].nunique().reset_index().rename(columns={'filename': 'count'})
+    return count_distinct(df, 'module', 'filename')
+
+
+def cube_components(cube, module, component_type=None, value='count'):
+    components = cube.components[(cube.components['module'] == module) & ((cube.components['component_type'] == component_type) if component_type else True)]
+    columns = ['component_name'] if component_type else ['component_type', 'component_name']
+    return components[columns + [value]].rename(columns={value: 'count'}).reset_index(drop=True)
 
 
 def module_component_counts(df):
-    return df.groupby(['module', 'component_type'])['count'].sum().reset_index()
+    if isinstance(df, PartitionedDataset):
+        return df.aggregate(['module', 'component_type'], 'count')
+    if isinstance(df, AggregateCube):
+        return df.components.groupby(['module', 'component_type'])['count'].sum().reset_index()
+    return df.groupby(['module', 'component_type'], observed=True)['count'].sum().reset_index()
 
 
 def component_in_files(df, module):
-    return df[df['module'] == module].groupby(['component_type', 'component_name'])['filename'].nunique().reset_index().rename(columns={'filename': 'count'})
+    if isinstance(df, PartitionedDataset):
+        return df.aggregate(['component_type', 'component_name'], 'filename', module)
+    if isinstance(df, AggregateCube):
+        return cube_components(df, module, value='files')
+    return df[df['module'] == module].groupby(['component_type', 'component_name'], observed=True)['filename'].nunique().reset_index().rename(columns={'filename': 'count'})
 
 
 def component_counts(df, module):
-    return df[df['module'] == module].groupby(['component_type', 'component_name'])['count'].sum().reset_index()
+    if isinstance(df, PartitionedDataset):
+        return df.aggregate(['component_type', 'component_name'], 'count', module)
+    if isinstance(df, AggregateCube):
+        return cube_components(df, module)
+    return df[df['module'] == module].groupby(['component_type', 'component_name'], observed=True)['count'].sum().reset_index()
 
 
 def specific_component_type_in_files(df, module, component_type):
-    return df[(df['module'] == module) & (df['component_type'] == component_type)].groupby('component_name')['filename'].nunique().reset_index().rename(columns={'filename': 'count'})
+    if isinstance(df, PartitionedDataset):
+        return df.aggregate(['component_name'], 'filename', module, component_type)
+    if isinstance(df, AggregateCube):
+        return cube_components(df, module, component_type, value='files')
+    return df[(df['module'] == module) & (df['component_type'] == component_type)].groupby('component_name', observed=True)['filename'].nunique().reset_index().rename(columns={'filename': 'count'})
 
 
 def specific_component_type_counts(df, module, component_type):
-    return df[(df['module'] == module) & (df['component_type'] == component_type)].groupby('component_name')['count'].sum().reset_index()
+    if isinstance(df, PartitionedDataset):
+        return df.aggregate(['component_name'], 'count', module, component_type)
+    if isinstance(df, AggregateCube):
+        return cube_components(df, module, component_type)
+    return df[(df['module'] == module) & (df['component_type'] == component_type)].groupby('component_name', observed=True)['count'].sum().reset_index()
 
 
 def plot_popularity(df, title, top_n=None, full_count=None, files_or_repos='repos'):
@@ -106,25 +288,89 @@ def plot_popularity(df, title, top_n=None, full_count=None, files_or_repos='repo
     plt.show()
 
 
-def get_corr_table(df, index='filename', column='component_name', binary=True, top_n=24):
-    if index in ('filename', 'repo') and column in ('component_name', 'module', 'library'):
-        if 'count' not in df.columns:
-            df['count'] = 1
-        df = df[[index, column, 'count']]
+def cooccurrence_matrix(df, index='filename', column='component_name', binary=True, top_n=None, aggfunc='mean'):
+    # Sparse (index x column) matrix, e.g. files x components, with the counts or 1 where the column occurs.
+    # aggfunc: 'mean' or 'sum', how the counts of rows with the same index and column value are combined
+    # (e.g. a component name imported from several modules), 'mean' as the pivot_table the matrix replaces.
+    # With top_n, only the top_n columns are kept (the most widespread ones for files, the most used ones otherwise)
+    # and only the index values using at least one of them.
+    if aggfunc not in ('mean', 'sum'):
+        raise ValueError(f"Unknown aggfunc {aggfunc}, expected 'mean' or 'sum'")
+    # SciPy is imported here, so the notebooks that don't compute co-occurrences don't need it.
+    from scipy import sparse
+    values = df['count'] if 'count' in df.columns else pd.Series(1, index=df.index)
+    if top_n is not None:
         if index == 'filename':
-            top = df.groupby(column)['filename'].nunique().sort_values(ascending=False).head(top_n).index
+            top = df.groupby(column, observed=True)[index].nunique().sort_values(ascending=False).head(top_n).index
         else:
-            top = df.groupby(column)['count'].sum().sort_values(ascending=False).head(top_n).index
+            top = values.groupby(df[column], observed=True).sum().sort_values(ascending=False).head(top_n).index
+        selected = df[column].isin(top)
+        df, values = df[selected], values[selected]
+    row_codes, _ = pd.factorize(df[index])
+    column_codes, columns = pd.factorize(df[column], sort=True)
+    shape = (row_codes.max() + 1 if len(row_codes) else 0, len(columns))
+    matrix = sparse.csr_matrix((values.to_numpy(dtype=np.float64), (row_codes, column_codes)), shape=shape)
+    matrix.sum_duplicates()
+    if aggfunc == 'mean' and not binary:
+        # Both matrices have the same sorted entries once their duplicates are summed.
+        rows = sparse.csr_matrix((np.ones(len(row_codes)), (row_codes, column_codes)), shape=shape)
+        rows.sum_duplicates()
+        matrix.data /= rows.data
+    if binary:
+        matrix.data[:] = 1
+    return matrix, pd.Index(np.asarray(columns), name=column)
+
+
+def similarity_block(matrix, columns, measure='correlation'):
+    # Similarity of all columns of the matrix with the given ones, as a dense (all columns x len(columns)) array.
+    # measure: 'correlation' (Pearson, of the 0/1 or count values), 'jaccard' or 'lift' (both of occurrences).
+    if measure not in ('correlation', 'jaccard', 'lift'):
+        raise ValueError(f"Unknown measure {measure}, expected 'correlation', 'jaccard' or 'lift'")
+    if measure != 'correlation' and not np.all(matrix.data == 1):
+        matrix = matrix.copy()
+        matrix.data[:] = 1
+    n = matrix.shape[0]
+    gram = (matrix.T @ matrix[:, columns]).toarray()
+    sums = np.asarray(matrix.sum(axis=0)).ravel()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if measure == 'jaccard':
+            return gram / (sums[:, None] + sums[None, columns] - gram)
+        if measure == 'lift':
+            return gram * n / np.outer(sums, sums[columns])
+        squares = np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel()
+        std = np.sqrt((squares - sums ** 2 / n) / (n - 1))
+        covariance = (gram - np.outer(sums, sums[columns]) / n) / (n - 1)
+        return covariance / np.outer(std, std[columns])
+
+
+def get_corr_table(df, index='filename', column='component_name', binary=True, top_n=24, measure='correlation', aggfunc='mean'):
+    matrix, columns = cooccurrence_matrix(df, index, column, binary, top_n, aggfunc)
+    return pd.DataFrame(similarity_block(matrix, np.arange(len(columns)), measure), index=columns, columns=columns)
+
+
+def top_partners(df, index='filename', column='component_name', k=10, measure='correlation', binary=True, min_support=1, block_size=1024, aggfunc='mean'):
+    # The k most similar columns (e.g. components co-used in the same files) of every column occurring in at least min_support index values.
+    # Columns are compared block by block, so memory stays at (number of columns x block_size) whatever their number.
+    matrix, columns = cooccurrence_matrix(df, index, column, binary, aggfunc=aggfunc)
+    kept = np.flatnonzero(np.diff(matrix.tocsc().indptr) >= min_support)
+    matrix, columns = matrix[:, kept], columns[kept]
+    names, partners, values = [], [], []
+    for start in range(0, len(columns), block_size):
+        block = np.arange(start, min(start + block_size, len(columns)))
+        similarity = similarity_block(matrix, block, measure)
+        similarity[block, np.arange(len(block))] = np.nan
+        similarity[np.isnan(similarity)] = -np.inf
+        top = np.argsort(-similarity, axis=0, kind='stable')[:k]
+        top_values = np.take_along_axis(similarity, top, axis=0)
+        valid = np.isfinite(top_values)
+        names.append(np.broadcast_to(block, top.shape)[valid])
+        partners.append(top[valid])
+        values.append(top_values[valid])
+    names, partners, values = (np.concatenate(arrays) if arrays else np.array([], dtype=int) for arrays in (names, partners, values))
+    # Boolean indexing walks the (k x block) arrays row by row, so the pairs are reordered by column and then by rank.
+    order = np.lexsort((np.arange(len(names)), names))
+    return pd.DataFrame({column: columns[names[order]], 'partner': columns[partners[order]], measure: values[order]})
 
-        pivot_df = df[df[column].isin(top)].pivot_table(index=index, columns=column, values='count', fill_value=0)
-
-        if binary:
-            binary_df = pivot_df.copy()
-            binary_df[binary_df > 0] = 1
-            return binary_df.corr()
-        else:
-            return pivot_df.corr()
-        
 
 def plot_correlation_matrix(df, title):
     mask = np.triu(np.ones_like(df, dtype=bool))
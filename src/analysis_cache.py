@@ -0,0 +1,101 @@
+import time
+import pickle
+import sqlite3
+import hashlib
+from collections import Counter
+from typing import Tuple, Optional, Iterable
+
+
+CACHE_FORMAT_VERSION = 4
+CACHE_FILENAME = "analysis_cache.sqlite"
+DEFAULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+
+def file_cache_key(code_file: str, reference_version: str, mode: str, source: Optional[bytes] = None) -> Optional[str]:
+    """
+    Compute the cache key of a file from its content, the API reference version and the mode of operation.
+
+    Parameters:
+    code_file: The path to the file.
+    reference_version: Version of the API reference (see utils.reference_version), empty in 'imports' mode.
+    mode: Mode of operation, 'full', 'imports' or 'both'.
+    source: Content of the file (e.g. a member of a corpus archive), None to read code_file.
+
+    Returns:
+    A hex digest, or None if the file can't be read.
+    """
+    digest = hashlib.blake2b(f"{CACHE_FORMAT_VERSION}:{reference_version}:{mode}:".encode(), digest_size=20)
+    if source is not None:
+        digest.update(source)
+        return digest.hexdigest()
+    try:
+        with open(code_file, "rb") as f:
+            digest.update(f.read())
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def encode_counter(counter: Counter) -> bytes:
+    # The filename is dropped, so identical files in different repositories share one entry.
+    return pickle.dumps([(key[1:], count) for key, count in counter.items()], protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def decode_counter(blob: bytes, code_file: str) -> Counter:
+    return Counter({(code_file, *key): count for key, count in pickle.loads(blob)})
+
+
+class AnalysisCache:
+    """
+    Persistent SQLite store of per-file results, keyed by file_cache_key and evicted in LRU order.
+
+    Workers open it read-only to look results up, while the parent process inserts new results,
+    refreshes the last use of hits and evicts entries once the cache grows above max_bytes.
+    """
+
+    def __init__(self, cache_path: str, max_bytes: int = DEFAULT_CACHE_MAX_BYTES, read_only: bool = False):
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        if read_only:
+            self.connection = sqlite3.connect(f"file:{cache_path}?mode=ro", uri=True)
+        else:
+            self.connection = sqlite3.connect(cache_path)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, rows BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+            self.connection.commit()
+
+    def get(self, key: str) -> Optional[bytes]:
+        row = self.connection.execute("SELECT rows FROM results WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def update(self, new_entries: Iterable[Tuple[str, bytes]], hit_keys: Iterable[str]) -> None:
+        now = time.time()
+        self.connection.executemany("INSERT OR REPLACE INTO results (key, rows, size, last_used) VALUES (?, ?, ?, ?)",
+                                    ((key, blob, len(blob), now) for key, blob in new_entries))
+        self.connection.executemany("UPDATE results SET last_used = ? WHERE key = ?", ((now, key) for key in hit_keys))
+        self.connection.commit()
+
+    def evict(self) -> int:
+        """
+        Delete the least recently used entries until the total size of the stored results is at most max_bytes.
+
+        Returns:
+        The number of deleted entries.
+        """
+        total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total_size <= self.max_bytes:
+            return 0
+        evicted_keys = []
+        for key, size in self.connection.execute("SELECT key, size FROM results ORDER BY last_used"):
+            if total_size <= self.max_bytes:
+                break
+            evicted_keys.append((key,))
+            total_size -= size
+        self.connection.executemany("DELETE FROM results WHERE key = ?", evicted_keys)
+        self.connection.commit()
+        return len(evicted_keys)
+
+    def close(self) -> None:
+        self.connection.close()
+
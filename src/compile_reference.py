@@ -0,0 +1,19 @@
+import argparse
+
+from src.utils import load_library_reference, save_compiled_reference
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile an API reference pickle into the frozen lookup format used by lib_elements_counter.")
+    parser.add_argument("--library_pickle_path", default="./api_reference_pickles/standard_library.pickle", help="Path to the pickle file containing API reference")
+    parser.add_argument("--output_path", default=None, help="Path for the compiled reference, defaults to <library_pickle_path stem>.compiled.pickle")
+    args = parser.parse_args()
+
+    output_path = args.output_path or args.library_pickle_path.removesuffix(".pickle") + ".compiled.pickle"
+    lib_dict = load_library_reference(args.library_pickle_path)
+    save_compiled_reference(lib_dict, output_path)
+    print(f"Saved compiled reference with {len(lib_dict)} modules to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import os
+import zlib
+import zipfile
+import tarfile
+import argparse
+from functools import partial
+from typing import Callable, Dict, Iterator, List, Tuple
+
+
+# Formats written by pack_repositories and the cloner, by their archive suffix.
+ARCHIVE_FORMATS = {"tar.gz": ".tar.gz", "zip": ".zip"}
+# Zip members are read with less per-member work than tar ones, tar.gz archives are smaller (compressed across files).
+DEFAULT_ARCHIVE_FORMAT = "zip"
+# Suffixes of the archives read as corpus shards, tar archives may use any compression tarfile reads.
+ARCHIVE_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz", ".zip")
+DEFAULT_REPOS_PER_ARCHIVE = 100
+# Raised when reading a corrupt or truncated archive or member.
+ARCHIVE_ERRORS = (OSError, EOFError, zlib.error, tarfile.TarError, zipfile.BadZipFile)
+
+
+def list_repository_files(repo_dir: str, repo_name: str) -> List[Tuple[str, str]]:
+    """
+    List the regular files of a checked out repository with their names in a corpus archive, <repo_name>/<path in the repository>.
+
+    Returns:
+    A list of (path on disk, name in the archive) pairs, in sorted order.
+    """
+    files = []
+    for dirpath, dirnames, filenames in os.walk(repo_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            if os.path.isfile(path) and not os.path.islink(path):
+                files.append((path, "/".join((repo_name, *os.path.relpath(path, repo_dir).split(os.sep)))))
+    return files
+
+
+def write_archive(archive_path: str, files: List[Tuple[str, str]], archive_format: str = DEFAULT_ARCHIVE_FORMAT) -> int:
+    """
+    Write files into an archive, through a temporary file renamed once complete, so an interrupted run leaves no partial archive.
+
+    Parameters:
+    archive_path: Path of the archive.
+    files: (path on disk, name in the archive) pairs, see list_repository_files.
+    archive_format: One of ARCHIVE_FORMATS.
+
+    Returns:
+    The number of archived files.
+    """
+    temporary_path = f"{archive_path}.{os.getpid()}.tmp"
+    if archive_format == "zip":
+        with zipfile.ZipFile(temporary_path, "w", zipfile.ZIP_DEFLATED) as archive:
+            for path, name in files:
+                archive.write(path, name)
+    else:
+        # GNU headers, the default pax format adds an extended header to every member (for its float mtime), doubling the headers to parse.
+        with tarfile.open(temporary_path, "w:gz", format=tarfile.GNU_FORMAT) as archive:
+            for path, name in files:
+                archive.add(path, name, recursive=False)
+    os.replace(temporary_path, archive_path)
+    return len(files)
+
+
+def pack_repositories(repos_directory: str, archive_directory: str, repos_per_archive: int = DEFAULT_REPOS_PER_ARCHIVE, archive_format: str = DEFAULT_ARCHIVE_FORMAT) -> List[str]:
+    """
+    Pack the checked out repositories of a directory into archives of repos_per_archive repositories each.
+
+    The repositories are grouped in sorted order and archives that already exist are kept, so an interrupted run
+    can be resumed (with the same repositories and settings).
+
+    Parameters:
+    repos_directory: Directory with one subdirectory per repository, as read by src.main.
+    archive_directory: Directory receiving the archives, repos_<index><suffix>.
+    repos_per_archive: Number of repositories per archive.
+    archive_format: One of ARCHIVE_FORMATS.
+
+    Returns:
+    The paths of the archives.
+    """
+    with os.scandir(repos_directory) as scanned:
+        repos = sorted(dir_entry.name for dir_entry in scanned if dir_entry.is_dir())
+    os.makedirs(archive_directory, exist_ok=True)
+    archive_paths = []
+    for index, start in enumerate(range(0, len(repos), repos_per_archive)):
+        archive_path = os.path.join(archive_directory, f"repos_{index:06d}{ARCHIVE_FORMATS[archive_format]}")
+        if not os.path.exists(archive_path):
+            files = [file for repo in repos[start:start + repos_per_archive] for file in list_repository_files(os.path.join(repos_directory, repo), repo)]
+            n_files = write_archive(archive_path, files, archive_format)
+            print(f"Packed {n_files} files of {len(repos[start:start + repos_per_archive])} repositories into {archive_path}")
+        archive_paths.append(archive_path)
+    return archive_paths
+
+
+def find_archives(archive_directory: str, dir_range: Tuple[int, int] = (0, float("inf"))) -> Dict[str, int]:
+    """
+    Find the corpus archives of a directory, in a range of archives counted in sorted order like the top-level directories of find_python_files.
+
+    Returns:
+    A dict mapping the paths of the archives to their sizes in bytes, in sorted order.
+    """
+    with os.scandir(archive_directory) as scanned:
+        archives = sorted((dir_entry for dir_entry in scanned if dir_entry.is_file() and dir_entry.name.endswith(ARCHIVE_SUFFIXES)), key=lambda dir_entry: dir_entry.name)
+    return {dir_entry.path: dir_entry.stat().st_size for archive_counter, dir_entry in enumerate(archives) if dir_range[0] <= archive_counter <= dir_range[1]}
+
+
+def count_archives(archive_directory: str) -> int:
+    return len(find_archives(archive_directory))
+
+
+def iter_archive_members(archive_path: str, root: str, suffixes: Tuple[str, ...]) -> Iterator[Tuple[str, int, Callable[[], bytes]]]:
+    """
+    Stream the members of a corpus archive with the given suffixes.
+
+    Tar archives are read once from start to end, without seeking, so a member can only be read before the next one is requested.
+
+    Parameters:
+    archive_path: Path of the archive.
+    root: Directory in which the archive is named as if extracted; the filename of a member is <root>/<name in the archive>,
+          the path the file would have in a checked out corpus rooted at root.
+    suffixes: File extensions of the members to return.
+
+    Returns:
+    An iterator of (filename, size in bytes, function reading the content) tuples.
+
+    Raises:
+    One of ARCHIVE_ERRORS if the archive or a member can't be read.
+    """
+    if archive_path.endswith(".zip"):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and info.filename.endswith(suffixes):
+                    yield os.path.join(root, info.filename), info.file_size, partial(archive.read, info)
+    else:
+        with tarfile.open(archive_path, "r|*") as archive:
+            for member in archive:
+                if member.isfile() and member.name.endswith(suffixes):
+                    yield os.path.join(root, member.name), member.size, archive.extractfile(member).read
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack a directory of checked out repositories into corpus archives, read by src.main with --archive_directory.")
+    parser.add_argument("repos_directory", help="Directory with one subdirectory per repository")
+    parser.add_argument("archive_directory", help="Directory receiving the archives")
+    parser.add_argument("--repos_per_archive", type=int, default=DEFAULT_REPOS_PER_ARCHIVE, help="Number of repositories per archive")
+    parser.add_argument("--archive_format", default=DEFAULT_ARCHIVE_FORMAT, choices=sorted(ARCHIVE_FORMATS), help="Format of the archives")
+    args = parser.parse_args()
+
+    archive_paths = pack_repositories(args.repos_directory, args.archive_directory, args.repos_per_archive, args.archive_format)
+    print(f"Archives in {args.archive_directory}: {len(archive_paths)}")
+
+
+if __name__ == "__main__":
+    main()
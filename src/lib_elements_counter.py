@@ -1,13 +1,36 @@
+import os
+import io
+import re
+import gc
 import ast
+import time
+import cProfile
+import bisect
+import signal
 import logging
-from functools import partial
+import resource
 from multiprocessing import Pool
-from typing import List, Dict, Tuple, Set, Callable
-from collections import defaultdict
+from typing import List, Dict, Tuple, Set, Callable, FrozenSet, Optional, Iterable, Iterator
+from contextlib import ExitStack
+from collections import Counter, defaultdict
 
-import pandas as pd
+import pyarrow as pa
 
-from src.utils import convert_notebook_to_python
+from src.utils import SKIP_TOO_LARGE, SKIP_TIMEOUT, SKIP_UNREADABLE, COMPONENT_TYPES, IMPORT_COLUMNS, COMPONENT_SCHEMA, IMPORT_SCHEMA, REFERENCE_COMPONENT_SCHEMA, DEFAULT_ROW_GROUP_SIZE, DEFAULT_CHUNK_BYTES, ParquetCounterWriter, batch_files_by_size, convert_notebook_to_python, reference_version
+from src.analysis_cache import AnalysisCache, file_cache_key, encode_counter, decode_counter
+from src.metrics import Metrics, merge_profile_stats
+from src.corpus_archives import ARCHIVE_ERRORS, iter_archive_members
+
+
+# Patterns of extract_imports_fast. Strings and comments are blanked first, so the remaining ones only see code.
+STRING_OR_COMMENT_PATTERN = re.compile(r'"""(?:[^"\\]|\\[\s\S]|"(?!""))*"""' r"|'''(?:[^'\\]|\\[\s\S]|'(?!''))*'''"
+                                       r'|"(?:[^"\\\n]|\\[\s\S])*"' r"|'(?:[^'\\\n]|\\[\s\S])*'" r'|#[^\n]*')
+IMPORT_LINE_PATTERN = re.compile(r'^([ \t]*)(?:import|from)\b', re.MULTILINE)
+INLINE_IMPORT_PATTERN = re.compile(r'[:;][ \t]*(?:import|from)\b')
+TOP_LEVEL_LINE_PATTERN = re.compile(r'^(\w+|@)', re.MULTILINE)
+INDENTATION_PATTERN = re.compile(r'^([ \t]+)\S', re.MULTILINE)
+IMPORT_STATEMENT_PATTERN = re.compile(r'(?:[^\n(\\]|\\\n|\([^)]*\))*')
+IF_CHAIN_KEYWORDS = frozenset(("if", "elif", "for", "while", "try", "except", "async"))
 
 
 def get_imported_modules(tree: ast.AST, max_depth: int = 2) -> Tuple[Set[str], Dict[str, str]]:
@@ -26,9 +49,12 @@ def get_imported_modules(tree: ast.AST, max_depth: int = 2) -> Tuple[Set[str], D
     imported_modules = set()
     direct_imports = defaultdict(set)
 
-    def walk_tree(node, depth=0):
+    # An explicit stack instead of recursion, so deeply nested code can't exceed the recursion limit.
+    stack = [(tree, 0)]
+    while stack:
+        node, depth = stack.pop()
         if max_depth is not None and depth > max_depth:
-            return
+            continue
 
         match node:
             case ast.Import(names=names):
@@ -37,22 +63,83 @@ def get_imported_modules(tree: ast.AST, max_depth: int = 2) -> Tuple[Set[str], D
                 imported_modules.add(module_name)
                 direct_imports[module_name].update(n.name for n in names)
 
-        for child in ast.iter_child_nodes(node):
-            walk_tree(child, depth + 1)
+        stack.extend((child, depth + 1) for child in ast.iter_child_nodes(node))
 
-    walk_tree(tree)
     return imported_modules, direct_imports
 
 
-def check_node(node: ast.AST, components: Dict[str, List[str]], df: pd.DataFrame, code_file: str, module: str, module_direct_imports: Dict[str, str]) -> None:
+def extract_imports_fast(code: str) -> Optional[Tuple[Set[str], Dict[str, str]]]:
+    """
+    Finds the imports that get_imported_modules(ast.parse(code)) would find, without parsing the whole file.
+
+    Strings and comments are blanked with one regex substitution, then only the lines starting with
+    'import' or 'from' are looked at. An indented import counts when it is in the body of a top-level
+    statement (depth 2), except in the body of an 'except', 'elif', or 'else' of an if-elif chain, which
+    are one level deeper in the AST. The found statements are then parsed on their own.
+
+    Unlike ast.parse, the extractor doesn't reject files with syntax errors elsewhere in the code.
+
+    Parameters:
+    code: The source code.
+
+    Returns:
+    The same tuple as get_imported_modules, or None if the code has constructs the extractor can't
+    place with certainty (imports after ':' or ';', 'from' continuing another statement after a
+    backslash...) and the AST has to be used instead.
+    """
+    if "import" not in code:
+        return set(), defaultdict(set)
+    code = STRING_OR_COMMENT_PATTERN.sub(" ", code)
+    if INLINE_IMPORT_PATTERN.search(code):
+        return None
+
+    top_level_lines = None
+    statements = []
+    statement_end = 0
+    for match in IMPORT_LINE_PATTERN.finditer(code):
+        # Lines continuing an import after a backslash ('from os \ / import path') are part of it,
+        # those continuing another statement can only be placed by the AST.
+        if match.start() < statement_end:
+            continue
+        if code.endswith("\\\n", 0, match.start()):
+            return None
+        statement_end = IMPORT_STATEMENT_PATTERN.match(code, match.end()).end()
+        indentation = match.group(1)
+        if indentation:
+            if top_level_lines is None:
+                top_level_lines = list(TOP_LEVEL_LINE_PATTERN.finditer(code))
+                top_level_starts = [line.start() for line in top_level_lines]
+            i = bisect.bisect_right(top_level_starts, match.start()) - 1
+            if i < 0:
+                return None
+            header = top_level_lines[i]
+            # Continuation lines of a multi-line header are indented at least as much as the body of the header.
+            body_indentation = min(len(line_indentation.expandtabs()) for line_indentation in INDENTATION_PATTERN.findall(code, header.end(), match.end()))
+            if len(indentation.expandtabs()) > body_indentation:
+                continue
+            keyword = header.group(1)
+            if keyword in ("except", "elif"):
+                continue
+            if keyword == "else" and next((line.group(1) for line in reversed(top_level_lines[:i]) if line.group(1) in IF_CHAIN_KEYWORDS), None) == "elif":
+                continue
+        statements.append(code[match.start():statement_end].strip())
+
+    try:
+        tree = ast.parse("\n".join(statements))
+    except SyntaxError:
+        return None
+    return get_imported_modules(tree)
+
+
+def check_node(node: ast.AST, components: Dict[str, List[str]], component_counter: Counter, code_file: str, module: str, module_direct_imports: Dict[str, str]) -> None:
     """
     Checks if the node represents any of the library components (functions, methods, classes instatiations, attributes, and exceptions).
-    If it does, it updates the given DataFrame with the component's count.
+    If it does, it increments the component's count in the given Counter.
 
     Parameters:
     node: The AST node to check.
     components: A dict containing API reference of a given library.
-    df: A DataFrame object for storing counts of library components.
+    component_counter: A Counter keyed by (filename, module, component_type, component_name) tuples.
     code_file: The path to the Python file being processed.
     module: The name of the library which components are being checked.
     module_direct_imports: A dictionary mapping directly imported component names to their module names.
@@ -62,161 +149,640 @@ def check_node(node: ast.AST, components: Dict[str, List[str]], df: pd.DataFrame
     """
     match node:
         case ast.Call(func=ast.Name(id=func_name)) if func_name in components["function"] and func_name in module_direct_imports:
-            update_df(df, code_file, module, "function", func_name)
+            component_counter[(code_file, module, "function", func_name)] += 1
         case ast.Call(func=ast.Attribute(attr=func_name, value=ast.Name(id=module_name))) if func_name in components["function"] and module_name == module:
-            update_df(df, code_file, module, "function", func_name)
+            component_counter[(code_file, module, "function", func_name)] += 1
         case ast.Call(args=[ast.Name(id=func_name)]) | ast.Call(args=[ast.Name(id=func_name), _]) | ast.Call(args=[_, ast.Name(id=func_name)]) if func_name in components["function"] and func_name in module_direct_imports:
-            update_df(df, code_file, module, "function", func_name)
+            component_counter[(code_file, module, "function", func_name)] += 1
         case ast.Call(args=[ast.Attribute(value=ast.Name(id=module_name), attr=func_name)]) | ast.Call(args=[_, ast.Attribute(value=ast.Name(id=module_name), attr=func_name)]) | ast.Call(args=[ast.Attribute(value=ast.Name(id=module_name), attr=func_name), _]) if func_name in components["function"] and module_name == module:
-            update_df(df, code_file, module, "function", func_name)
+            component_counter[(code_file, module, "function", func_name)] += 1
         case ast.Call(keywords=[ast.keyword(value=ast.Name(id=func_name))]) | ast.Call(keywords=[ast.keyword(value=ast.Name(id=func_name)), _]) | ast.Call(keywords=[_, ast.keyword(value=ast.Name(id=func_name))]) if func_name in components["function"] and func_name in module_direct_imports:
-            update_df(df, code_file, module, "function", func_name)
+            component_counter[(code_file, module, "function", func_name)] += 1
         case ast.Call(keywords=[ast.Attribute(value=ast.Name(id=module_name), attr=func_name)]) | ast.Call(keywords=[_, ast.Attribute(value=ast.Name(id=module_name), attr=func_name)]) | ast.Call(keywords=[ast.Attribute(value=ast.Name(id=module_name), attr=func_name), _]) if func_name in components["function"] and module_name == module:
-            update_df(df, code_file, module, "function", func_name)
+            component_counter[(code_file, module, "function", func_name)] += 1
         case ast.Call(func=ast.Attribute(attr=method_name)) if method_name in components["method"]:
-            update_df(df, code_file, module, "method", method_name)
+            component_counter[(code_file, module, "method", method_name)] += 1
         case ast.Call(func=ast.Name(id=class_name)) if class_name in components["class"] and class_name in module_direct_imports:
-            update_df(df, code_file, module, "class", class_name)
+            component_counter[(code_file, module, "class", class_name)] += 1
         case ast.Call(func=ast.Attribute(value=ast.Name(id=module_name), attr=class_name)) if class_name in components["class"] and module_name == module:
-            update_df(df, code_file, module, "class", class_name)
+            component_counter[(code_file, module, "class", class_name)] += 1
         case ast.Attribute(attr=attr_name) if attr_name in components["attribute"]:
-            update_df(df, code_file, module, "attribute", attr_name)
+            component_counter[(code_file, module, "attribute", attr_name)] += 1
         case ast.ExceptHandler(type=ast.Name(id=exc_name)) if exc_name in components["exception"] and exc_name in module_direct_imports:
-            update_df(df, code_file, module, "exception", exc_name)
+            component_counter[(code_file, module, "exception", exc_name)] += 1
         case ast.ExceptHandler(type=ast.Attribute(value=ast.Name(id=module_name), attr=exc_name)) if exc_name in components["exception"] and module_name == module:
-            update_df(df, code_file, module, "exception", exc_name)
+            component_counter[(code_file, module, "exception", exc_name)] += 1
         case ast.Raise(exc=ast.Name(id=exc_name)) if exc_name in components["exception"] and exc_name in module_direct_imports:
-            update_df(df, code_file, module, "exception", exc_name)
+            component_counter[(code_file, module, "exception", exc_name)] += 1
         case ast.Raise(exc=ast.Attribute(value=ast.Name(id=module_name), attr=exc_name)) if exc_name in components["exception"] and module_name == module:
-            update_df(df, code_file, module, "exception", exc_name)
+            component_counter[(code_file, module, "exception", exc_name)] += 1
 
 
-def update_df(df: pd.DataFrame, code_file: str, module: str, component_type: str, component_name: str) -> None:
+def build_lookup_index(lib_dict: Dict, imported_modules: Set[str]) -> Tuple[Dict[str, List[str]], Dict[str, Dict[str, FrozenSet[str]]]]:
     """
-    Checks whether a row for the given code file, module, component type and component name already exists.
-    If it does, the count in that row is incremented. 
-    If it doesn't, a new row is added to the DataFrame with a count of 1.
+    Builds a per-file reverse index of the API reference, limited to the modules imported by the file.
 
     Parameters:
-    df: The DataFrame to be updated. 
-        It has the following columns:
-        - 'filename': the path to the Python file
-        - 'module': the name of the library
-        - 'component_type': the type of the component (e.g., 'function', 'class', etc.)
-        - 'component_name': the name of the component
-        - 'count': the count of the component
-    code_file: The path to the Python file being processed.
-    module: The name of the library which components are being checked.
-    component_type: The type of the component (e.g., 'function', 'class', etc.).
-    component_name: The name of the component.
+    lib_dict: A dictionary representing the API reference of one or more libraries.
+    imported_modules: A set of module names imported by the file.
 
     Returns:
-    None
+    A tuple containing:
+    - A dictionary mapping a component name to the imported modules whose reference contains it.
+    - A dictionary mapping each imported module to its components, with each component type stored as a frozenset.
     """
-    row_exists = ((df['filename'] == code_file) & 
-                  (df['module'] == module) & 
-                  (df['component_type'] == component_type) & 
-                  (df['component_name'] == component_name)).any()
-    if row_exists:
-        df.loc[(df['filename'] == code_file) & 
-               (df['module'] == module) & 
-               (df['component_type'] == component_type) & 
-               (df['component_name'] == component_name), 'count'] += 1
-    else:
-        new_row = {'filename': code_file, 'module': module, 'component_type': component_type, 
-                   'component_name': component_name, 'count': 1}
-        df.loc[len(df)] = new_row
+    lookup_index = defaultdict(list)
+    module_components = {}
+    for module, components in lib_dict.items():
+        if module not in imported_modules:
+            continue
+        module_components[module] = {component_type: frozenset(components[component_type]) for component_type in COMPONENT_TYPES}
+        for name in set().union(*module_components[module].values()):
+            lookup_index[name].append(module)
+    return lookup_index, module_components
+
+
+def _match_name(values: List[ast.AST]) -> Optional[str]:
+    # Mirrors the [Name(x)] | [Name(x), _] | [_, Name(x)] patterns of check_node.
+    if len(values) == 1 and isinstance(values[0], ast.Name):
+        return values[0].id
+    if len(values) == 2:
+        for value in values:
+            if isinstance(value, ast.Name):
+                return value.id
+    return None
+
+
+def _match_module_attribute(values: List[ast.AST]) -> Tuple[Optional[str], Optional[str]]:
+    # Mirrors the [Attribute(Name(m), x)] | [_, Attribute(Name(m), x)] | [Attribute(Name(m), x), _] patterns of check_node.
+    if len(values) in (1, 2):
+        for value in reversed(values):
+            if isinstance(value, ast.Attribute) and isinstance(value.value, ast.Name):
+                return value.value.id, value.attr
+    return None, None
+
+
+def _match_target(node: Optional[ast.AST]) -> Tuple[Optional[str], Optional[str]]:
+    # Splits an except/raise target into (name, None) for Name(x) or (x, m) for Attribute(Name(m), x).
+    if isinstance(node, ast.Name):
+        return node.id, None
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name):
+        return node.attr, node.value.id
+    return None, None
+
+
+class ComponentVisitor(ast.NodeVisitor):
+    """
+    Counts library components in a single pass over the AST.
 
+    Produces the same counts as calling check_node on every node for every imported module,
+    but looks up only the modules whose reference contains the names found in a node.
+    """
+
+    def __init__(self, lib_dict: Dict, imported_modules: Set[str], direct_imports: Dict[str, Set[str]], component_counter: Counter, code_file: str):
+        self.lookup_index, self.module_components = build_lookup_index(lib_dict, imported_modules)
+        self.direct_imports = direct_imports
+        self.component_counter = component_counter
+        self.code_file = code_file
+        self._visitors = {ast.Call: self.visit_Call, ast.Attribute: self.visit_Attribute, ast.ExceptHandler: self.visit_ExceptHandler, ast.Raise: self.visit_Raise}
 
-def process_file(logger: logging.Logger, lib_dict: Dict, code_file: str, mode: str) -> pd.DataFrame:
+    def visit(self, tree: ast.AST) -> None:
+        # Iterates over ast.walk instead of the recursive generic_visit, so deeply nested code can't exceed the recursion limit.
+        for node in ast.walk(tree):
+            visitor = self._visitors.get(type(node))
+            if visitor is not None:
+                visitor(node)
+
+    def _candidate_modules(self, *names: Optional[str]) -> Set[str]:
+        return {module for name in names if name is not None for module in self.lookup_index.get(name, ())}
+
+    def _count(self, module: str, component_type: str, component_name: str) -> None:
+        self.component_counter[(self.code_file, module, component_type, component_name)] += 1
+
+    def visit_Call(self, node: ast.Call) -> None:
+        func = node.func
+        func_name = func.id if isinstance(func, ast.Name) else None
+        func_attr = func.attr if isinstance(func, ast.Attribute) else None
+        func_base = func.value.id if func_attr is not None and isinstance(func.value, ast.Name) else None
+        arg_name = _match_name(node.args)
+        arg_base, arg_attr = _match_module_attribute(node.args)
+        keyword_name = _match_name([keyword.value for keyword in node.keywords])
+
+        for module in self._candidate_modules(func_name, func_attr, arg_name, arg_attr, keyword_name):
+            components = self.module_components[module]
+            direct = self.direct_imports[module]
+            functions = components["function"]
+            if func_name in functions and func_name in direct:
+                self._count(module, "function", func_name)
+            elif func_base == module and func_attr in functions:
+                self._count(module, "function", func_attr)
+            elif arg_name in functions and arg_name in direct:
+                self._count(module, "function", arg_name)
+            elif arg_base == module and arg_attr in functions:
+                self._count(module, "function", arg_attr)
+            elif keyword_name in functions and keyword_name in direct:
+                self._count(module, "function", keyword_name)
+            elif func_attr in components["method"]:
+                self._count(module, "method", func_attr)
+            elif func_name in components["class"] and func_name in direct:
+                self._count(module, "class", func_name)
+            elif func_base == module and func_attr in components["class"]:
+                self._count(module, "class", func_attr)
+
+    def visit_Attribute(self, node: ast.Attribute) -> None:
+        for module in self._candidate_modules(node.attr):
+            if node.attr in self.module_components[module]["attribute"]:
+                self._count(module, "attribute", node.attr)
+
+    def _visit_exception(self, target: Optional[ast.AST]) -> None:
+        exc_name, module_name = _match_target(target)
+        for module in self._candidate_modules(exc_name):
+            if exc_name not in self.module_components[module]["exception"]:
+                continue
+            if module_name is None and exc_name in self.direct_imports[module]:
+                self._count(module, "exception", exc_name)
+            elif module_name == module:
+                self._count(module, "exception", exc_name)
+
+    def visit_ExceptHandler(self, node: ast.ExceptHandler) -> None:
+        self._visit_exception(node.type)
+
+    def visit_Raise(self, node: ast.Raise) -> None:
+        self._visit_exception(node.exc)
+
+
+def _lap(timings: Dict[str, float], stage: str, start: float) -> float:
+    now = time.perf_counter()
+    timings[stage] = timings.get(stage, 0.0) + now - start
+    return now
+
+
+def process_file(logger: logging.Logger, lib_dict: Dict, code_file: str, mode: str, timings: Optional[Dict[str, float]] = None, source: Optional[bytes] = None, lenient_imports: bool = False) -> Counter:
     """
-    Process a single file, returning a DataFrame with counts of library components or a DataFrame with imported modules.
+    Process a single file, returning a Counter with counts of library components or a Counter with imported modules.
 
     Parameters:
     logger: Logger object for logging messages.
     lib_dict: A dictionary representing the API reference of one or more libraries.
     code_file: The path to the file to process.
-    mode: Mode of operation, 'full' for full analysis or 'imports' for filenames and imports only.
+    mode: Mode of operation, 'full' for full analysis, 'imports' for filenames and imports only or 'both' for both from the same parse.
+    timings: A dictionary receiving the seconds spent in each stage (see metrics.FILE_STAGES), None to skip timing.
+    source: Content of the file, decoded as the file would be read (e.g. a member of a corpus archive), None to read code_file.
+    lenient_imports: In 'imports' and 'both' modes, also report the imports of files ast.parse rejects (e.g. Python 2 files),
+                     found by extract_imports_fast; 'imports' mode then doesn't parse whole files. By default such files
+                     have no rows, as in 'full' mode.
 
     Returns:
-    A DataFrame containing counts of library components or a DataFrame with filenames and imported modules within the given code file.
+    A Counter keyed by (filename, module, component_type, component_name) tuples in 'full' mode
+    or by (filename, module) tuples in 'imports' mode; in 'both' mode it has both kinds of keys.
     """
-    columns = ['filename', 'module', 'component_type', 'component_name', 'count'] if mode == 'full' else ['filename', 'module']
-    df = pd.DataFrame(columns=columns)
+    component_counter = Counter()
+    start = time.perf_counter() if timings is not None else 0.0
     try:
-        with open(code_file, 'r', encoding='utf-8', errors='ignore') as f:
-            code = f.read()
+        if source is not None:
+            code = io.TextIOWrapper(io.BytesIO(source), encoding='utf-8', errors='ignore').read()
+        else:
+            with open(code_file, 'r', encoding='utf-8', errors='ignore') as f:
+                code = f.read()
     except IOError as e:
         logger.error(f"Error reading file {code_file}: {e}")
-        return pd.DataFrame(columns=columns)
+        return Counter()
+    if timings is not None:
+        start = _lap(timings, "read", start)
     
     if code_file.endswith('.ipynb'):
         code = convert_notebook_to_python(code, logger)
+        if timings is not None:
+            start = _lap(timings, "convert_notebook", start)
 
     try:
-        tree = ast.parse(code)
-        imported_modules, direct_imports = get_imported_modules(tree)
-
         if mode == "imports":
+            imports = extract_imports_fast(code) if lenient_imports else None
+            if timings is not None and lenient_imports:
+                start = _lap(timings, "extract_imports", start)
+            if imports is not None:
+                imported_modules = imports[0]
+            else:
+                tree = ast.parse(code)
+                if timings is not None:
+                    start = _lap(timings, "parse", start)
+                imported_modules = get_imported_modules(tree)[0]
+                if timings is not None:
+                    start = _lap(timings, "find_imports", start)
             for module in imported_modules:
-                new_row = {'filename': code_file, 'module': module}
-                df.loc[len(df)] = new_row
-            return df
+                component_counter[(code_file, module)] = 1
+            return component_counter
 
-        for node in ast.walk(tree):
-            for module, components in lib_dict.items():
-                if module not in imported_modules:
-                    continue
-                check_node(node, components, df, code_file, module, direct_imports[module])
-        return df
+        tree = ast.parse(code)
+        if timings is not None:
+            start = _lap(timings, "parse", start)
+        imported_modules, direct_imports = get_imported_modules(tree)
+        if mode == "both":
+            for module in imported_modules:
+                component_counter[(code_file, module)] = 1
+        if timings is not None:
+            start = _lap(timings, "find_imports", start)
+        visitor = ComponentVisitor(lib_dict, imported_modules, direct_imports, component_counter, code_file)
+        if visitor.module_components:
+            visitor.visit(tree)
+        if timings is not None:
+            start = _lap(timings, "visit", start)
+        return component_counter
     except SyntaxError as e:
+        if timings is not None:
+            start = _lap(timings, "parse", start)
         logger.error(f"Syntax error parsing file {code_file}: {e}")
-        return pd.DataFrame(columns=columns)
+        # The imports of a file that doesn't parse may still be found without the AST.
+        imports = extract_imports_fast(code) if mode == "both" and lenient_imports else None
+        if timings is not None and mode == "both" and lenient_imports:
+            _lap(timings, "extract_imports", start)
+        return Counter({(code_file, module): 1 for module in imports[0]}) if imports is not None else Counter()
     except Exception as e:
         logger.error(f"Exception {code_file}: {e}")
-        return pd.DataFrame(columns=columns)
+        return Counter()
+
+
+_worker_state = {}
+
+
+class FileTimeoutError(BaseException):
+    """
+    Raised in a worker when processing a single file takes longer than the per-file timeout.
+
+    It derives from BaseException, so that the broad exception handling in process_file doesn't swallow it.
+    """
+
+
+def _raise_file_timeout(signum, frame):
+    raise FileTimeoutError()
+
+
+def build_reference_prefilter(lib_dict: Dict) -> Optional[re.Pattern]:
+    """
+    Compile a bytes pattern matching the top-level package names of the reference modules as whole words.
+
+    A file only counts components of the modules it imports and an import always spells out the
+    top-level package name, so a file without a match can be skipped without being parsed.
+
+    Parameters:
+    lib_dict: A dictionary representing the API reference of one or more libraries.
+
+    Returns:
+    The compiled pattern, or None if the reference is empty or has non-ASCII module names (which notebooks may store escaped).
+    """
+    packages = sorted({module.split(".")[0] for module in lib_dict}, key=len, reverse=True)
+    if not packages or not all(package.isascii() for package in packages):
+        return None
+    return re.compile(rb"\b(?:" + b"|".join(re.escape(package.encode()) for package in packages) + rb")\b")
+
+
+def may_use_reference(prefilter: re.Pattern, code_file: str, max_file_bytes: Optional[int] = None, source: Optional[bytes] = None) -> bool:
+    """
+    Check the raw bytes of a file (or source, if given) for any name matched by build_reference_prefilter.
+
+    Files that can't be read or are larger than max_file_bytes pass, so that process_guarded reports them.
+    """
+    if source is not None:
+        return (max_file_bytes is not None and len(source) > max_file_bytes) or prefilter.search(source) is not None
+    try:
+        with open(code_file, "rb") as f:
+            data = f.read(max_file_bytes + 1) if max_file_bytes is not None else f.read()
+    except OSError:
+        return True
+    if max_file_bytes is not None and len(data) > max_file_bytes:
+        return True
+    return prefilter.search(data) is not None
+
+
+def init_worker(process_file_func: Callable[[logging.Logger, Dict, str, str], Counter], lib_dict: Dict, logger: logging.Logger, mode: str, cache_path: Optional[str] = None, reference_version: str = "", max_file_bytes: Optional[int] = None, file_timeout: Optional[float] = None, prefilter: Optional[re.Pattern] = None, slowest_files: Optional[int] = None, profile: bool = False, lenient_imports: bool = False) -> None:
+    """
+    Pool initializer storing the per-run arguments (including the API reference) once per worker, so tasks only carry file paths.
+
+    With the default 'fork' start method the arguments are inherited from the parent process
+    instead of being pickled, so the API reference is not copied per task.
+    Each worker opens its own read-only connection to the analysis cache, if one is used.
+    With slowest_files set, batches are returned with their Metrics; with profile, with their cProfile stats.
+    """
+    cache = AnalysisCache(cache_path, read_only=True) if cache_path is not None else None
+    if file_timeout:
+        signal.signal(signal.SIGALRM, _raise_file_timeout)
+    _worker_state.update(process_file_func=process_file_func, lib_dict=lib_dict, logger=logger, mode=mode, cache=cache, reference_version=reference_version,
+                         max_file_bytes=max_file_bytes, file_timeout=file_timeout, prefilter=prefilter, slowest_files=slowest_files, profile=profile,
+                         lenient_imports=lenient_imports)
+
+
+def _check_file_size(code_file: str, source: Optional[bytes] = None) -> Optional[Tuple[str, str, str]]:
+    # The (filename, reason, detail) tuple of a file above the size limit of the worker or that can't be stat-ed, None if it can be processed.
+    max_file_bytes = _worker_state["max_file_bytes"]
+    if max_file_bytes is None:
+        return None
+    try:
+        size = len(source) if source is not None else os.path.getsize(code_file)
+    except OSError as e:
+        return code_file, SKIP_UNREADABLE, str(e)
+    if size > max_file_bytes:
+        return code_file, SKIP_TOO_LARGE, f"{size} bytes"
+    return None
+
+
+def process_guarded(code_file: str, timings: Optional[Dict[str, float]] = None, source: Optional[bytes] = None) -> Tuple[Counter, Optional[Tuple[str, str, str]]]:
+    """
+    Apply process_file_func to a file in a worker, skipping files above the size limit and interrupting files
+    that take longer than the per-file timeout.
+
+    The timeout is checked between Python bytecodes, so a single long call into C (e.g. ast.parse) only ends
+    when it returns; the size limit is what bounds those. timings and source (the content of the file, for members
+    of corpus archives) are passed on to process_file_func if given, and so is lenient_imports if set.
+
+    Returns:
+    A tuple containing:
+    - The Counter of the file, empty if it was skipped.
+    - A (filename, reason, detail) tuple if the file was skipped, otherwise None.
+    """
+    skip = _check_file_size(code_file, source)
+    if skip is not None:
+        return Counter(), skip
+
+    file_timeout = _worker_state["file_timeout"]
+    try:
+        if file_timeout:
+            signal.setitimer(signal.ITIMER_REAL, file_timeout)
+        try:
+            extra_args = (timings, source) if source is not None else (timings,) if timings is not None else ()
+            extra_kwargs = {"lenient_imports": True} if _worker_state["lenient_imports"] else {}
+            return _worker_state["process_file_func"](_worker_state["logger"], _worker_state["lib_dict"], code_file, _worker_state["mode"], *extra_args, **extra_kwargs), None
+        finally:
+            if file_timeout:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+    except FileTimeoutError:
+        _worker_state["logger"].error(f"Timeout processing file {code_file} after {file_timeout} s")
+        return Counter(), (code_file, SKIP_TIMEOUT, f"{file_timeout} s")
 
 
-def process_files_in_parallel(process_file_func: Callable[[logging.Logger, Dict, str, str], pd.DataFrame], lib_dict: Dict, code_files: List[str], logger: logging.Logger, mode: str) -> List[pd.DataFrame]:
+BatchResult = Tuple[Counter, List[str], List[Tuple[str, bytes]], List[Tuple[str, str, str]], int, Optional[Metrics], Optional[Dict]]
+
+
+def process_batch_in_worker(code_files: List[str]) -> BatchResult:
+    """
+    Process a batch of files in a worker, returning one Counter for the whole batch.
+
+    Every file has its own keys (they start with the filename), so merging the per-file Counters
+    doesn't change any count and the batch is sent back to the parent as a single message.
+    Files found in the analysis cache are not processed again; results of the other files are
+    returned encoded, so that the parent process (the only writer) can add them to the cache.
+    Skipped files are not cached, as their result depends on the limits of the run.
+    Files rejected by the reference prefilter are neither parsed nor looked up in the cache.
+
+    Returns:
+    A tuple containing:
+    - The Counter of the whole batch.
+    - Cache keys of the files found in the cache.
+    - (cache key, encoded Counter) pairs of the processed files.
+    - (filename, reason, detail) tuples of the skipped files.
+    - The number of files rejected by the reference prefilter.
+    - The Metrics of the batch, if the worker collects them.
+    - The cProfile stats of the batch, if the worker is profiled.
+    """
+    return _process_entries_in_worker(((code_file, None, None) for code_file in code_files), [])
+
+
+def _archive_entries(archive_paths: List[str], root: str, suffixes: Tuple[str, ...], skipped: List[Tuple[str, str, str]]) -> Iterator[Tuple[str, int, Callable[[], bytes]]]:
+    for archive_path in archive_paths:
+        try:
+            yield from iter_archive_members(archive_path, root, suffixes)
+        except ARCHIVE_ERRORS as e:
+            _worker_state["logger"].error(f"Error reading archive {archive_path}: {e}")
+            skipped.append((archive_path, SKIP_UNREADABLE, str(e)))
+
+
+def process_archives_in_worker(task: Tuple[List[str], str, Tuple[str, ...]]) -> BatchResult:
     """
-    Process the given files in parallel, returning a list of DataFrames.
+    Process the members of a batch of corpus archives in a worker, as process_batch_in_worker does with files.
+
+    Each archive is read once from start to end (see corpus_archives.iter_archive_members) and its members are processed
+    from memory, named as if the archives were extracted in root. Members above the size limit are skipped without being read.
+    A member that can't be read is reported as skipped, and so is an archive that can't be read any further.
+
+    Parameters:
+    task: A tuple containing the paths of the archives, root and the file extensions of the members to process.
+
+    Returns:
+    The same tuple as process_batch_in_worker.
+    """
+    archive_paths, root, suffixes = task
+    skipped = []
+    return _process_entries_in_worker(_archive_entries(archive_paths, root, suffixes, skipped), skipped)
+
+
+def _process_entries_in_worker(entries: Iterable[Tuple[str, Optional[int], Optional[Callable[[], bytes]]]], skipped: List[Tuple[str, str, str]]) -> BatchResult:
+    # Entries are (filename, size, read) tuples, size and read are None for files read from disk by process_file_func.
+    cache = _worker_state["cache"]
+    prefilter = _worker_state["prefilter"]
+    max_file_bytes = _worker_state["max_file_bytes"]
+    batch_counter = Counter()
+    hit_keys, new_entries = [], []
+    n_prefiltered = 0
+    metrics = Metrics(_worker_state["slowest_files"]) if _worker_state["slowest_files"] is not None else None
+    profiler = cProfile.Profile() if _worker_state["profile"] else None
+    if profiler is not None:
+        profiler.enable()
+    for code_file, size, read in entries:
+        start = time.perf_counter() if metrics is not None else 0.0
+        source = None
+        if read is not None:
+            if max_file_bytes is not None and size > max_file_bytes:
+                skipped.append((code_file, SKIP_TOO_LARGE, f"{size} bytes"))
+                continue
+            try:
+                source = read()
+            except ARCHIVE_ERRORS as e:
+                _worker_state["logger"].error(f"Error reading {code_file}: {e}")
+                skipped.append((code_file, SKIP_UNREADABLE, str(e)))
+                continue
+            if metrics is not None:
+                start = _lap(metrics.stage_seconds, "archive_read", start)
+        if prefilter is not None and not may_use_reference(prefilter, code_file, max_file_bytes, source):
+            n_prefiltered += 1
+            if metrics is not None:
+                _lap(metrics.stage_seconds, "prefilter", start)
+            continue
+        if metrics is not None and prefilter is not None:
+            start = _lap(metrics.stage_seconds, "prefilter", start)
+        # Computing the cache key reads the whole file, so the size limit is applied first (archive members were checked above).
+        skip = _check_file_size(code_file) if cache is not None and read is None else None
+        if skip is not None:
+            skipped.append(skip)
+            continue
+        key = file_cache_key(code_file, _worker_state["reference_version"], _worker_state["mode"], source) if cache is not None else None
+        blob = cache.get(key) if key is not None else None
+        if metrics is not None and cache is not None:
+            start = _lap(metrics.stage_seconds, "cache_lookup", start)
+        if blob is not None:
+            batch_counter.update(decode_counter(blob, code_file))
+            hit_keys.append(key)
+            continue
+        timings = {} if metrics is not None else None
+        counter, skip = process_guarded(code_file, timings, source)
+        if metrics is not None:
+            metrics.add_file(code_file, time.perf_counter() - start, timings)
+        batch_counter.update(counter)
+        if skip is not None:
+            skipped.append(skip)
+        elif key is not None:
+            new_entries.append((key, encode_counter(counter)))
+    profile_stats = None
+    if profiler is not None:
+        profiler.disable()
+        profiler.create_stats()
+        profile_stats = profiler.stats
+    return batch_counter, hit_keys, new_entries, skipped, n_prefiltered, metrics, profile_stats
+
+
+def process_files_in_parallel(process_file_func: Callable[[logging.Logger, Dict, str, str], Counter], lib_dict: Dict, code_files: List[str], logger: logging.Logger, mode: str, workers: Optional[int] = None, chunk_bytes: int = DEFAULT_CHUNK_BYTES, cache: Optional[AnalysisCache] = None, file_sizes: Optional[Dict[str, int]] = None, max_file_bytes: Optional[int] = None, file_timeout: Optional[float] = None, skipped_files: Optional[List[Tuple[str, str, str]]] = None, use_prefilter: bool = True, metrics: Optional[Metrics] = None, profile_output_file: Optional[str] = None, archive_root: Optional[str] = None, suffixes: Tuple[str, ...] = (".py",), lenient_imports: bool = False) -> Iterator[Counter]:
+    """
+    Process the given files in parallel, yielding one Counter per batch of files in the order the workers finish them.
 
     Parameters:
     process_file_func: Function to be applied to each file.
     lib_dict: A dictionary representing the library.
     code_files: A list of paths to Python code files.
     logger: Logger object for logging messages.
-    mode: Mode of operation, 'full' for full analysis or 'imports' for filenames and imports only.
+    mode: Mode of operation, 'full' for full analysis, 'imports' for filenames and imports only or 'both' for both from the same parse.
+    workers: Number of worker processes, defaults to the number of CPUs.
+    chunk_bytes: Target total size of the files sent to a worker as one task (see batch_files_by_size).
+    cache: An AnalysisCache with results of previous runs, updated with the results of this one.
+    file_sizes: Known sizes of the files (e.g. from discover_files), used for batching without stat-ing them again.
+    max_file_bytes: Files larger than this are skipped, None for no limit.
+    file_timeout: Wall-clock seconds after which processing of a single file is abandoned, None for no timeout.
+    skipped_files: A list extended with (filename, reason, detail) tuples of the skipped files.
+    use_prefilter: In 'full' mode, skip files in which no top-level package of the reference appears (see build_reference_prefilter).
+    metrics: Metrics receiving the stage times, counters and slowest files of the workers, None to run without instrumentation.
+    profile_output_file: Profile the workers with cProfile and save their merged stats to this file (readable with pstats).
+    archive_root: With it, code_files are corpus archives (see corpus_archives) and their members are processed instead,
+                  named as if the archives were extracted in archive_root; batches are then made of whole archives.
+    suffixes: With archive_root, file extensions of the archive members to process.
+    lenient_imports: In 'imports' and 'both' modes, also report the imports of files that don't parse (see process_file).
 
     Returns:
-    A list of DataFrames, each resulting from processing a single file.
+    An iterator of non-empty Counters, each resulting from processing a batch of files.
     """
-    process_file_partial = partial(process_file_func, logger, lib_dict, mode=mode)
-    with Pool() as pool:
-        results = pool.map(process_file_partial, code_files)
-    print(f'Number of DataFrames: {len(results)}')
-    print(f'Shape of first DataFrame: {results[0].shape if results else "No DataFrames"}')
-    return [df for df in results if not df.empty]
-
-
-def concatenate_and_save(df_list: List[pd.DataFrame], output_file: str) -> None:
+    workers = workers or os.cpu_count() or 1
+    batches = batch_files_by_size(code_files, chunk_bytes, min_batches=workers * 4, file_sizes=file_sizes)
+    # Imports don't depend on the API reference, so their cache entries are shared between references.
+    version = reference_version(lib_dict) if mode != "imports" else ""
+    if lenient_imports:
+        version += ":lenient_imports"
+    cache_path = cache.cache_path if cache is not None else None
+    prefilter = build_reference_prefilter(lib_dict) if mode == "full" and use_prefilter else None
+    cache_hits = cache_misses = n_skipped = n_prefiltered = 0
+    profile_stats = None
+    if archive_root is None:
+        worker_func, tasks = process_batch_in_worker, batches
+    else:
+        worker_func, tasks = process_archives_in_worker, [(batch, archive_root, tuple(suffixes)) for batch in batches]
+    print(f'Dispatching {len(code_files)} {"files" if archive_root is None else "archives"} in {len(batches)} batches to {workers} workers')
+    # Objects existing before the fork are moved out of the garbage collector's reach,
+    # so collections in the workers don't touch (and copy) the pages holding the reference.
+    gc.freeze()
+    try:
+        with Pool(processes=workers, initializer=init_worker, initargs=(process_file_func, lib_dict, logger, mode, cache_path, version, max_file_bytes, file_timeout, prefilter,
+                                                                          metrics.slowest_files if metrics is not None else None, profile_output_file is not None, lenient_imports)) as pool:
+            for counter, hit_keys, new_entries, skipped, batch_prefiltered, batch_metrics, batch_profile_stats in pool.imap_unordered(worker_func, tasks):
+                if batch_metrics is not None:
+                    metrics.merge(batch_metrics)
+                if batch_profile_stats is not None:
+                    profile_stats = merge_profile_stats(profile_stats, batch_profile_stats)
+                n_skipped += len(skipped)
+                n_prefiltered += batch_prefiltered
+                if skipped_files is not None:
+                    skipped_files.extend(skipped)
+                if cache is not None:
+                    cache.update(new_entries, hit_keys)
+                    cache_hits += len(hit_keys)
+                    cache_misses += len(new_entries)
+                if counter:
+                    yield counter
+    finally:
+        gc.unfreeze()
+    print(f'Peak worker RSS: {resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024:.1f} MB')
+    print(f'Skipped files: {n_skipped}')
+    if prefilter is not None:
+        print(f'Files without any reference module name (not parsed): {n_prefiltered}')
+    if cache is not None:
+        print(f'Cache hits: {cache_hits}, misses: {cache_misses}, evicted entries: {cache.evict()}')
+    if metrics is not None:
+        metrics.count('files' if archive_root is None else 'archives', len(code_files))
+        metrics.count('batches', len(batches))
+        metrics.count('skipped', n_skipped)
+        metrics.count('prefiltered', n_prefiltered)
+        metrics.count('cache_hits', cache_hits)
+    if profile_stats is not None:
+        profile_stats.dump_stats(profile_output_file)
+        print(f'Merged profile of the workers saved to {profile_output_file}, top functions by cumulative time:')
+        profile_stats.sort_stats('cumulative').print_stats(15)
+
+
+def reference_output_path(output_file: str, reference: str) -> str:
+    return f"{output_file.removesuffix('.parquet')}.{reference}.parquet"
+
+
+def concatenate_and_save(counters: Iterable[Counter], output_file: str, row_group_size: int = DEFAULT_ROW_GROUP_SIZE, module_references: Optional[Dict[str, Tuple[str, ...]]] = None, output_per_reference: bool = False, imports_output_file: Optional[str] = None, metrics: Optional[Metrics] = None) -> None:
     """
-    Concatenate the given list of DataFrames and save the result to a parquet file.
+    Stream the given Counters into a parquet file.
 
-    If the DataFrames contain a 'count' column, the function will group by the 'filename', 'module', 
-    'component_type', and 'component_name' columns and sum the 'count' column. If the 'count' column 
-    does not exist, the function will simply concatenate the DataFrames.
+    Every file is processed exactly once and its Counter is already aggregated per
+    (filename, module, component_type, component_name), so the rows are final as they arrive
+    and only one row group has to be held in memory.
 
     Parameters:
-    df_list: A list of DataFrames.
+    counters: An iterable of Counters returned by process_file.
     output_file: Path to the output parquet file.
+    row_group_size: Number of rows per parquet row group.
+    module_references: For 'full' mode runs over several references, the names of the references defining each
+                       module (see combine_library_references); the rows are then saved with a 'reference' column.
+    output_per_reference: With module_references, save the rows of each reference without the 'reference' column
+                          to its own file (see reference_output_path) instead.
+    imports_output_file: For 'both' mode, path to the parquet file receiving the (filename, module) rows.
+    metrics: Metrics receiving the time spent writing (as wall time 'write'), None to skip timing.
 
     Returns:
     None
     """
-    df_concat = pd.concat(df_list)
-    if 'count' in df_concat.columns:
-        df_final = df_concat.groupby(['filename', 'module', 'component_type', 'component_name'], as_index=False).sum()
-    else:
-        df_final = df_concat
-    df_final.to_parquet(output_file, engine="pyarrow")
+    with ExitStack() as stack:
+        def open_writer(path: str, schema: Optional[pa.Schema] = None) -> ParquetCounterWriter:
+            return stack.enter_context(ParquetCounterWriter(path, row_group_size, schema))
+
+        imports_writer = open_writer(imports_output_file, IMPORT_SCHEMA) if imports_output_file is not None else None
+        if module_references is None:
+            writers = {None: open_writer(output_file, COMPONENT_SCHEMA if imports_writer is not None else None)}
+        elif output_per_reference:
+            references = sorted({reference for module_reference_names in module_references.values() for reference in module_reference_names})
+            writers = {reference: open_writer(reference_output_path(output_file, reference), COMPONENT_SCHEMA) for reference in references}
+        else:
+            writers = {None: open_writer(output_file, REFERENCE_COMPONENT_SCHEMA)}
+
+        for counter in counters:
+            start = time.perf_counter() if metrics is not None else 0.0
+            if imports_writer is not None:
+                imports_writer.write({key: count for key, count in counter.items() if len(key) == len(IMPORT_COLUMNS)})
+                counter = {key: count for key, count in counter.items() if len(key) != len(IMPORT_COLUMNS)}
+            if module_references is None:
+                writers[None].write(counter)
+            elif not output_per_reference:
+                writers[None].write({(reference, *key): count for key, count in counter.items() for reference in module_references[key[1]]})
+            else:
+                reference_counters = defaultdict(dict)
+                for key, count in counter.items():
+                    for reference in module_references[key[1]]:
+                        reference_counters[reference][key] = count
+                for reference, reference_counter in reference_counters.items():
+                    writers[reference].write(reference_counter)
+            if metrics is not None:
+                _lap(metrics.wall_seconds, "write", start)
+        start = time.perf_counter() if metrics is not None else 0.0
+    if metrics is not None:
+        _lap(metrics.wall_seconds, "write", start)
+
+    print(f'Rows written: {sum(writer.rows_written for writer in writers.values())}')
+    if imports_writer is not None:
+        print(f'Import rows written: {imports_writer.rows_written}')
@@ -1,33 +1,204 @@
+import os
+import time
+import hashlib
 import argparse
 
-from src.utils import setup_logger, find_python_files, load_library_reference
-from src.lib_elements_counter import process_files_in_parallel, process_file, concatenate_and_save
+from src.utils import DEFAULT_ROW_GROUP_SIZE, DEFAULT_CHUNK_BYTES, DEFAULT_MAX_FILE_BYTES, DEFAULT_FILE_TIMEOUT, MANIFEST_FILENAME, setup_logger, save_skipped_files_report, discover_files, load_library_reference, reference_version, reference_name, combine_library_references
+from src.analysis_cache import CACHE_FILENAME, DEFAULT_CACHE_MAX_BYTES, AnalysisCache
+from src.lib_elements_counter import process_files_in_parallel, process_file, concatenate_and_save, reference_output_path
+from src.metrics import DEFAULT_SLOWEST_FILES, Metrics, print_metrics, save_metrics
+from src.corpus_archives import find_archives, count_archives
+from src.normalized import normalize_tables
+from src.partitioned import PARTITION_COLUMNS, partition_tables
+from src.shards import DEFAULT_STALE_LOCK_SECONDS, IMPORTS_TABLE, count_top_level_directories, plan_shards, load_or_create_shard_plan, is_shard_done, claim_shard, complete_shard, shard_name, shard_output_path
+
+
+def analyse(args, logger, lib_dict, module_references, dir_range, output_parquet_path, imports_output_parquet_path, skipped_report_path, manifest_path, cache, metrics_path=None, profile_path=None):
+    metrics = Metrics(args.slowest_files) if args.metrics else None
+    print("Updating list of Python files...")
+    start = run_start = time.perf_counter()
+    if args.archive_directory:
+        file_sizes = find_archives(args.archive_directory, dir_range)
+        code_files = list(file_sizes)
+        print(f"Found {len(code_files)} archives in {time.perf_counter() - start:.2f} s")
+    else:
+        file_info = discover_files(args.input_python_files_path, tuple(args.file_types), dir_range, manifest_path=manifest_path)
+        code_files = list(file_info)
+        file_sizes = {path: size for path, (size, _) in file_info.items()}
+        print(f"Found {len(code_files)} files in {time.perf_counter() - start:.2f} s")
+    if metrics is not None:
+        metrics.add_wall("discover", time.perf_counter() - start)
+
+    if args.mode == "full":
+        print("Counting library components occurrences...")
+    elif args.mode == "both":
+        print("Counting library components occurrences and extracting import information...")
+    else:
+        print("Extracting import information...")
+    skipped_files = []
+    counters = process_files_in_parallel(process_file, lib_dict, code_files, logger, mode=args.mode, workers=args.workers, chunk_bytes=args.chunk_bytes, cache=cache, file_sizes=file_sizes,
+                                         max_file_bytes=int(args.max_file_mb * 1024 * 1024) if args.max_file_mb > 0 else None, file_timeout=args.file_timeout if args.file_timeout > 0 else None, skipped_files=skipped_files, use_prefilter=not args.no_prefilter,
+                                         metrics=metrics, profile_output_file=profile_path if args.profile else None, archive_root=args.input_python_files_path if args.archive_directory else None,
+                                         suffixes=tuple(args.file_types), lenient_imports=args.lenient_imports)
+    concatenate_and_save(counters, output_parquet_path, args.row_group_size, module_references, args.output_per_reference, imports_output_parquet_path, metrics)
+    save_skipped_files_report(skipped_files, skipped_report_path)
+    if metrics is not None:
+        metrics.add_wall("total", time.perf_counter() - run_start)
+        print_metrics(metrics)
+        save_metrics(metrics, metrics_path, {"mode": args.mode, "workers": args.workers or os.cpu_count(), "input_python_files_path": args.input_python_files_path, "dir_range": list(dir_range)})
+        print(f"Metrics saved to {metrics_path}")
+    return len(code_files)
+
+
+def output_tables(args, module_references, output_parquet_path, imports_output_parquet_path):
+    if args.mode == "imports":
+        tables = {"imports": output_parquet_path}
+    elif module_references is not None and args.output_per_reference:
+        tables = {f"components.{reference}": reference_output_path(output_parquet_path, reference) for reference in sorted({name for names in module_references.values() for name in names})}
+    else:
+        tables = {"components": output_parquet_path}
+    if imports_output_parquet_path is not None:
+        tables["imports"] = imports_output_parquet_path
+    return tables
+
+
+def save_normalized(args, tables):
+    rows_written = normalize_tables(tables, args.normalized_directory, args.input_python_files_path, args.row_group_size)
+    print(f"Normalized dataset in {args.normalized_directory}: " + ", ".join(f"{table} {rows} rows" for table, rows in rows_written.items()))
+
+
+def save_partitioned(args, tables):
+    rows_written = partition_tables(tables, args.partitioned_directory, args.input_python_files_path, args.partition_by, args.row_group_size)
+    print(f"Datasets partitioned by {args.partition_by} in {args.partitioned_directory}: " + ", ".join(f"{table} {rows} rows" for table, rows in rows_written.items()))
+
+
+def analyse_shards(args, logger, lib_dict, module_references, manifest_path, cache):
+    n_directories = count_archives(args.archive_directory) if args.archive_directory else count_top_level_directories(args.input_python_files_path)
+    run_settings = {"input_python_files_path": os.path.abspath(args.input_python_files_path), "mode": args.mode, "file_types": sorted(args.file_types),
+                    "reference_version": reference_version(lib_dict) if args.mode != "imports" else "", "shard_size": args.shard_size, "dir_range": args.dir_range,
+                    "references": sorted({name for names in (module_references or {}).values() for name in names})}
+    if args.archive_directory:
+        run_settings["archive_directory"] = os.path.abspath(args.archive_directory)
+    if args.lenient_imports:
+        run_settings["lenient_imports"] = True
+    shards = load_or_create_shard_plan(args.shards_directory, plan_shards(n_directories, args.shard_size, tuple(args.dir_range)), run_settings)
+
+    for i, shard in enumerate(shards):
+        if is_shard_done(args.shards_directory, shard):
+            continue
+        if not claim_shard(args.shards_directory, shard, args.stale_lock_seconds):
+            print(f"Shard {shard_name(shard)} is being processed elsewhere, skipping")
+            continue
+        print(f"Shard {i + 1}/{len(shards)}: top-level directories {shard[0]}-{shard[1]}")
+        start = time.perf_counter()
+        temporary_output_path = f"{shard_output_path(args.shards_directory, shard)}.{os.getpid()}.tmp"
+        temporary_imports_output_path = f"{shard_output_path(args.shards_directory, shard, IMPORTS_TABLE)}.{os.getpid()}.tmp" if args.mode == "both" else None
+        skipped_report_path = os.path.join(args.shards_directory, f"{shard_name(shard)}.skipped.csv")
+        n_files = analyse(args, logger, lib_dict, module_references, shard, temporary_output_path, temporary_imports_output_path, skipped_report_path, manifest_path, cache,
+                          os.path.join(args.shards_directory, f"{shard_name(shard)}.metrics.json"), os.path.join(args.shards_directory, f"{shard_name(shard)}.prof"))
+        complete_shard(args.shards_directory, shard, temporary_output_path, {"files": n_files, "seconds": time.perf_counter() - start}, temporary_imports_output_path)
+
+    done = sum(is_shard_done(args.shards_directory, shard) for shard in shards)
+    print(f"Shards done: {done}/{len(shards)}" + (", merge them with src.merge_shards" if done == len(shards) else ""))
+
+
+def local_state_directory(shards_directory):
+    # The analysis cache (a SQLite database in WAL mode, which needs memory shared on one host) and the file manifest of
+    # a sharded run are kept on local disk, one directory per shards directory, as the shards directory may be on a network filesystem.
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    run_id = hashlib.sha1(os.path.abspath(shards_directory).encode()).hexdigest()[:16]
+    return os.path.join(cache_home, "python_repo_analysis", run_id)
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--library_pickle_path", default="./api_reference_pickles/standard_library.pickle", help="Path to the pickle file containing API reference")
+    parser.add_argument("--library_pickle_path", nargs="+", default=["./api_reference_pickles/standard_library.pickle"], help="Path to the pickle file containing API reference (raw or compiled with src.compile_reference); several references are analysed in the same pass")
     parser.add_argument("--output_parquet_path", default="./data/py_imports_python_repos.parquet", help="Path and/or the filename for the output")
     parser.add_argument("--input_python_files_path", default="/media/tobiasz/crucial/python_repos/", help="Path to analysed repositories")
-    parser.add_argument("--mode", default="imports", choices=["full", "imports"], help="Mode of operation: 'full' for full analysis or 'imports' for filenames and imports only")
+    parser.add_argument("--archive_directory", default=None, help="Read the repositories from the corpus archives in this directory (see src.corpus_archives) instead of their checkouts; "
+                                                                  "the files keep the names they have below --input_python_files_path, and --dir_range and --shard_size count archives")
+    parser.add_argument("--mode", default="imports", choices=["full", "imports", "both"], help="Mode of operation: 'full' for full analysis, 'imports' for filenames and imports only or 'both' for the two tables from a single parse of each file")
+    parser.add_argument("--lenient_imports", action="store_true", help="In 'imports' and 'both' modes, also report the imports of files that don't parse (e.g. Python 2 files), "
+                                                                       "which have no rows by default, as in the component counts; 'imports' mode then finds imports without parsing whole files, several times faster")
+    parser.add_argument("--imports_output_parquet_path", default=None, help="With '--mode both', path for the imports table, defaults to <output stem>.imports.parquet (the component counts go to --output_parquet_path)")
+    parser.add_argument("--output_per_reference", action="store_true", help="With several references in 'full' mode, write one output per reference (<output stem>.<reference>.parquet) instead of one output with a 'reference' column")
+    parser.add_argument("--normalized_directory", default=None, help="Also write the output as a normalized dataset (repo and file id tables plus dictionary-encoded fact tables) into this directory")
+    parser.add_argument("--partitioned_directory", default=None, help="Also write each output table as a hive-partitioned dataset (<directory>/<table>/library=.../) for the query backend of the notebooks")
+    parser.add_argument("--partition_by", default="library", choices=PARTITION_COLUMNS, help="Partition column of --partitioned_directory")
+    parser.add_argument("--row_group_size", type=int, default=DEFAULT_ROW_GROUP_SIZE, help="Number of rows per parquet row group, bounds the memory used for buffering results")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes, defaults to the number of CPUs")
+    parser.add_argument("--chunk_bytes", "--chunk-bytes", type=int, default=DEFAULT_CHUNK_BYTES, help="Target total size in bytes of the files sent to a worker as one task")
+    parser.add_argument("--file_types", nargs="+", default=[".py"], help="File extensions to analyse, e.g. '.py .ipynb', found in a single pass over the input")
+    parser.add_argument("--dir_range", nargs=2, type=int, default=[0, 10**12], metavar=("FIRST", "LAST"), help="First and last top-level directory (in sorted order) to analyse")
+    parser.add_argument("--manifest_path", default=None, help=f"Path to the file manifest used to skip unchanged directories, defaults to {MANIFEST_FILENAME} next to the output "
+                                                              "(in a local directory of ~/.cache/python_repo_analysis for sharded runs)")
+    parser.add_argument("--no_cache", "--no-cache", action="store_true", help="Process every file and rescan every directory, without reading or updating the analysis cache and the file manifest")
+    parser.add_argument("--cache_path", default=None, help=f"Path to the analysis cache, defaults to {CACHE_FILENAME} next to the output (in a local directory of ~/.cache/python_repo_analysis "
+                                                           "for sharded runs, as SQLite's WAL mode doesn't work on network filesystems); don't share one between machines")
+    parser.add_argument("--cache_max_mb", type=int, default=DEFAULT_CACHE_MAX_BYTES // (1024 * 1024), help="Size limit of the analysis cache, least recently used entries are evicted above it")
+    parser.add_argument("--no_prefilter", "--no-prefilter", action="store_true", help="In 'full' mode, parse every file, including those in which no module of the reference is mentioned")
+    parser.add_argument("--shards_directory", default=None, help="Run in shards, writing one parquet part per shard into this directory; rerunning skips finished shards and several machines can share it")
+    parser.add_argument("--shard_size", type=int, default=100, help="Number of top-level directories per shard")
+    parser.add_argument("--stale_lock_seconds", type=float, default=DEFAULT_STALE_LOCK_SECONDS, help="Age after which a shard claimed by a run that never finished it is taken over")
+    parser.add_argument("--metrics", action="store_true", help="Time the stages of the run, print them with the slowest files and save them to <output stem>.metrics.json (next to the parts in sharded runs)")
+    parser.add_argument("--slowest_files", type=int, default=DEFAULT_SLOWEST_FILES, help="Number of slowest files kept with '--metrics'")
+    parser.add_argument("--profile", action="store_true", help="Profile the workers with cProfile and save the merged stats to <output stem>.prof")
+    parser.add_argument("--max_file_mb", type=float, default=DEFAULT_MAX_FILE_BYTES / (1024 * 1024), help="Files larger than this are skipped (0 for no limit)")
+    parser.add_argument("--file_timeout", type=float, default=DEFAULT_FILE_TIMEOUT, help="Wall-clock seconds after which a single file is abandoned (0 for no timeout)")
     args = parser.parse_args()
+    reference_names = [reference_name(path) for path in args.library_pickle_path]
+    if len(set(reference_names)) < len(reference_names):
+        parser.error(f"References need distinct file names, got {', '.join(reference_names)}")
+    if args.normalized_directory and args.shards_directory:
+        parser.error("--normalized_directory can't be used with --shards_directory, pass it to src.merge_shards instead")
+    if args.partitioned_directory and args.shards_directory:
+        parser.error("--partitioned_directory can't be used with --shards_directory, pass it to src.merge_shards instead")
+    if args.output_per_reference and args.shards_directory:
+        parser.error("--output_per_reference can't be used with --shards_directory, the merged output has a 'reference' column instead")
 
     logger = setup_logger()
 
     print("Loading library reference...")
-    lib_dict = load_library_reference(args.library_pickle_path)
-    print("Updating list of Python files...")
-    code_files = find_python_files(args.input_python_files_path, filetype='.py')
+    start = time.perf_counter()
+    references = {name: load_library_reference(path) for name, path in zip(reference_names, args.library_pickle_path)}
+    if len(references) == 1:
+        lib_dict, module_references = references[reference_names[0]], None
+    else:
+        lib_dict, module_references = combine_library_references(references)
+    print(f"Loaded {len(lib_dict)} modules from {len(references)} references in {time.perf_counter() - start:.3f} s")
+    if args.mode == "imports":
+        module_references = None
 
-    if args.mode == "full":
-        print("Counting library components occurrences...")
+    if args.shards_directory:
+        output_directory = local_state_directory(args.shards_directory)
+        if not args.no_cache:
+            os.makedirs(output_directory, exist_ok=True)
     else:
-        print("Extracting import information...")
-    df_list = process_files_in_parallel(process_file, lib_dict, code_files, logger, mode=args.mode)
+        output_directory = os.path.dirname(os.path.abspath(args.output_parquet_path))
+    manifest_path = None if args.no_cache else args.manifest_path or os.path.join(output_directory, MANIFEST_FILENAME)
+    cache = None
+    if not args.no_cache:
+        cache_path = args.cache_path or os.path.join(output_directory, CACHE_FILENAME)
+        cache = AnalysisCache(cache_path, max_bytes=args.cache_max_mb * 1024 * 1024)
 
-    print("Saving data to parquet...")
-    concatenate_and_save(df_list, args.output_parquet_path)
+    if args.shards_directory:
+        analyse_shards(args, logger, lib_dict, module_references, manifest_path, cache)
+    else:
+        output_stem = args.output_parquet_path.removesuffix('.parquet')
+        skipped_report_path = f"{output_stem}.skipped.csv"
+        imports_output_parquet_path = None
+        if args.mode == "both":
+            imports_output_parquet_path = args.imports_output_parquet_path or f"{output_stem}.imports.parquet"
+        analyse(args, logger, lib_dict, module_references, tuple(args.dir_range), args.output_parquet_path, imports_output_parquet_path, skipped_report_path, manifest_path, cache,
+                f"{output_stem}.metrics.json", f"{output_stem}.prof")
+        tables = output_tables(args, module_references, args.output_parquet_path, imports_output_parquet_path)
+        if args.normalized_directory:
+            save_normalized(args, tables)
+        if args.partitioned_directory:
+            save_partitioned(args, tables)
+    if cache is not None:
+        cache.close()
     print("DONE")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
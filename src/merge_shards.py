@@ -0,0 +1,43 @@
+import os
+import json
+import argparse
+
+from src.utils import DEFAULT_ROW_GROUP_SIZE
+from src.shards import SHARD_PLAN_FILENAME, IMPORTS_TABLE, merge_shards
+from src.normalized import normalize_tables
+from src.partitioned import PARTITION_COLUMNS, partition_tables
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge the parquet parts of a sharded run of src.main into a single parquet file.")
+    parser.add_argument("--shards_directory", required=True, help="Directory with the shard parts, as passed to src.main")
+    parser.add_argument("--output_parquet_path", required=True, help="Path and/or the filename for the merged output")
+    parser.add_argument("--imports_output_parquet_path", default=None, help="For runs with '--mode both', path for the merged imports table")
+    parser.add_argument("--normalized_directory", default=None, help="Also write the merged output as a normalized dataset into this directory")
+    parser.add_argument("--partitioned_directory", default=None, help="Also write each merged table as a hive-partitioned dataset into this directory")
+    parser.add_argument("--partition_by", default="library", choices=PARTITION_COLUMNS, help="Partition column of --partitioned_directory")
+    parser.add_argument("--row_group_size", type=int, default=None, help="Maximum number of rows per row group, defaults to the row groups of the parts")
+    args = parser.parse_args()
+
+    rows_written = merge_shards(args.shards_directory, args.output_parquet_path, args.row_group_size)
+    print(f"Merged {rows_written} rows into {args.output_parquet_path}")
+    if args.imports_output_parquet_path:
+        rows_written = merge_shards(args.shards_directory, args.imports_output_parquet_path, args.row_group_size, IMPORTS_TABLE)
+        print(f"Merged {rows_written} rows into {args.imports_output_parquet_path}")
+
+    if args.normalized_directory or args.partitioned_directory:
+        with open(os.path.join(args.shards_directory, SHARD_PLAN_FILENAME)) as f:
+            run_settings = json.load(f)["run_settings"]
+        tables = {"imports" if run_settings["mode"] == "imports" else "components": args.output_parquet_path}
+        if args.imports_output_parquet_path:
+            tables["imports"] = args.imports_output_parquet_path
+        if args.normalized_directory:
+            rows_written = normalize_tables(tables, args.normalized_directory, run_settings["input_python_files_path"], args.row_group_size or DEFAULT_ROW_GROUP_SIZE)
+            print(f"Normalized dataset in {args.normalized_directory}: " + ", ".join(f"{table} {rows} rows" for table, rows in rows_written.items()))
+        if args.partitioned_directory:
+            rows_written = partition_tables(tables, args.partitioned_directory, run_settings["input_python_files_path"], args.partition_by, args.row_group_size or DEFAULT_ROW_GROUP_SIZE)
+            print(f"Datasets partitioned by {args.partition_by} in {args.partitioned_directory}: " + ", ".join(f"{table} {rows} rows" for table, rows in rows_written.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import json
+import heapq
+import pstats
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+
+DEFAULT_SLOWEST_FILES = 20
+# Stages timed in process_file, in the order they run.
+FILE_STAGES = ("read", "convert_notebook", "extract_imports", "parse", "find_imports", "visit")
+
+
+class Metrics:
+    """
+    Cumulative time per stage, counters and the slowest files of a run.
+
+    Workers fill one instance per batch and send it back with the batch, the parent merges them into the run's
+    instance, so nothing is shared between processes. stage_seconds are summed over the workers, wall_seconds
+    are measured in the parent (discovery, writing...).
+    """
+
+    def __init__(self, slowest_files: int = DEFAULT_SLOWEST_FILES):
+        self.stage_seconds = defaultdict(float)
+        self.wall_seconds = defaultdict(float)
+        self.counters = Counter()
+        self.slowest_files = slowest_files
+        self._slowest = []
+
+    def add_time(self, stage: str, seconds: float) -> None:
+        self.stage_seconds[stage] += seconds
+
+    def add_wall(self, stage: str, seconds: float) -> None:
+        self.wall_seconds[stage] += seconds
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] += n
+
+    def add_file(self, code_file: str, seconds: float, stages: Dict[str, float]) -> None:
+        """
+        Add the stage times of one processed file, keeping it if it is among the slowest_files slowest.
+        """
+        for stage, stage_seconds in stages.items():
+            self.stage_seconds[stage] += stage_seconds
+        self.stage_seconds["file_total"] += seconds
+        self.counters["files_processed"] += 1
+        entry = (seconds, code_file, stages)
+        if len(self._slowest) < self.slowest_files:
+            heapq.heappush(self._slowest, entry)
+        elif seconds > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, entry)
+
+    def merge(self, other: "Metrics") -> None:
+        for stage, seconds in other.stage_seconds.items():
+            self.stage_seconds[stage] += seconds
+        for stage, seconds in other.wall_seconds.items():
+            self.wall_seconds[stage] += seconds
+        self.counters.update(other.counters)
+        for entry in other._slowest:
+            if len(self._slowest) < self.slowest_files:
+                heapq.heappush(self._slowest, entry)
+            elif entry[0] > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def slowest(self) -> List[Tuple[float, str, Dict[str, float]]]:
+        return sorted(self._slowest, key=lambda entry: entry[0], reverse=True)
+
+    def to_dict(self) -> Dict:
+        return {"wall_seconds": dict(sorted(self.wall_seconds.items())), "stage_seconds": dict(sorted(self.stage_seconds.items())), "counters": dict(sorted(self.counters.items())),
+                "slowest_files": [{"filename": code_file, "seconds": seconds, "stages": stages} for seconds, code_file, stages in self.slowest()]}
+
+
+def print_metrics(metrics: Metrics, n_files: int = 10) -> None:
+    print("Wall time: " + ", ".join(f"{stage} {seconds:.3f} s" for stage, seconds in metrics.wall_seconds.items()))
+    print("Time per stage (summed over workers):")
+    for stage, seconds in sorted(metrics.stage_seconds.items(), key=lambda item: item[1], reverse=True):
+        print(f"  {stage:20s} {seconds:10.3f} s")
+    print("Counters: " + ", ".join(f"{name} {value}" for name, value in sorted(metrics.counters.items())))
+    print("Slowest files:")
+    for seconds, code_file, stages in metrics.slowest()[:n_files]:
+        print(f"  {seconds:8.3f} s {code_file} (" + ", ".join(f"{stage} {stage_seconds:.3f}" for stage, stage_seconds in stages.items()) + ")")
+
+
+def save_metrics(metrics: Metrics, output_file: str, run_info: Optional[Dict] = None) -> None:
+    """
+    Save the metrics of a run as JSON, together with run_info (settings, file counts...).
+    """
+    with open(output_file, "w") as f:
+        json.dump({**(run_info or {}), **metrics.to_dict()}, f, indent=2)
+
+
+class ProfileStats:
+    # The stats dict of a cProfile.Profile sent back from a worker, in the form pstats.Stats loads.
+    def __init__(self, stats: Dict):
+        self.stats = stats
+
+    def create_stats(self) -> None:
+        pass
+
+
+def merge_profile_stats(merged: Optional[pstats.Stats], stats: Dict) -> pstats.Stats:
+    if merged is None:
+        return pstats.Stats(ProfileStats(stats))
+    merged.add(ProfileStats(stats))
+    return merged
@@ -0,0 +1,24 @@
+import argparse
+
+from src.utils import DEFAULT_ROW_GROUP_SIZE
+from src.normalized import normalize_tables
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert flat outputs of src.main into a normalized dataset (repo and file id tables plus dictionary-encoded fact tables).")
+    parser.add_argument("--components_parquet_path", default=None, help="Flat component counts ('full' mode output)")
+    parser.add_argument("--imports_parquet_path", default=None, help="Flat imports ('imports' mode output)")
+    parser.add_argument("--root", required=True, help="Directory containing the analysed repositories, e.g. the --input_python_files_path of the run")
+    parser.add_argument("--normalized_directory", required=True, help="Output directory of the normalized dataset")
+    parser.add_argument("--row_group_size", type=int, default=DEFAULT_ROW_GROUP_SIZE, help="Number of rows converted at a time")
+    args = parser.parse_args()
+
+    tables = {table: path for table, path in (("components", args.components_parquet_path), ("imports", args.imports_parquet_path)) if path}
+    if not tables:
+        parser.error("Give --components_parquet_path and/or --imports_parquet_path")
+    rows_written = normalize_tables(tables, args.normalized_directory, args.root, args.row_group_size)
+    print(", ".join(f"{table}: {rows} rows" for table, rows in rows_written.items()))
+
+
+if __name__ == "__main__":
+    main()
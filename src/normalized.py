@@ -0,0 +1,106 @@
+import os
+from typing import Dict, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.utils import DEFAULT_ROW_GROUP_SIZE
+
+
+REPOS_TABLE = "repos"
+FILES_TABLE = "files"
+NORMALIZED_COMPRESSION = "zstd"
+REPOS_SCHEMA = pa.schema([("repo_id", pa.int32()), ("repo", pa.string())])
+FILES_SCHEMA = pa.schema([("file_id", pa.int32()), ("repo_id", pa.int32()), ("path", pa.string())])
+# Columns with a handful of distinct values get one-byte dictionary indices, other strings four-byte ones.
+SMALL_DICTIONARY_COLUMNS = ("reference", "component_type")
+
+
+def split_repo_path(filename: str, root: str) -> Tuple[str, str]:
+    """
+    Split a path of an analysed file into its repository (the top-level directory below root) and the path inside it.
+    Relative paths (e.g. from a run given a relative input directory) are resolved against the working directory.
+
+    Raises:
+    ValueError if the file is not below root.
+    """
+    prefix = root.rstrip("/") + "/"
+    if not filename.startswith(prefix):
+        filename = os.path.abspath(filename)
+        prefix = os.path.abspath(root) + "/"
+    if not filename.startswith(prefix):
+        raise ValueError(f"{filename} is not below the root directory {root}")
+    repo, _, path = filename[len(prefix):].partition("/")
+    return (repo, path) if path else ("", repo)
+
+
+def normalized_table_path(directory: str, table: str) -> str:
+    return os.path.join(directory, f"{table}.parquet")
+
+
+def _fact_schema(schema: pa.Schema) -> pa.Schema:
+    fields = [pa.field("file_id", pa.int32())]
+    for field in schema:
+        if field.name == "filename" or field.name.startswith("__index_level_"):
+            continue
+        if field.name == "count":
+            fields.append(pa.field("count", pa.int32()))
+        else:
+            fields.append(pa.field(field.name, pa.dictionary(pa.int8() if field.name in SMALL_DICTIONARY_COLUMNS else pa.int32(), pa.string())))
+    return pa.schema(fields)
+
+
+def normalize_tables(tables: Dict[str, str], output_directory: str, root: str, row_group_size: int = DEFAULT_ROW_GROUP_SIZE) -> Dict[str, int]:
+    """
+    Convert flat outputs of the counter into a normalized dataset sharing one repository and one file table.
+
+    The output directory holds repos.parquet (repo_id, repo), files.parquet (file_id, repo_id, path inside the repo)
+    and one fact table per input, in which the filename is replaced by file_id, the other strings are dictionary
+    encoded and counts are int32. All tables are compressed with zstd. The inputs are read one row group at a time.
+
+    Parameters:
+    tables: A dictionary mapping names of the fact tables (e.g. 'components', 'imports') to flat parquet files.
+    output_directory: Directory for the normalized dataset, created if needed.
+    root: Directory containing the analysed repositories, stripped from the filenames.
+    row_group_size: Maximum number of rows read and written at a time.
+
+    Returns:
+    A dictionary mapping the names of the written tables to their numbers of rows.
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    repo_ids, file_ids = {}, {}
+    files = {"repo_id": [], "path": []}
+    rows_written = {}
+
+    for table, input_file in tables.items():
+        parquet_file = pq.ParquetFile(input_file)
+        schema = _fact_schema(parquet_file.schema_arrow)
+        rows_written[table] = 0
+        with pq.ParquetWriter(normalized_table_path(output_directory, table), schema, compression=NORMALIZED_COMPRESSION) as writer:
+            for batch in parquet_file.iter_batches(batch_size=row_group_size):
+                # Filenames are looked up once per distinct value of the batch instead of once per row.
+                encoded_filenames = batch.column("filename").dictionary_encode()
+                dictionary_file_ids = []
+                for filename in encoded_filenames.dictionary.to_pylist():
+                    file_id = file_ids.get(filename)
+                    if file_id is None:
+                        repo, path = split_repo_path(filename, root)
+                        file_id = file_ids[filename] = len(file_ids)
+                        files["repo_id"].append(repo_ids.setdefault(repo, len(repo_ids)))
+                        files["path"].append(path)
+                    dictionary_file_ids.append(file_id)
+                columns = [pa.array(dictionary_file_ids, pa.int32()).take(encoded_filenames.indices)]
+                for field in list(schema)[1:]:
+                    column = batch.column(field.name)
+                    columns.append(column.cast(pa.int32()) if field.name == "count" else column.dictionary_encode().cast(field.type))
+                writer.write_table(pa.Table.from_arrays(columns, schema=schema), row_group_size=row_group_size)
+                rows_written[table] += batch.num_rows
+
+    repos = pa.Table.from_arrays([pa.array(range(len(repo_ids)), pa.int32()), pa.array(list(repo_ids), pa.string())], schema=REPOS_SCHEMA)
+    files_table = pa.Table.from_arrays([pa.array(range(len(file_ids)), pa.int32()), pa.array(files["repo_id"], pa.int32()), pa.array(files["path"], pa.string())],
+                                       schema=FILES_SCHEMA.with_metadata({"root": root}))
+    pq.write_table(repos, normalized_table_path(output_directory, REPOS_TABLE), compression=NORMALIZED_COMPRESSION)
+    pq.write_table(files_table, normalized_table_path(output_directory, FILES_TABLE), compression=NORMALIZED_COMPRESSION)
+    rows_written[REPOS_TABLE], rows_written[FILES_TABLE] = repos.num_rows, files_table.num_rows
+    return rows_written
+
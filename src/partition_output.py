@@ -0,0 +1,25 @@
+import argparse
+
+from src.utils import DEFAULT_ROW_GROUP_SIZE
+from src.partitioned import PARTITION_COLUMNS, partition_tables
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert flat outputs of src.main into hive-partitioned parquet datasets for the query backend of the notebooks.")
+    parser.add_argument("--components_parquet_path", default=None, help="Flat component counts ('full' mode output)")
+    parser.add_argument("--imports_parquet_path", default=None, help="Flat imports ('imports' mode output)")
+    parser.add_argument("--root", required=True, help="Directory containing the analysed repositories, e.g. the --input_python_files_path of the run")
+    parser.add_argument("--partitioned_directory", required=True, help="Output directory, holding one dataset per table")
+    parser.add_argument("--partition_by", default="library", choices=PARTITION_COLUMNS, help="Partition column of the datasets")
+    parser.add_argument("--row_group_size", type=int, default=DEFAULT_ROW_GROUP_SIZE, help="Number of rows converted at a time")
+    args = parser.parse_args()
+
+    tables = {table: path for table, path in (("components", args.components_parquet_path), ("imports", args.imports_parquet_path)) if path}
+    if not tables:
+        parser.error("Give --components_parquet_path and/or --imports_parquet_path")
+    rows_written = partition_tables(tables, args.partitioned_directory, args.root, args.partition_by, args.row_group_size)
+    print(", ".join(f"{table}: {rows} rows" for table, rows in rows_written.items()))
+
+
+if __name__ == "__main__":
+    main()
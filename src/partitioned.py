@@ -0,0 +1,87 @@
+import os
+import shutil
+from typing import Dict
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from src.utils import DEFAULT_ROW_GROUP_SIZE
+from src.normalized import NORMALIZED_COMPRESSION, split_repo_path
+
+
+PARTITION_COLUMNS = ("library", "module")
+
+
+def _partitioned_schema(schema: pa.Schema, partition_by: str) -> pa.Schema:
+    fields = [pa.field("repo", pa.string()), pa.field("filename", pa.string())]
+    fields += [field for field in schema if field.name != "filename" and not field.name.startswith("__index_level_")]
+    if partition_by == "library":
+        fields.append(pa.field("library", pa.string()))
+    return pa.schema(fields)
+
+
+def partition_table(input_file: str, output_directory: str, root: str, partition_by: str = "library", row_group_size: int = DEFAULT_ROW_GROUP_SIZE) -> int:
+    """
+    Convert a flat output of the counter into a hive-partitioned parquet dataset (<output_directory>/library=os/...),
+    so that queries on one library or module read only its partition.
+
+    Rows keep the columns of the input, with the filename split into the repository (the top-level directory
+    below root) and the path inside it, as transform_df of the notebooks does. The input is read one row group
+    at a time and an existing dataset in output_directory is replaced.
+
+    Parameters:
+    input_file: Flat parquet output of the counter (any mode).
+    output_directory: Directory of the dataset.
+    root: Directory containing the analysed repositories, stripped from the filenames.
+    partition_by: 'library' (the top-level package of the module) or 'module'.
+    row_group_size: Maximum number of rows read and written at a time.
+
+    Returns:
+    The number of written rows.
+    """
+    if partition_by not in PARTITION_COLUMNS:
+        raise ValueError(f"partition_by has to be one of {', '.join(PARTITION_COLUMNS)}, got {partition_by}")
+    parquet_file = pq.ParquetFile(input_file)
+    schema = _partitioned_schema(parquet_file.schema_arrow, partition_by)
+    rows_written = 0
+
+    def batches():
+        nonlocal rows_written
+        for batch in parquet_file.iter_batches(batch_size=row_group_size):
+            # The filenames and modules are split once per distinct value of the batch instead of once per row.
+            filenames = batch.column("filename").dictionary_encode()
+            repos, paths = zip(*(split_repo_path(filename, root) for filename in filenames.dictionary.to_pylist())) if len(filenames.dictionary) else ((), ())
+            columns = {"repo": pa.array(repos, pa.string()).take(filenames.indices), "filename": pa.array(paths, pa.string()).take(filenames.indices)}
+            if partition_by == "library":
+                modules = batch.column("module").dictionary_encode()
+                libraries = pc.list_element(pc.split_pattern(modules.dictionary, "."), 0)
+                columns["library"] = libraries.take(modules.indices)
+            rows_written += batch.num_rows
+            yield pa.RecordBatch.from_arrays([columns[field.name] if field.name in columns else batch.column(field.name) for field in schema], schema=schema)
+
+    if os.path.isdir(output_directory):
+        shutil.rmtree(output_directory)
+    ds.write_dataset(batches(), output_directory, schema=schema, format="parquet", partitioning=[partition_by], partitioning_flavor="hive",
+                     file_options=ds.ParquetFileFormat().make_write_options(compression=NORMALIZED_COMPRESSION), max_rows_per_group=row_group_size,
+                     max_partitions=1_000_000, existing_data_behavior="overwrite_or_ignore")
+    return rows_written
+
+
+def partition_tables(tables: Dict[str, str], output_directory: str, root: str, partition_by: str = "library", row_group_size: int = DEFAULT_ROW_GROUP_SIZE) -> Dict[str, int]:
+    """
+    Convert flat outputs of the counter into partitioned datasets, one per table, in subdirectories of output_directory.
+
+    Parameters:
+    tables: A dictionary mapping names of the tables (e.g. 'components', 'imports') to flat parquet files.
+    output_directory: Directory for the datasets, created if needed.
+    root: Directory containing the analysed repositories, stripped from the filenames.
+    partition_by: 'library' or 'module'.
+    row_group_size: Maximum number of rows read and written at a time.
+
+    Returns:
+    A dictionary mapping the names of the tables to their numbers of rows.
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    return {table: partition_table(input_file, os.path.join(output_directory, table), root, partition_by, row_group_size) for table, input_file in tables.items()}
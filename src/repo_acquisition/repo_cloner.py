@@ -1,57 +1,145 @@
 import os
-import time
-import subprocess
+import shutil
 import pickle
+import argparse
+import subprocess
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+from src.corpus_archives import ARCHIVE_FORMATS, DEFAULT_ARCHIVE_FORMAT, list_repository_files, write_archive
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 REPO_FILES_PICKLE = "repo_files_jupyter.pickle"
 REPOS_DIRECTORY = "shared/jupyter_repos"
+GITHUB_URL = "https://github.com"
+KEPT_SUFFIXES = (".py", ".ipynb", ".txt")
+DEFAULT_WORKERS = 8
+
+
+def run_git(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run(["git", *args], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+
+
+def clone_repo(repo_url: str, repo_dir: str, suffixes: Tuple[str, ...] = KEPT_SUFFIXES) -> List[str]:
+    """
+    Clone the latest commit of a repository, writing only the files with the given suffixes to disk.
+
+    The clone is shallow and filtered (blobs are fetched only for the checked out files), and the checkout is sparse,
+    so neither the history nor the other files are downloaded. The .git directory is removed afterwards.
+
+    Parameters:
+    repo_url: URL of the repository (https://, file://...).
+    repo_dir: Directory of the checkout.
+    suffixes: Suffixes of the files to check out.
+
+    Returns:
+    The names of all files of the repository, checked out or not, from the tree of the commit.
+
+    Raises:
+    subprocess.CalledProcessError if a git command fails.
+    """
+    run_git("clone", "--quiet", "--depth", "1", "--filter=blob:none", "--no-checkout", "--single-branch", repo_url, repo_dir)
+    tree = run_git("-C", repo_dir, "ls-tree", "-r", "-z", "--name-only", "HEAD").stdout.decode("utf-8", errors="surrogateescape")
+    run_git("-C", repo_dir, "sparse-checkout", "set", "--no-cone", *(f"*{suffix}" for suffix in suffixes))
+    run_git("-C", repo_dir, "checkout", "--quiet")
+    shutil.rmtree(os.path.join(repo_dir, ".git"))
+    return [os.path.basename(path) for path in tree.split("\0") if path]
+
+
+def _clone_or_log(repo: str, repo_url: str, repo_dir: str, suffixes: Tuple[str, ...], archive_path: Optional[str] = None, archive_format: str = DEFAULT_ARCHIVE_FORMAT) -> Optional[List[str]]:
+    logger.info(f"Cloning {repo}")
+    # git refuses to clone into a directory that isn't empty, a failed clone only removes the directory it created.
+    created = not os.path.exists(repo_dir)
+    try:
+        files = clone_repo(repo_url, repo_dir, suffixes)
+    except subprocess.CalledProcessError as e:
+        logger.error(f'Error cloning {repo}: {e.stderr.decode("utf-8", errors="replace")}')
+        if created:
+            shutil.rmtree(repo_dir, ignore_errors=True)
+        return None
+    if archive_path is not None:
+        write_archive(archive_path, list_repository_files(repo_dir, os.path.basename(repo_dir)), archive_format)
+        shutil.rmtree(repo_dir)
+    logger.info(f"Cloned {repo} successfully")
+    return files
+
 
+def clone_repos(pickle_file: str, directory: str = REPOS_DIRECTORY, workers: int = DEFAULT_WORKERS, base_url: str = GITHUB_URL, repo_files_pickle: str = REPO_FILES_PICKLE,
+                suffixes: Tuple[str, ...] = KEPT_SUFFIXES, archive_directory: Optional[str] = None, archive_format: str = DEFAULT_ARCHIVE_FORMAT) -> Dict[str, List[str]]:
+    """
+    Clone the repositories listed in a pickle into directory with a pool of workers, keeping only files with the given suffixes.
 
-def process_repo(repo_dir, repo_name, repo_files):
-    repo_files[repo_name] = []
-    for root, dirs, files in os.walk(repo_dir):
-        for file in files:
-            repo_files[repo_name].append(file)
-            if not file.endswith((".py", ".ipynb", ".txt")):
-                os.remove(os.path.join(root, file))
-    logger.info(f"Deleted unwanted files from {repo_name}")
+    Repositories whose directory (or archive) already exists are skipped, as are the repositories with the same name
+    as an earlier one in the list (their directories would be the same). The names of all files of every cloned repository
+    are saved in repo_files_pickle after each clone, so an interrupted run loses nothing.
+    With archive_directory, every checkout is packed into a corpus archive <repo name><suffix> (see corpus_archives)
+    and removed, so directory only holds the clones in progress.
 
+    Parameters:
+    pickle_file: Pickle with a list of repository names ('owner/name').
+    directory: Directory receiving one subdirectory per repository.
+    workers: Number of clones running at the same time.
+    base_url: URL under which the repositories are found as <owner>/<name>.git.
+    repo_files_pickle: Pickle mapping repository names to the names of their files, updated if it exists.
+    suffixes: Suffixes of the files to check out.
+    archive_directory: Directory receiving one archive per repository, None to keep the checkouts.
+    archive_format: Format of the archives, one of corpus_archives.ARCHIVE_FORMATS.
 
-def clone_repos(pickle_file, directory=REPOS_DIRECTORY, delay=1.1):
+    Returns:
+    The mapping of repository names to their file names.
+    """
     with open(pickle_file, "rb") as f:
         repos = pickle.load(f)
 
     try:
-        with open(REPO_FILES_PICKLE, "rb") as f:
+        with open(repo_files_pickle, "rb") as f:
             repo_files = pickle.load(f)
     except FileNotFoundError:
         repo_files = {}
 
-    for repo in repos:
-        repo_dir = f'{directory}/{repo.split("/")[-1]}'
-        repo_name = repo.split("/")[-1]
+    os.makedirs(directory, exist_ok=True)
+    if archive_directory is not None:
+        os.makedirs(archive_directory, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        submitted = set()
+        for repo in repos:
+            repo_name = repo.split("/")[-1]
+            repo_dir = f"{directory}/{repo_name}"
+            archive_path = os.path.join(archive_directory, f"{repo_name}{ARCHIVE_FORMATS[archive_format]}") if archive_directory is not None else None
+            if repo_name in submitted or os.path.exists(archive_path or repo_dir):
+                logger.info(f"Repo {repo} already cloned.")
+                continue
+            if archive_path is not None:
+                shutil.rmtree(repo_dir, ignore_errors=True)
+            submitted.add(repo_name)
+            futures[executor.submit(_clone_or_log, repo, f"{base_url.rstrip('/')}/{repo}.git", repo_dir, suffixes, archive_path, archive_format)] = repo_name
 
-        if os.path.exists(repo_dir):
-            logger.info(f"Repo {repo} already cloned.")
-        else:
-            logger.info(f"Cloning {repo}")
-            process = subprocess.run(["git", "clone", f"https://github.com/{repo}.git", repo_dir], stderr=subprocess.PIPE)
+        for future in as_completed(futures):
+            files = future.result()
+            if files is not None:
+                repo_files[futures[future]] = files
+                with open(repo_files_pickle, "wb") as f:
+                    pickle.dump(repo_files, f)
+    return repo_files
 
-            if process.returncode != 0:
-                logger.error(f'Error cloning {repo}: {process.stderr.decode("utf-8")}')
-            else:
-                logger.info("Cloned successfully")
-                process_repo(repo_dir, repo_name, repo_files)
 
-            with open(REPO_FILES_PICKLE, "wb") as f:
-                pickle.dump(repo_files, f)
+def main():
+    parser = argparse.ArgumentParser(description="Clone the repositories listed in a pickle, keeping only the analysed file types.")
+    parser.add_argument("--repos_pickle_path", default="/workspaces/repos/jupyter_repos_names.pickle", help="Pickle with a list of repository names ('owner/name')")
+    parser.add_argument("--repos_directory", default=REPOS_DIRECTORY, help="Directory receiving the clones")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Number of clones running at the same time")
+    parser.add_argument("--base_url", default=GITHUB_URL, help="URL under which the repositories are found as <owner>/<name>.git")
+    parser.add_argument("--repo_files_pickle_path", default=REPO_FILES_PICKLE, help="Pickle receiving the names of all files of each repository")
+    parser.add_argument("--archive_directory", default=None, help="Pack every clone into a corpus archive in this directory (read by src.main with --archive_directory), --repos_directory then only holds the clones in progress")
+    parser.add_argument("--archive_format", default=DEFAULT_ARCHIVE_FORMAT, choices=sorted(ARCHIVE_FORMATS), help="Format of the archives")
+    args = parser.parse_args()
 
-            time.sleep(delay)
+    clone_repos(args.repos_pickle_path, args.repos_directory, args.workers, args.base_url, args.repo_files_pickle_path, archive_directory=args.archive_directory, archive_format=args.archive_format)
 
 
 if __name__ == "__main__":
-    clone_repos("/workspaces/repos/jupyter_repos_names.pickle")
+    main()
@@ -1,14 +1,31 @@
 import os
+import math
 import time
 import pickle
-import httpx
+import asyncio
+import argparse
 import logging
-from itertools import product
-from typing import Dict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Optional
+
+import httpx
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+GITHUB_API_URL = "https://api.github.com"
+DEFAULT_QUERY = "language:jupyter-notebook stars:>50"
+# The search API returns at most 1000 results of a query, 100 per page.
+SEARCH_RESULTS_CAP = 1000
+PER_PAGE = 100
+DEFAULT_CONCURRENCY = 8
+MAX_RETRIES = 5
+# Rate limit responses are retried after at least 1, 2, 4... seconds (up to MAX_RATE_LIMIT_WAIT), a reset time in the past
+# (clock skew, a stale header) would otherwise retry at once, and up to MAX_RATE_LIMIT_RETRIES times in a row.
+MIN_RATE_LIMIT_WAIT = 1.0
+MAX_RATE_LIMIT_WAIT = 60.0
+MAX_RATE_LIMIT_RETRIES = 10
+
 
 def load_repos(filename: str) -> Dict:
     try:
@@ -19,46 +36,183 @@ def load_repos(filename: str) -> Dict:
 
 
 def save_repos(repos: Dict, filename: str):
-    with open(filename, "wb") as f:
+    # Written next to the target and renamed, so a crash while checkpointing keeps the previous file.
+    with open(f"{filename}.tmp", "wb") as f:
         pickle.dump(repos, f)
-
-
-def fetch_repositories(year: int, month: int, day: int, token: str) -> Dict:
-    headers = {"Accept": "application/vnd.github+json", "Authorization": f"Bearer {token}"}
-    url = rf"https://api.github.com/search/repositories?q=created:{year}-{str(month).zfill(2)}-{str(day).zfill(2)}+language:jupyter-notebook+stars:%3E50&sort=stars&order=desc&per_page=100"
-
-    with httpx.Client() as client:
-        response = client.get(url, headers=headers)
-
+    os.replace(f"{filename}.tmp", filename)
+
+
+def repo_record(repo: Dict) -> Dict:
+    return {"name": repo["name"], "full_name": repo["full_name"], "html_url": repo["html_url"], "created_at": repo["created_at"], "updated_at": repo["updated_at"], "size": repo["size"], "stargazers_count": repo["stargazers_count"], "topics": repo["topics"], "watchers": repo["watchers"]}
+
+
+class RateLimiter:
+    """
+    Holds requests back when the X-RateLimit-* headers of the responses say the current window is used up,
+    until the window resets, and limits the number of requests in flight.
+    """
+
+    def __init__(self, concurrency: int = DEFAULT_CONCURRENCY):
+        self.in_flight = asyncio.Semaphore(concurrency)
+        self.lock = asyncio.Lock()
+        self.remaining = None
+        self.reset = 0.0
+
+    async def wait(self):
+        async with self.lock:
+            if self.remaining is not None and self.remaining <= 0:
+                delay = self.reset - time.time()
+                if delay > 0:
+                    logger.info(f"Rate limit reached, waiting {delay:.0f} s")
+                    await asyncio.sleep(delay)
+                self.remaining = None
+            if self.remaining is not None:
+                self.remaining -= 1
+
+    def update(self, headers: httpx.Headers):
+        if "x-ratelimit-remaining" not in headers or "x-ratelimit-reset" not in headers:
+            return
+        remaining, reset = int(headers["x-ratelimit-remaining"]), float(headers["x-ratelimit-reset"])
+        # Responses of the current window can arrive out of order, the lowest remaining count is the latest one.
+        if reset > self.reset or self.remaining is None:
+            self.remaining, self.reset = remaining, reset
+        elif reset == self.reset:
+            self.remaining = min(self.remaining, remaining)
+
+    def pause(self, seconds: float):
+        self.remaining = 0
+        self.reset = max(self.reset, time.time() + seconds)
+
+
+async def request_json(client: httpx.AsyncClient, limiter: RateLimiter, method: str, url: str, max_retries: int = MAX_RETRIES, max_rate_limit_retries: int = MAX_RATE_LIMIT_RETRIES,
+                       **kwargs) -> Optional[Dict]:
+    """
+    Send a request through the rate limiter, retrying up to max_rate_limit_retries times in a row after rate limit responses (403/429),
+    and up to max_retries times after server errors.
+
+    Returns:
+    The decoded JSON response, or None if the request failed.
+    """
+    attempt = rate_limited = 0
+    while attempt < max_retries:
+        await limiter.wait()
+        async with limiter.in_flight:
+            try:
+                response = await client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                logger.warning(f"Request to {url} failed: {e!r}")
+                await asyncio.sleep(2 ** attempt)
+                attempt += 1
+                continue
+        limiter.update(response.headers)
+        if response.status_code in (403, 429) and ("retry-after" in response.headers or response.headers.get("x-ratelimit-remaining") == "0"):
+            if rate_limited == max_rate_limit_retries:
+                logger.error(f"Request to {url} still rate limited after {max_rate_limit_retries} retries")
+                return None
+            wait = float(response.headers["retry-after"]) if "retry-after" in response.headers else float(response.headers["x-ratelimit-reset"]) - time.time()
+            limiter.pause(max(wait, min(MIN_RATE_LIMIT_WAIT * 2 ** rate_limited, MAX_RATE_LIMIT_WAIT)))
+            rate_limited += 1
+            continue
+        rate_limited = 0
+        if response.status_code >= 500:
+            attempt += 1
+            if attempt < max_retries:
+                await asyncio.sleep(2 ** attempt / 2)
+            continue
         if response.status_code != 200:
-            logger.error(f"Failed to fetch data for {year}-{str(month).zfill(2)}-{str(day).zfill(2)}: {response.text}")
-            return {}
-
-        results = response.json().get("items", [])
-        return {repo["id"]: {"name": repo["name"], "full_name": repo["full_name"], "html_url": repo["html_url"], "created_at": repo["created_at"], "updated_at": repo["updated_at"], "size": repo["size"], "stargazers_count": repo["stargazers_count"], "topics": repo["topics"], "watchers": repo["watchers"]} for repo in results}
+            logger.error(f"Request to {url} failed with {response.status_code}: {response.text}")
+            return None
+        return response.json()
+    logger.error(f"Request to {url} failed after {max_retries} attempts")
+    return None
+
+
+def created_query(query: str, start: datetime, end: datetime) -> str:
+    # GitHub date ranges are inclusive, the ranges here exclude their end.
+    return f"{query} created:{start:%Y-%m-%dT%H:%M:%SZ}..{end - timedelta(seconds=1):%Y-%m-%dT%H:%M:%SZ}"
+
+
+async def fetch_page(client: httpx.AsyncClient, limiter: RateLimiter, query: str, page: int) -> Optional[Dict]:
+    return await request_json(client, limiter, "GET", "/search/repositories", params={"q": query, "sort": "stars", "order": "desc", "per_page": PER_PAGE, "page": page})
+
+
+async def collect_range(client: httpx.AsyncClient, limiter: RateLimiter, query: str, start: datetime, end: datetime, repos: Dict, on_range_done: Callable[[], None]):
+    """
+    Collect the repositories created in [start, end) into repos. Ranges with more results than the search returns
+    are split in halves (down to single seconds), the pages of the others are fetched concurrently.
+    """
+    first_page = await fetch_page(client, limiter, created_query(query, start, end), 1)
+    if first_page is None:
+        logger.error(f"Failed to fetch data for {start:%Y-%m-%d %H:%M:%S}..{end:%Y-%m-%d %H:%M:%S}")
+        return
+    total_count = first_page["total_count"]
+    if total_count > SEARCH_RESULTS_CAP and end - start > timedelta(seconds=1):
+        middle = start + timedelta(seconds=(end - start).total_seconds() // 2)
+        await asyncio.gather(collect_range(client, limiter, query, start, middle, repos, on_range_done), collect_range(client, limiter, query, middle, end, repos, on_range_done))
+        return
+    if total_count > SEARCH_RESULTS_CAP:
+        logger.warning(f"{total_count} repositories created at {start:%Y-%m-%d %H:%M:%S}, only the first {SEARCH_RESULTS_CAP} are returned")
+
+    n_pages = math.ceil(min(total_count, SEARCH_RESULTS_CAP) / PER_PAGE)
+    pages = [first_page] + await asyncio.gather(*(fetch_page(client, limiter, created_query(query, start, end), page) for page in range(2, n_pages + 1)))
+    for page in pages:
+        if page is not None:
+            repos.update({repo["id"]: repo_record(repo) for repo in page.get("items", [])})
+    on_range_done()
+
+
+async def collect_repositories(start: datetime, end: datetime, token: Optional[str], query: str = DEFAULT_QUERY, repos: Optional[Dict] = None, api_url: str = GITHUB_API_URL,
+                               concurrency: int = DEFAULT_CONCURRENCY, checkpoint: Optional[Callable[[Dict], None]] = None, checkpoint_every: int = 10) -> Dict:
+    """
+    Collect the repositories matching a search query created in [start, end), using one pooled client.
+
+    Parameters:
+    start, end: Creation time range of the repositories (timezone-aware or UTC).
+    token: GitHub token, None for unauthenticated requests.
+    query: Search query, without the creation date qualifier.
+    repos: Previously collected repositories, updated in place.
+    api_url: Base URL of the GitHub API.
+    concurrency: Maximum number of requests in flight.
+    checkpoint: Called with the repositories after every checkpoint_every completed date ranges, e.g. to save them.
+
+    Returns:
+    A dictionary mapping repository ids to their records.
+    """
+    repos = {} if repos is None else repos
+    headers = {"Accept": "application/vnd.github+json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    limiter = RateLimiter(concurrency)
+    ranges_done = 0
+
+    def on_range_done():
+        nonlocal ranges_done
+        ranges_done += 1
+        if ranges_done % checkpoint_every == 0:
+            logger.info(f"Repos gathered so far: {len(repos)}")
+            if checkpoint is not None:
+                checkpoint(repos)
+
+    async with httpx.AsyncClient(base_url=api_url, headers=headers, timeout=30, limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)) as client:
+        await collect_range(client, limiter, query, start, end, repos, on_range_done)
+    return repos
 
 
 def main():
-    years = (2020, 2021, 2022, 2023)
-    months = range(1, 13)
-    days = range(1, 32)
-    filename = "repos_jupyter.pickle"
-    token = os.getenv("GITHUB_TOKEN")
-
-    repos = load_repos(filename)
-
-    for year, month, day in product(years, months, days):
-        logger.info(f"Year: {year}, month: {month}, day: {day}")
-
-        repos.update(fetch_repositories(year, month, day, token))
-
-        if day % 10 == 0:
-            save_repos(repos, filename)
-            logger.info(f"Repos gathered so far: {len(repos.keys())}")
-
-        time.sleep(2)
-
-    save_repos(repos, filename)
+    parser = argparse.ArgumentParser(description="Collect repositories matching a GitHub search query, created in a range of years.")
+    parser.add_argument("--first_year", type=int, default=2020, help="First year of creation")
+    parser.add_argument("--last_year", type=int, default=2023, help="Last year of creation")
+    parser.add_argument("--query", default=DEFAULT_QUERY, help="Search query, without the creation date qualifier")
+    parser.add_argument("--output_pickle_path", default="repos_jupyter.pickle", help="Pickle with the collected repositories, updated if it exists")
+    parser.add_argument("--api_url", default=GITHUB_API_URL, help="Base URL of the GitHub API")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Maximum number of requests in flight")
+    args = parser.parse_args()
+
+    repos = load_repos(args.output_pickle_path)
+    start, end = datetime(args.first_year, 1, 1, tzinfo=timezone.utc), datetime(args.last_year + 1, 1, 1, tzinfo=timezone.utc)
+    asyncio.run(collect_repositories(start, end, os.getenv("GITHUB_TOKEN"), args.query, repos, args.api_url, args.concurrency, lambda repos: save_repos(repos, args.output_pickle_path)))
+
+    save_repos(repos, args.output_pickle_path)
     logger.info(f"Total repos: {len(repos)}")
 
 
@@ -1,40 +1,150 @@
 import os
-import time
+import json
 import pickle
-import requests
+import asyncio
+import argparse
+import logging
+from typing import Callable, Dict, Iterable, List, Optional
 
+import httpx
 
-TOKEN = os.getenv("GITHUB_TOKEN")
+from src.repo_acquisition.repo_collector import GITHUB_API_URL, DEFAULT_CONCURRENCY, RateLimiter, request_json, load_repos, save_repos
 
-headers = {
-    "Authorization": f"token {TOKEN}",
-    "Accept": "application/vnd.github.mercy-preview+json",
-}
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 50
+# Batches are retried once before being split, large GraphQL queries tend to time out rather than fail quickly.
+BATCH_RETRIES = 2
+# The GraphQL equivalents of the fields of a REST search item, which the previous REST collector stored whole.
+REPOSITORY_FIELDS = ("databaseId id name nameWithOwner owner { login url __typename } isPrivate url description isFork createdAt updatedAt pushedAt homepageUrl diskUsage stargazerCount "
+                     "primaryLanguage { name } hasIssuesEnabled hasProjectsEnabled hasWikiEnabled forkCount mirrorUrl isArchived isDisabled issues(states: OPEN) { totalCount } "
+                     "pullRequests(states: OPEN) { totalCount } licenseInfo { key name spdxId } forkingAllowed isTemplate repositoryTopics(first: 20) { nodes { topic { name } } } "
+                     "visibility defaultBranchRef { name } sshUrl")
+
+
+def repository_selection(alias: str, repo: str) -> str:
+    # Names with an owner are looked up directly, bare names take the best match of a search, as the previous REST collector did.
+    # JSON string literals are valid GraphQL string literals.
+    if "/" in repo:
+        owner, name = repo.split("/", 1)
+        return f"{alias}: repository(owner: {json.dumps(owner)}, name: {json.dumps(name)}) {{ {REPOSITORY_FIELDS} }}"
+    return f"{alias}: search(query: {json.dumps(repo)}, type: REPOSITORY, first: 1) {{ nodes {{ ... on Repository {{ {REPOSITORY_FIELDS} }} }} }}"
+
+
+def batch_query(repos: List[str]) -> str:
+    return "query { " + " ".join(repository_selection(f"r{i}", repo) for i, repo in enumerate(repos)) + " }"
+
+
+def metadata_record(node: Dict) -> Dict:
+    # A REST search item under its field names, without the API URLs and the search score ('watchers' is the star count there too,
+    # open issues include the open pull requests).
+    license_info = node["licenseInfo"]
+    open_issues = node["issues"]["totalCount"] + node["pullRequests"]["totalCount"]
+    return {"id": node["databaseId"], "node_id": node["id"], "name": node["name"], "full_name": node["nameWithOwner"], "private": node["isPrivate"],
+            "owner": {"login": node["owner"]["login"], "html_url": node["owner"]["url"], "type": node["owner"]["__typename"]}, "html_url": node["url"], "description": node["description"],
+            "fork": node["isFork"], "created_at": node["createdAt"], "updated_at": node["updatedAt"], "pushed_at": node["pushedAt"], "homepage": node["homepageUrl"],
+            "size": node["diskUsage"], "stargazers_count": node["stargazerCount"], "watchers_count": node["stargazerCount"],
+            "language": node["primaryLanguage"]["name"] if node["primaryLanguage"] else None, "has_issues": node["hasIssuesEnabled"], "has_projects": node["hasProjectsEnabled"],
+            "has_wiki": node["hasWikiEnabled"], "forks_count": node["forkCount"], "mirror_url": node["mirrorUrl"], "archived": node["isArchived"], "disabled": node["isDisabled"],
+            "open_issues_count": open_issues, "license": {"key": license_info["key"], "name": license_info["name"], "spdx_id": license_info["spdxId"]} if license_info else None,
+            "allow_forking": node["forkingAllowed"], "is_template": node["isTemplate"], "topics": [topic["topic"]["name"] for topic in node["repositoryTopics"]["nodes"]],
+            "visibility": node["visibility"].lower(), "forks": node["forkCount"], "open_issues": open_issues, "watchers": node["stargazerCount"],
+            "default_branch": node["defaultBranchRef"]["name"] if node["defaultBranchRef"] else None, "clone_url": f"{node['url']}.git", "ssh_url": node["sshUrl"], "svn_url": node["url"]}
+
+
+async def fetch_batch(client: httpx.AsyncClient, limiter: RateLimiter, repos: List[str]) -> Dict[str, Dict]:
+    """
+    Fetch the metadata of a batch of repositories with one GraphQL query. A batch whose request fails is split in halves,
+    so a query too large for the API or a single broken name only costs smaller requests.
+
+    Returns:
+    A dictionary mapping the found repositories to their records.
+    """
+    response = await request_json(client, limiter, "POST", "/graphql", max_retries=BATCH_RETRIES, json={"query": batch_query(repos)})
+    if response is None or response.get("data") is None:
+        if len(repos) == 1:
+            logger.error(f"Failed to fetch repo info for {repos[0]}: {(response or {}).get('errors')}")
+            return {}
+        halves = await asyncio.gather(fetch_batch(client, limiter, repos[:len(repos) // 2]), fetch_batch(client, limiter, repos[len(repos) // 2:]))
+        return {**halves[0], **halves[1]}
+
+    records = {}
+    for i, repo in enumerate(repos):
+        node = response["data"].get(f"r{i}")
+        if node is not None and "nodes" in node:
+            node = node["nodes"][0] if node["nodes"] else None
+        if node:
+            records[repo] = metadata_record(node)
+    return records
+
+
+async def collect_metadata(repos: Iterable[str], token: Optional[str], repo_data: Optional[Dict] = None, collected_repos: Optional[Dict] = None, api_url: str = GITHUB_API_URL,
+                           batch_size: int = DEFAULT_BATCH_SIZE, concurrency: int = DEFAULT_CONCURRENCY, checkpoint: Optional[Callable[[Dict], None]] = None, checkpoint_every: int = 10) -> Dict:
+    """
+    Collect the metadata of repositories with batched GraphQL queries sent concurrently over one pooled client.
+
+    Parameters:
+    repos: Repository names, 'owner/name' or bare names (resolved to the best search match).
+    token: GitHub token (the GraphQL API requires one).
+    repo_data: Previously collected metadata, updated in place; its repositories are not fetched again.
+    collected_repos: Output of repo_collector (records by id); repositories found there by full or bare name are copied instead of fetched,
+                     with only the fields of repo_collector.repo_record.
+    api_url: Base URL of the GitHub API.
+    batch_size: Number of repositories per GraphQL query.
+    concurrency: Maximum number of requests in flight.
+    checkpoint: Called with the metadata after every checkpoint_every completed batches, e.g. to save it.
+
+    Returns:
+    A dictionary mapping repository names to their metadata.
+    """
+    repo_data = {} if repo_data is None else repo_data
+    known = {}
+    for record in (collected_repos or {}).values():
+        known[record["full_name"]] = record
+        known.setdefault(record["name"], record)
+    pending = []
+    for repo in dict.fromkeys(str(repo) for repo in repos):
+        if repo in repo_data:
+            continue
+        if repo in known:
+            repo_data[repo] = known[repo]
+        else:
+            pending.append(repo)
+    logger.info(f"Fetching metadata of {len(pending)} repos, {len(repo_data)} already known")
+
+    headers = {"Authorization": f"bearer {token}"} if token else {}
+    limiter = RateLimiter(concurrency)
+    async with httpx.AsyncClient(base_url=api_url, headers=headers, timeout=60, limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)) as client:
+        batches = [fetch_batch(client, limiter, pending[i:i + batch_size]) for i in range(0, len(pending), batch_size)]
+        for done, batch in enumerate(asyncio.as_completed(batches), 1):
+            repo_data.update(await batch)
+            if done % checkpoint_every == 0:
+                logger.info(f"Batches done: {done}/{len(batches)}, repos with metadata: {len(repo_data)}")
+                if checkpoint is not None:
+                    checkpoint(repo_data)
+    return repo_data
 
-def get_repo_info(repo):
-    response = requests.get(f"https://api.github.com/search/repositories?q={repo}&type=Repositories", headers=headers)
-    if response.status_code != 200:
-        print(f"Failed to fetch repo info for {repo}")
-        return None
-    return response.json()
 
 def main():
-    with open('/home/tobiasz/Repos/top-python-repos-analysis/data/python_repo_names.pickle', 'rb') as f:
+    parser = argparse.ArgumentParser(description="Collect metadata of repositories with batched GraphQL queries.")
+    parser.add_argument("--repo_names_pickle_path", default="./data/python_repo_names.pickle", help="Pickle with the repository names, 'owner/name' or bare names")
+    parser.add_argument("--output_pickle_path", default="python_repos_metadata.pickle", help="Pickle with the metadata by repository name, resumed if it exists and saved at every checkpoint")
+    parser.add_argument("--collected_repos_pickle_path", default=None, help="Output of repo_collector, whose repositories are copied (with its fields only) instead of fetched")
+    parser.add_argument("--api_url", default=GITHUB_API_URL, help="Base URL of the GitHub API")
+    parser.add_argument("--batch_size", type=int, default=DEFAULT_BATCH_SIZE, help="Number of repositories per GraphQL query")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Maximum number of requests in flight")
+    args = parser.parse_args()
+
+    with open(args.repo_names_pickle_path, "rb") as f:
         repos = pickle.load(f)
+    repo_data = load_repos(args.output_pickle_path)
+    collected_repos = load_repos(args.collected_repos_pickle_path) if args.collected_repos_pickle_path else None
+    asyncio.run(collect_metadata(repos, os.getenv("GITHUB_TOKEN"), repo_data, collected_repos, args.api_url, args.batch_size, args.concurrency, lambda repo_data: save_repos(repo_data, args.output_pickle_path)))
+
+    save_repos(repo_data, args.output_pickle_path)
+    logger.info(f"Repos with metadata: {len(repo_data)}")
 
-    repo_data = {}
-    for i, repo in enumerate(repos):
-        print(i, repo)
-        try:
-            repo_info = get_repo_info(repo)
-            if repo_info is not None and 'items' in repo_info and len(repo_info['items']) > 0:
-                repo_data[repo] = repo_info['items'][0]
-        except Exception as e:
-            print(e)
-        time.sleep(2)
-
-    with open('python_repos_metadata.pickle', 'wb') as f:
-        pickle.dump(repo_data, f)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import socket
+from typing import List, Tuple, Dict, Optional
+
+import pyarrow.parquet as pq
+
+
+SHARD_PLAN_FILENAME = "_shards.json"
+DEFAULT_STALE_LOCK_SECONDS = 24 * 60 * 60
+IMPORTS_TABLE = "imports"
+
+
+def count_top_level_directories(root_directory: str) -> int:
+    with os.scandir(root_directory) as scanned:
+        return sum(1 for dir_entry in scanned if dir_entry.is_dir())
+
+
+def plan_shards(n_directories: int, shard_size: int, dir_range: Tuple[int, int] = (0, float("inf"))) -> List[Tuple[int, int]]:
+    """
+    Split a range of top-level directories into shards of shard_size directories.
+
+    Parameters:
+    n_directories: Number of top-level directories in the corpus.
+    shard_size: Number of top-level directories per shard.
+    dir_range: The (first, last) top-level directory to include, as in find_python_files.
+
+    Returns:
+    A list of (first, last) top-level directory ranges, usable as dir_range of discover_files.
+    """
+    first = max(0, dir_range[0])
+    last = min(n_directories - 1, dir_range[1])
+    return [(start, int(min(start + shard_size - 1, last))) for start in range(first, int(last) + 1, shard_size)]
+
+
+def shard_name(shard: Tuple[int, int]) -> str:
+    return f"part-{shard[0]:06d}-{shard[1]:06d}"
+
+
+def _write_json_atomically(path: str, data: Dict) -> None:
+    temporary_path = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(temporary_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(temporary_path, path)
+
+
+def load_or_create_shard_plan(shards_directory: str, shards: List[Tuple[int, int]], run_settings: Dict) -> List[Tuple[int, int]]:
+    """
+    Save the shard plan of a run, or load the plan saved by a previous run or by another machine.
+
+    Parameters:
+    shards_directory: Directory holding the shard parts, locks and the plan.
+    shards: The planned shards.
+    run_settings: Settings that have to be the same for all parts of the run (input, mode, reference...).
+
+    Returns:
+    The shards of the saved plan.
+
+    Raises:
+    ValueError if the saved plan was made with different settings.
+    """
+    os.makedirs(shards_directory, exist_ok=True)
+    plan_path = os.path.join(shards_directory, SHARD_PLAN_FILENAME)
+    plan = {"run_settings": run_settings, "shards": [list(shard) for shard in shards]}
+    try:
+        with open(plan_path, "x") as f:
+            json.dump(plan, f, indent=2)
+        return shards
+    except FileExistsError:
+        pass
+    with open(plan_path) as f:
+        saved_plan = json.load(f)
+    if saved_plan["run_settings"] != run_settings:
+        raise ValueError(f"{plan_path} was created with different settings: {saved_plan['run_settings']}, remove it to start a new run")
+    return [tuple(shard) for shard in saved_plan["shards"]]
+
+
+def is_shard_done(shards_directory: str, shard: Tuple[int, int]) -> bool:
+    return os.path.exists(os.path.join(shards_directory, f"{shard_name(shard)}.done"))
+
+
+def _is_lock_stale(lock: Dict, stale_lock_seconds: float) -> bool:
+    if time.time() - lock["time"] > stale_lock_seconds:
+        return True
+    if lock["host"] != socket.gethostname():
+        return False
+    try:
+        os.kill(lock["pid"], 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False
+    return False
+
+
+def claim_shard(shards_directory: str, shard: Tuple[int, int], stale_lock_seconds: float = DEFAULT_STALE_LOCK_SECONDS) -> bool:
+    """
+    Try to take a shard for processing by creating its lock file, which is atomic on a shared filesystem.
+
+    A lock left by a crashed run is taken over when its process no longer exists (on the same host)
+    or when it is older than stale_lock_seconds.
+
+    Returns:
+    True if the shard was claimed by this process.
+    """
+    lock_path = os.path.join(shards_directory, f"{shard_name(shard)}.lock")
+    lock = {"host": socket.gethostname(), "pid": os.getpid(), "time": time.time()}
+    for _ in range(2):
+        try:
+            with open(lock_path, "x") as f:
+                json.dump(lock, f)
+            return True
+        except FileExistsError:
+            try:
+                with open(lock_path) as f:
+                    existing_lock = json.load(f)
+            except (OSError, ValueError):
+                return False
+            if not _is_lock_stale(existing_lock, stale_lock_seconds):
+                return False
+            try:
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+    return False
+
+
+def shard_output_path(shards_directory: str, shard: Tuple[int, int], table: Optional[str] = None) -> str:
+    # Runs writing a second table (the imports of '--mode both') store it in parts named after it.
+    return os.path.join(shards_directory, f"{shard_name(shard)}.{table}.parquet" if table else f"{shard_name(shard)}.parquet")
+
+
+def complete_shard(shards_directory: str, shard: Tuple[int, int], temporary_output_path: str, stats: Dict, temporary_imports_output_path: Optional[str] = None) -> None:
+    """
+    Publish the parquet part (or parts) of a finished shard, then mark the shard as done and release its lock.
+    """
+    if temporary_imports_output_path is not None:
+        os.replace(temporary_imports_output_path, shard_output_path(shards_directory, shard, IMPORTS_TABLE))
+    os.replace(temporary_output_path, shard_output_path(shards_directory, shard))
+    _write_json_atomically(os.path.join(shards_directory, f"{shard_name(shard)}.done"), {**stats, "host": socket.gethostname(), "time": time.time()})
+    try:
+        os.remove(os.path.join(shards_directory, f"{shard_name(shard)}.lock"))
+    except FileNotFoundError:
+        pass
+
+
+def merge_shards(shards_directory: str, output_file: str, row_group_size: Optional[int] = None, table: Optional[str] = None) -> int:
+    """
+    Stream the parquet parts of all shards of a finished run into a single parquet file.
+
+    Parts come from different top-level directories, so they never share a filename and rows
+    are copied without aggregation.
+
+    Parameters:
+    shards_directory: Directory holding the shard parts and the plan.
+    output_file: Path to the merged parquet file.
+    row_group_size: Maximum number of rows per row group of the output, defaults to the row groups of the parts.
+    table: Name of the merged table for runs writing more than one (e.g. IMPORTS_TABLE), None for the main one.
+
+    Returns:
+    The number of written rows.
+
+    Raises:
+    ValueError if some shards of the plan are not done.
+    """
+    with open(os.path.join(shards_directory, SHARD_PLAN_FILENAME)) as f:
+        shards = [tuple(shard) for shard in json.load(f)["shards"]]
+    pending = [shard_name(shard) for shard in shards if not is_shard_done(shards_directory, shard)]
+    if pending:
+        raise ValueError(f"{len(pending)} shards are not done yet: {', '.join(pending[:5])}")
+    if not shards:
+        raise ValueError(f"The plan in {shards_directory} has no shards")
+
+    parts = [pq.ParquetFile(shard_output_path(shards_directory, shard, table)) for shard in shards]
+    # Shards without any files are written with the default (full mode) schema, so the schema is taken from the first non-empty part.
+    schema = next((part.schema_arrow for part in parts if part.metadata.num_rows), parts[0].schema_arrow)
+    rows_written = 0
+    with pq.ParquetWriter(output_file, schema) as writer:
+        for part in parts:
+            if not part.metadata.num_rows:
+                continue
+            for row_group in range(part.num_row_groups):
+                row_group_table = part.read_row_group(row_group)
+                writer.write_table(row_group_table, row_group_size=row_group_size)
+                rows_written += row_group_table.num_rows
+    return rows_written
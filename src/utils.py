@@ -1,10 +1,46 @@
 import os
+import re
+import csv
+import bisect
+import sys
+import json
 import pickle
+import socket
+import hashlib
 import logging
 import warnings
-import nbformat
-from nbconvert import PythonExporter
-from typing import List, Tuple, Dict
+import pyarrow as pa
+import pyarrow.parquet as pq
+from itertools import repeat
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Dict, FrozenSet, Iterable, Optional, Union
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+
+COMPONENT_COLUMNS = ['filename', 'module', 'component_type', 'component_name']
+IMPORT_COLUMNS = ['filename', 'module']
+COMPONENT_TYPES = ('function', 'method', 'class', 'attribute', 'exception')
+COMPILED_REFERENCE_FORMAT = 'compiled_library_reference'
+COMPILED_REFERENCE_VERSION = 1
+COMPONENT_SCHEMA = pa.schema([(column, pa.string()) for column in COMPONENT_COLUMNS] + [('count', pa.int64())])
+IMPORT_SCHEMA = pa.schema([(column, pa.string()) for column in IMPORT_COLUMNS])
+REFERENCE_COMPONENT_SCHEMA = pa.schema([('reference', pa.string())] + list(COMPONENT_SCHEMA))
+SCHEMAS_BY_KEY_LENGTH = {len(schema.names) - (schema.names[-1] == 'count'): schema for schema in (COMPONENT_SCHEMA, IMPORT_SCHEMA, REFERENCE_COMPONENT_SCHEMA)}
+DEFAULT_ROW_GROUP_SIZE = 100_000
+DEFAULT_CHUNK_BYTES = 4 * 1024 * 1024
+MANIFEST_FILENAME = 'file_manifest.pickle'
+DEFAULT_MAX_FILE_BYTES = 5 * 1024 * 1024
+DEFAULT_FILE_TIMEOUT = 60.0
+SKIP_TOO_LARGE = 'file_too_large'
+SKIP_TIMEOUT = 'timeout'
+SKIP_UNREADABLE = 'unreadable'
+# Lines run by IPython instead of Python: line magics (%time), shell escapes (!ls), their assignments (files = !ls) and help (obj?).
+IPYTHON_LINE_PATTERN = re.compile(r"^\s*(?:%{1,2}[A-Za-z]|![^=]|[A-Za-z_][\w.\[\], ]*=\s*[!%]|\?|[\w.]+\?{1,2}\s*$)")
 
 
 def setup_logger():
@@ -18,44 +54,240 @@ def setup_logger():
     return logger
 
 
-def find_python_files(root_directory: str, filetype: str = ".py", dir_range: Tuple[int, int] = (0, float("inf"))) -> List[str]:
+def _scan_directory(directory: str, suffixes: Tuple[str, ...], manifest: Dict, new_manifest: Dict) -> List[Tuple[str, int, int]]:
+    """
+    Recursively list the files with the given suffixes below a directory, reusing the manifest entries
+    of directories whose mtime hasn't changed. Like os.walk, symlinks to directories are not followed.
+    """
+    found_files = []
+    stack = [directory]
+    while stack:
+        dirpath = stack.pop()
+        try:
+            dir_mtime = os.stat(dirpath).st_mtime_ns
+        except OSError:
+            continue
+        entry = manifest.get(dirpath)
+        if entry is None or entry[0] != dir_mtime:
+            subdirectories, files = [], []
+            try:
+                with os.scandir(dirpath) as scanned:
+                    for dir_entry in scanned:
+                        try:
+                            if dir_entry.is_dir():
+                                if not dir_entry.is_symlink():
+                                    subdirectories.append(dir_entry.name)
+                            elif dir_entry.name.endswith(suffixes):
+                                stat = dir_entry.stat()
+                                files.append((dir_entry.name, stat.st_size, stat.st_mtime_ns))
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+            entry = (dir_mtime, subdirectories, files)
+        new_manifest[dirpath] = entry
+        found_files.extend((os.path.join(dirpath, name), size, mtime) for name, size, mtime in entry[2])
+        stack.extend(os.path.join(dirpath, name) for name in reversed(entry[1]))
+    return found_files
+
+
+def _load_manifest(manifest_path: str, suffixes: Tuple[str, ...]) -> Dict:
+    # A missing, unreadable (e.g. truncated by a crash) or differently configured manifest is treated as empty, costing a full scan.
+    try:
+        with open(manifest_path, "rb") as f:
+            saved_manifest = pickle.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError, TypeError, IndexError) as e:
+        logging.getLogger('python_repo_analysis').error(f"Ignoring unreadable manifest {manifest_path}: {e!r}")
+        return {}
+    if not isinstance(saved_manifest, dict) or saved_manifest.get('suffixes') != suffixes:
+        return {}
+    return saved_manifest['directories']
+
+
+def discover_files(root_directory: str, suffixes: Tuple[str, ...] = (".py",), dir_range: Tuple[int, int] = (0, float("inf")), manifest_path: Optional[str] = None, max_workers: int = 8) -> Dict[str, Tuple[int, int]]:
+    """
+    Find the files with any of the given suffixes in a range of top-level directories, scanning the top-level
+    directories concurrently, and record their sizes and modification times.
+
+    When a manifest is given, directories whose mtime is unchanged since the previous run are not scanned again.
+    A directory's mtime only changes when entries are added, removed or renamed in it, so sizes and mtimes of
+    files modified in place are taken from the manifest.
+
+    Parameters:
+    root_directory: The root directory to start the search from.
+    suffixes: File extensions to look for, all found in a single pass.
+    dir_range: A tuple of two numbers specifying the first and last top-level directory
+               (counted in sorted order) to include in the search. Defaults to (0, infinity).
+    manifest_path: Path to a pickle with the directory listings of the previous run, updated after the scan;
+                   an unreadable manifest is ignored.
+    max_workers: Number of threads scanning the top-level directories.
+
+    Returns:
+    A dict mapping paths of the found files to (size in bytes, mtime in ns), ordered by top-level directory.
+    """
+    suffixes = tuple(suffixes)
+    manifest = _load_manifest(manifest_path, suffixes) if manifest_path is not None else {}
+
+    top_level_directories = []
+    with os.scandir(root_directory) as scanned:
+        for dir_entry in sorted(scanned, key=lambda dir_entry: dir_entry.name):
+            if dir_entry.is_dir():
+                top_level_directories.append(dir_entry.path)
+    top_level_directories = [directory for dir_counter, directory in enumerate(top_level_directories) if dir_range[0] <= dir_counter <= dir_range[1]]
+
+    new_manifests = [{} for _ in top_level_directories]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(_scan_directory, top_level_directories, repeat(suffixes), repeat(manifest), new_manifests)
+        found_files = {path: (size, mtime) for files in results for path, size, mtime in files}
+
+    if manifest_path is not None:
+        # The manifest is read again just before being replaced, so the listings written meanwhile by runs over
+        # other directories (e.g. other shards) are kept, and only the scanned directories are updated.
+        manifest = _load_manifest(manifest_path, suffixes)
+        for new_manifest in new_manifests:
+            manifest.update(new_manifest)
+        # Written to a temporary file first, so that concurrent runs never read a partial manifest; the host name
+        # keeps runs with the same pid on different machines (e.g. in containers) from sharing a temporary file.
+        temporary_path = f"{manifest_path}.{socket.gethostname()}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as f:
+            pickle.dump({'suffixes': suffixes, 'directories': manifest}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, manifest_path)
+
+    return found_files
+
+
+def find_python_files(root_directory: str, filetype: Union[str, Tuple[str, ...]] = ".py", dir_range: Tuple[int, int] = (0, float("inf"))) -> List[str]:
     """
     Traverse directories within the given root directory and return a list of paths for
     files that match the given filetype, within a range of top-level directories specified.
 
     Parameters:
     root_directory (str): The root directory to start the search from.
-    filetype (str): The file extension to look for. Defaults to '.py'.
+    filetype (str or tuple): The file extension(s) to look for. Defaults to '.py'.
     dir_range (tuple): A tuple of two numbers specifying the first and last top-level
                        directory to include in the search. Defaults to (0, infinity).
 
     Returns:
     List[str]: A list of paths for all found files that match the given filetype.
     """
-    python_files = []
-    dir_counter = -1
+    suffixes = (filetype,) if isinstance(filetype, str) else tuple(filetype)
+    return list(discover_files(root_directory, suffixes, dir_range))
 
-    for dir_name in sorted(os.listdir(root_directory)):
-        full_dir_name = os.path.join(root_directory, dir_name)
-        if os.path.isdir(full_dir_name):
-            dir_counter += 1
-            if dir_counter < dir_range[0]:
-                continue
-            if dir_counter > dir_range[1]:
-                break
-            for dirpath, _, filenames in os.walk(full_dir_name):
-                for filename in filenames:
-                    if filename.endswith(filetype):
-                        full_path = os.path.join(dirpath, filename)
-                        python_files.append(full_path)
 
-    return python_files
+def batch_files_by_size(code_files: List[str], chunk_bytes: int = DEFAULT_CHUNK_BYTES, min_batches: int = 1, file_sizes: Optional[Dict[str, int]] = None) -> List[List[str]]:
+    """
+    Group files into batches of roughly chunk_bytes total size, largest files first.
+
+    Files bigger than the batch size become single-file batches dispatched at the start, so the biggest
+    tasks don't end up last and stall the tail of a run. The batch size is lowered when needed, so that
+    there are at least min_batches batches (to keep all workers busy on small corpora).
+
+    Parameters:
+    code_files: A list of file paths.
+    chunk_bytes: Target total size of a batch in bytes.
+    min_batches: Minimum number of batches to aim for.
+    file_sizes: Known sizes of the files (e.g. from discover_files), other files are stat-ed.
+
+    Returns:
+    A list of batches, each being a list of file paths.
+    """
+    sizes = {}
+    for code_file in code_files:
+        if file_sizes is not None and code_file in file_sizes:
+            sizes[code_file] = file_sizes[code_file]
+            continue
+        try:
+            sizes[code_file] = os.path.getsize(code_file)
+        except OSError:
+            sizes[code_file] = 0
+    chunk_bytes = max(1, min(chunk_bytes, sum(sizes.values()) // max(1, min_batches)))
+
+    batches = []
+    batch, batch_bytes = [], 0
+    for code_file in sorted(code_files, key=sizes.get, reverse=True):
+        if batch and batch_bytes + sizes[code_file] > chunk_bytes:
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(code_file)
+        batch_bytes += sizes[code_file]
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def extract_notebook_code(notebook_json: str) -> Tuple[str, List[Tuple[int, int]]]:
+    """
+    Extract the code cells of a Jupyter Notebook (.ipynb) JSON string into a Python script.
+
+    IPython-only lines are commented out: a cell magic (%%bash) comments the whole cell, and any other
+    magic, shell escape or help line becomes 'pass  # <line>' with the original indentation, so that
+    blocks containing them remain valid Python.
+
+    Parameters:
+    notebook_json: The Jupyter Notebook JSON string (nbformat 3 or 4).
+
+    Returns:
+    A tuple containing:
+    - The Python script made of the code cells, separated by blank lines.
+    - A list of (cell index, first line number) pairs, one per code cell, so that line numbers
+      in the script can be attributed to notebook cells (see cell_index_for_line).
+
+    Raises:
+    ValueError, KeyError, TypeError or AttributeError for notebooks that are malformed or of an unknown format.
+    """
+    notebook = _json_loads(notebook_json)
+    if 'cells' in notebook:
+        cells = notebook['cells']
+    else:
+        cells = [cell for worksheet in notebook['worksheets'] for cell in worksheet['cells']]
+
+    lines = []
+    cell_offsets = []
+    for cell_index, cell in enumerate(cells):
+        if cell['cell_type'] != 'code':
+            continue
+        source = cell['source'] if 'source' in cell else cell['input']
+        cell_lines = (source if isinstance(source, str) else ''.join(source)).splitlines()
+        if cell_lines and cell_lines[0].startswith('%%'):
+            cell_lines = [f'# {line}' for line in cell_lines]
+        else:
+            cell_lines = [f'{line[:len(line) - len(line.lstrip())]}pass  # {line.strip()}' if IPYTHON_LINE_PATTERN.match(line) else line for line in cell_lines]
+        cell_offsets.append((cell_index, len(lines) + 1))
+        lines.extend(cell_lines)
+        lines.append('')
+
+    return '\n'.join(lines), cell_offsets
+
+
+def cell_index_for_line(cell_offsets: List[Tuple[int, int]], line_number: int) -> int:
+    """
+    Return the index of the notebook cell containing the given line of a script produced by extract_notebook_code.
+    """
+    position = bisect.bisect_right([first_line for _, first_line in cell_offsets], line_number) - 1
+    return cell_offsets[max(position, 0)][0]
+
+
+def convert_notebook_with_nbconvert(notebook_json: str) -> str:
+    # nbconvert (and the Jinja templating behind it) is imported only when a notebook needs it.
+    import nbformat
+    from nbconvert import PythonExporter
+
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore")
+        notebook_node = nbformat.reads(notebook_json, as_version=4)
+        python_script, _ = PythonExporter().from_notebook_node(notebook_node)
+    return python_script
 
 
 def convert_notebook_to_python(notebook_json: str, logger: logging.Logger) -> str:
     """
     Convert a Jupyter Notebook (.ipynb) JSON string to a Python script.
 
+    The code cells are extracted with extract_notebook_code; nbconvert's PythonExporter is only used
+    as a fallback for notebooks that can't be read that way.
+
     Parameters:
     notebook_json: The Jupyter Notebook JSON string to be converted.
     logger: Logger object for logging messages.
@@ -63,21 +295,240 @@ def convert_notebook_to_python(notebook_json: str, logger: logging.Logger) -> st
     Returns:
     The Python script converted from the Jupyter Notebook JSON string.
     """
-    python_script = ''
+    try:
+        return extract_notebook_code(notebook_json)[0]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        pass
 
+    python_script = ''
     try:
-        with warnings.catch_warnings():
-            warnings.filterwarnings("ignore")
-            notebook_node = nbformat.reads(notebook_json, as_version=4)
-            exporter = PythonExporter()
-            python_script, _ = exporter.from_notebook_node(notebook_node)
+        python_script = convert_notebook_with_nbconvert(notebook_json)
     except Exception as e:
         logger.error(f"Couldn't convert notebook to python: {e}")
 
     return python_script
 
 
-def load_library_reference(library_pickle_path: str) -> Dict:
+def compile_library_reference(lib_dict: Dict) -> Dict[str, Dict[str, FrozenSet[str]]]:
+    """
+    Compile an API reference into an immutable lookup structure.
+
+    Every component list becomes a frozenset of interned names, so membership checks are hash lookups
+    and names shared between modules (e.g. 'get' or 'close') are stored once. Compiling an already
+    compiled reference returns an equal structure.
+
+    Parameters:
+    lib_dict: A dictionary mapping module names to dicts of component type -> component names.
+
+    Returns:
+    A dictionary mapping module names to dicts of component type -> frozenset of component names.
+    """
+    return {sys.intern(module): {component_type: frozenset(sys.intern(name) for name in components.get(component_type, ()))
+                                 for component_type in COMPONENT_TYPES}
+            for module, components in lib_dict.items()}
+
+
+def reference_version(lib_dict: Dict) -> str:
+    """
+    Compute a short digest identifying the content of an API reference (raw or compiled).
+
+    Parameters:
+    lib_dict: A dictionary representing the API reference.
+
+    Returns:
+    A hex digest that changes whenever a module or a component name is added or removed.
+    """
+    compiled = compile_library_reference(lib_dict)
+    canonical = repr(sorted((module, component_type, sorted(names)) for module, components in compiled.items() for component_type, names in components.items()))
+    return hashlib.sha256(canonical.encode()).hexdigest()[:16]
+
+
+def save_compiled_reference(lib_dict: Dict, output_path: str) -> None:
+    """
+    Compile an API reference and save it together with a format header, so it can be loaded without recompiling.
+
+    Parameters:
+    lib_dict: A dictionary representing the API reference (raw or already compiled).
+    output_path: Path to the output pickle file.
+
+    Returns:
+    None
+    """
+    compiled = {'format': COMPILED_REFERENCE_FORMAT, 'version': COMPILED_REFERENCE_VERSION, 'reference': compile_library_reference(lib_dict)}
+    with open(output_path, "wb") as f:
+        pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_library_reference(library_pickle_path: str) -> Dict[str, Dict[str, FrozenSet[str]]]:
+    """
+    Load an API reference pickle, either a raw one from api_reference_pickles/ or one saved by save_compiled_reference.
+
+    Parameters:
+    library_pickle_path: Path to the pickle file containing API reference.
+
+    Returns:
+    The compiled API reference (see compile_library_reference).
+    """
     with open(library_pickle_path, "rb") as f:
         lib_dict = pickle.load(f)
-    return lib_dict
+    if lib_dict.get('format') == COMPILED_REFERENCE_FORMAT and lib_dict.get('version') == COMPILED_REFERENCE_VERSION:
+        return lib_dict['reference']
+    return compile_library_reference(lib_dict)
+
+
+class ParquetCounterWriter:
+    """
+    Streams dicts of counts (e.g. Counters) into a parquet file, writing a row group every row_group_size rows.
+
+    Keys are (filename, module, component_type, component_name) tuples and the values become the 'count' column.
+    Keys that are (filename, module) tuples are saved as an imports table, without the 'count' column, and keys
+    that are (reference, filename, module, component_type, component_name) tuples as a multi-reference table.
+    Only one row group is buffered at a time, so memory use doesn't depend on the number of counters.
+    Rows are written as given, so keys repeated across counters are not summed.
+    """
+
+    def __init__(self, output_file: str, row_group_size: int = DEFAULT_ROW_GROUP_SIZE, schema: Optional[pa.Schema] = None):
+        """
+        Parameters:
+        output_file: Path to the output parquet file, created with the first written rows (or on close).
+        row_group_size: Maximum number of rows buffered before a row group is written.
+        schema: Schema of the output, by default inferred from the keys of the first non-empty dict (COMPONENT_SCHEMA if there is none).
+        """
+        self.output_file = output_file
+        self.row_group_size = row_group_size
+        self.schema = schema
+        self.rows_written = 0
+        self._writer = None
+        self._columns = None
+
+    def _open(self, schema: pa.Schema) -> None:
+        self.schema = schema
+        self._columns = [[] for _ in schema.names]
+        self._writer = pq.ParquetWriter(self.output_file, schema)
+
+    def _flush(self) -> None:
+        self._writer.write_table(pa.Table.from_pydict(dict(zip(self.schema.names, self._columns)), schema=self.schema), row_group_size=self.row_group_size)
+        for column in self._columns:
+            column.clear()
+
+    def write(self, counter: Dict[Tuple[str, ...], int]) -> None:
+        if not counter:
+            return
+        if self._writer is None:
+            self._open(self.schema or SCHEMAS_BY_KEY_LENGTH[len(next(iter(counter)))])
+        columns = self._columns
+        has_count = self.schema.names[-1] == 'count'
+        for key, count in counter.items():
+            for column, value in zip(columns, key):
+                column.append(value)
+            if has_count:
+                columns[-1].append(count)
+        self.rows_written += len(counter)
+        if len(columns[0]) >= self.row_group_size:
+            self._flush()
+
+    def close(self) -> int:
+        """
+        Write the buffered rows and close the file.
+
+        Returns:
+        The number of written rows.
+        """
+        if self._writer is None:
+            self._open(self.schema or COMPONENT_SCHEMA)
+        if self._columns[0] or self.rows_written == 0:
+            self._flush()
+        self._writer.close()
+        return self.rows_written
+
+    def __enter__(self) -> "ParquetCounterWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        elif self._writer is not None:
+            self._writer.close()
+
+
+def reference_name(library_pickle_path: str) -> str:
+    """
+    Name a reference after its pickle, e.g. 'pandas' for api_reference_pickles/pandas.pickle or pandas.compiled.pickle.
+    """
+    return os.path.basename(library_pickle_path).removesuffix('.pickle').removesuffix('.compiled')
+
+
+def combine_library_references(references: Dict[str, Dict]) -> Tuple[Dict[str, Dict[str, FrozenSet[str]]], Dict[str, Tuple[str, ...]]]:
+    """
+    Combine several named API references into one, so a single traversal of a file counts the components of all of them.
+
+    Parameters:
+    references: A dictionary mapping reference names to API references (raw or compiled).
+
+    Returns:
+    A tuple containing:
+    - The combined compiled API reference.
+    - A dictionary mapping each module to the names of the references defining it.
+
+    Raises:
+    ValueError if two references define the same module with different components, as their counts
+    could then differ from separate runs (a name matched as one component type isn't checked as the next).
+    """
+    lib_dict = {}
+    module_references = {}
+    for name, reference in references.items():
+        for module, components in compile_library_reference(reference).items():
+            if module in lib_dict and lib_dict[module] != components:
+                raise ValueError(f"Module {module} is defined differently in references {', '.join(module_references[module])} and {name}, analyse them separately")
+            lib_dict[module] = components
+            module_references[module] = module_references.get(module, ()) + (name,)
+    return lib_dict, module_references
+
+
+def save_counters_as_parquet(counters: Iterable[Dict[Tuple[str, ...], int]], output_file: str, row_group_size: int = DEFAULT_ROW_GROUP_SIZE) -> int:
+    """
+    Stream dicts of counts (e.g. Counters) into a parquet file (see ParquetCounterWriter).
+
+    Parameters:
+    counters: An iterable of dicts mapping key tuples to counts.
+    output_file: Path to the output parquet file.
+    row_group_size: Maximum number of rows buffered before a row group is written.
+
+    Returns:
+    The number of written rows.
+    """
+    with ParquetCounterWriter(output_file, row_group_size) as writer:
+        for counter in counters:
+            writer.write(counter)
+    return writer.rows_written
+
+
+def save_dict_as_parquet(counter: Dict[Tuple[str, ...], int], output_file: str) -> None:
+    """
+    Save a single dict of counts (e.g. a Counter) to a parquet file, with rows sorted by key.
+
+    Parameters:
+    counter: A dict mapping key tuples to counts (see save_counters_as_parquet).
+    output_file: Path to the output parquet file.
+
+    Returns:
+    None
+    """
+    save_counters_as_parquet([{key: counter[key] for key in sorted(counter)}], output_file)
+
+
+def save_skipped_files_report(skipped_files: List[Tuple[str, str, str]], output_file: str) -> None:
+    """
+    Save the files skipped by the guards of process_files_in_parallel to a CSV file with 'filename', 'reason' and 'detail' columns.
+
+    Parameters:
+    skipped_files: A list of (filename, reason, detail) tuples, reason being one of the SKIP_* codes.
+    output_file: Path to the output CSV file.
+
+    Returns:
+    None
+    """
+    with open(output_file, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['filename', 'reason', 'detail'])
+        writer.writerows(sorted(skipped_files))
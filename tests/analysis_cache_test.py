@@ -0,0 +1,45 @@
+import os
+import tempfile
+from collections import Counter
+
+from src.analysis_cache import AnalysisCache, file_cache_key, encode_counter, decode_counter
+
+
+def test_file_cache_key():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        first_file = os.path.join(tmpdirname, "first.py")
+        second_file = os.path.join(tmpdirname, "second.py")
+        for code_file in (first_file, second_file):
+            with open(code_file, "w") as f:
+                f.write("import os")
+
+        assert file_cache_key(first_file, "v1", "full") == file_cache_key(second_file, "v1", "full")
+        assert file_cache_key(first_file, "v1", "full") != file_cache_key(first_file, "v2", "full")
+        assert file_cache_key(first_file, "", "full") != file_cache_key(first_file, "", "imports")
+        assert file_cache_key(os.path.join(tmpdirname, "missing.py"), "v1", "full") is None
+
+
+def test_encode_decode_counter():
+    counter = Counter({("a.py", "os", "function", "listdir"): 2, ("a.py", "math", "attribute", "pi"): 1})
+
+    assert decode_counter(encode_counter(counter), "a.py") == counter
+    assert decode_counter(encode_counter(counter), "b.py") == Counter({("b.py", "os", "function", "listdir"): 2, ("b.py", "math", "attribute", "pi"): 1})
+
+
+def test_analysis_cache_lru_eviction():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        cache_path = os.path.join(tmpdirname, "cache.sqlite")
+        cache = AnalysisCache(cache_path, max_bytes=25)
+        cache.update([("old", b"x" * 10), ("used", b"y" * 10)], [])
+        cache.update([("new", b"z" * 10)], ["used"])
+
+        reader = AnalysisCache(cache_path, read_only=True)
+        assert reader.get("old") == b"x" * 10
+        assert reader.get("missing") is None
+
+        assert cache.evict() == 1
+        assert reader.get("old") is None
+        assert reader.get("used") == b"y" * 10
+        assert reader.get("new") == b"z" * 10
+        reader.close()
+        cache.close()
@@ -0,0 +1,105 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from notebooks.analysis_utils import transform_df, module_usage, libraries_in_repos, libraries_in_files, modules_in_repos, modules_in_files, module_component_counts, component_in_files, component_counts, \
+    specific_component_type_in_files, specific_component_type_counts, cooccurrence_matrix, get_corr_table, top_partners, build_cube, save_cube, load_cube, cube_for
+
+
+RAW = pd.DataFrame({
+    "filename": ["/media/user/disk/repos/Absolut/scripts/AbsolutPose.py", "/media/user/disk/repos/Absolut/scripts/AbsolutPose.py", "/media/user/disk/repos/other/setup.py",
+                 "/media/user/disk/repos/third/setup.py"],
+    "module": ["os.path", "json", "os", "json"],
+    "component_type": ["function", "function", "function", "function"],
+    "component_name": ["join", "dumps", "getcwd", "loads"],
+    "count": [2, 1, 1, 3],
+})
+
+
+def test_transform_df():
+    df = transform_df(RAW)
+    assert df.columns.tolist() == ["repo", "filename", "module", "component_type", "component_name", "count", "library"]
+    assert df["repo"].tolist() == ["Absolut", "Absolut", "other", "third"]
+    assert df["filename"].tolist() == ["scripts/AbsolutPose.py", "scripts/AbsolutPose.py", "setup.py", "setup.py"]
+    assert df["library"].tolist() == ["os", "json", "os", "json"]
+    assert transform_df(RAW, root="/media/user/disk/repos/").equals(df)
+    assert transform_df(RAW, imports_only=True).columns.tolist() == ["repo", "filename", "module", "library"]
+
+
+def test_helpers_share_module_usage():
+    df = transform_df(RAW)
+    usage = module_usage(df)
+    assert len(usage) == 4
+    for helper in (libraries_in_repos, libraries_in_files, modules_in_repos, modules_in_files):
+        assert helper(usage).equals(helper(df))
+    assert list(libraries_in_repos(df).itertuples(index=False, name=None)) == [("json", 2), ("os", 2)]
+    assert list(libraries_in_files(df).itertuples(index=False, name=None)) == [("json", 2), ("os", 2)]
+    assert list(modules_in_files(df).itertuples(index=False, name=None)) == [("json", 2), ("os", 1), ("os.path", 1)]
+
+
+USAGE = pd.DataFrame({
+    "filename": ["a.py", "a.py", "b.py", "b.py", "c.py", "d.py", "d.py"],
+    "component_name": ["x", "y", "x", "y", "x", "y", "z"],
+    "count": [1, 2, 3, 1, 1, 5, 1],
+})
+
+
+def test_get_corr_table_matches_dense_correlation():
+    dense = USAGE.pivot_table(index="filename", columns="component_name", values="count", fill_value=0, aggfunc="sum")
+    assert np.allclose(get_corr_table(USAGE, binary=False).values, dense.corr().values)
+    assert np.allclose(get_corr_table(USAGE, binary=True).values, (dense > 0).astype(int).corr().values)
+
+    matrix, columns = cooccurrence_matrix(USAGE, top_n=2)
+    assert columns.tolist() == ["x", "y"] and matrix.shape == (4, 2)
+
+
+def test_get_corr_table_averages_duplicate_rows_like_pivot_table():
+    # The same component name imported from two modules in a.py and c.py.
+    usage = pd.concat([USAGE, pd.DataFrame({"filename": ["a.py", "c.py"], "component_name": ["x", "y"], "count": [4, 2]})], ignore_index=True)
+    mean = usage.pivot_table(index="filename", columns="component_name", values="count", fill_value=0)
+    total = usage.pivot_table(index="filename", columns="component_name", values="count", fill_value=0, aggfunc="sum")
+    assert np.allclose(get_corr_table(usage, binary=False).values, mean.corr().values)
+    assert np.allclose(get_corr_table(usage, binary=False, aggfunc="sum").values, total.corr().values)
+    assert np.allclose(get_corr_table(usage, binary=True).values, (mean > 0).astype(int).corr().values, equal_nan=True)
+    matrix, _ = cooccurrence_matrix(usage, binary=False)
+    assert matrix.toarray().tolist() == mean.values.tolist()
+
+
+def test_jaccard_and_lift():
+    jaccard = get_corr_table(USAGE, measure="jaccard")
+    lift = get_corr_table(USAGE, measure="lift")
+    # x is used in a, b, c and y in a, b, d: 2 files in common out of 4 files using either, 4 files in total.
+    assert jaccard.loc["x", "y"] == 2 / 4
+    assert lift.loc["x", "y"] == 2 * 4 / (3 * 3)
+    assert lift.loc["y", "z"] == 1 * 4 / (3 * 1)
+
+
+def test_top_partners():
+    partners = top_partners(USAGE, k=1, measure="jaccard")
+    assert list(partners.itertuples(index=False, name=None)) == [("x", "y", 0.5), ("y", "x", 0.5), ("z", "y", 1 / 3)]
+    assert top_partners(USAGE, k=2, measure="lift", min_support=2, block_size=1)["component_name"].tolist() == ["x", "y"]
+
+
+def test_cube_helpers_match_frame(tmp_path):
+    df = transform_df(RAW)
+    save_cube(build_cube(df), tmp_path / "cube")
+    cube = load_cube(tmp_path / "cube")
+    for helper in (libraries_in_repos, libraries_in_files, modules_in_repos, modules_in_files, module_component_counts):
+        pd.testing.assert_frame_equal(helper(cube), helper(df), check_dtype=False)
+    for module in ("os", "os.path", "json"):
+        for helper in (component_in_files, component_counts):
+            pd.testing.assert_frame_equal(helper(cube, module), helper(df, module), check_dtype=False)
+        for helper in (specific_component_type_in_files, specific_component_type_counts):
+            pd.testing.assert_frame_equal(helper(cube, module, "function"), helper(df, module, "function"), check_dtype=False)
+
+
+def test_cube_for_rebuilds_stale_cube(tmp_path):
+    path = str(tmp_path / "counts.parquet")
+    RAW.to_parquet(path)
+    assert cube_for(path).libraries["repos"].tolist() == [2, 2]
+    assert os.path.exists(tmp_path / "counts.cube" / "modules.parquet")
+    RAW.iloc[:2].to_parquet(path)
+    os.utime(path, (time.time() + 10, time.time() + 10))
+    assert cube_for(path).libraries["repos"].tolist() == [1, 1]
@@ -0,0 +1,45 @@
+import os
+import hashlib
+
+from benchmarks.synthetic_corpus import generate_corpus
+from benchmarks.benchmark_suite import compare_results, run_suite
+from src.utils import find_python_files
+
+
+def corpus_digest(directory):
+    digest = hashlib.sha256()
+    for code_file in sorted(find_python_files(directory, (".py", ".ipynb"))):
+        digest.update(os.path.relpath(code_file, directory).encode())
+        with open(code_file, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def test_generate_corpus_is_deterministic(tmp_path):
+    n_files = generate_corpus(str(tmp_path / "a"), n_repos=3, files_per_repo=4, notebooks_per_repo=2, huge_files=1, syntax_error_files=2)
+    generate_corpus(str(tmp_path / "b"), n_repos=3, files_per_repo=4, notebooks_per_repo=2, huge_files=1, syntax_error_files=2)
+    assert n_files == 3 * 4 + 3 * 2 + 1 + 2
+    assert len(find_python_files(str(tmp_path / "a"), (".py", ".ipynb"))) == n_files
+    assert corpus_digest(str(tmp_path / "a")) == corpus_digest(str(tmp_path / "b"))
+
+
+def test_extra_files_keep_python_files_unchanged(tmp_path):
+    generate_corpus(str(tmp_path / "plain"), n_repos=2, files_per_repo=3)
+    generate_corpus(str(tmp_path / "extra"), n_repos=2, files_per_repo=3, notebooks_per_repo=1, syntax_error_files=1)
+    for code_file in find_python_files(str(tmp_path / "plain")):
+        with open(code_file) as plain, open(code_file.replace("plain", "extra")) as extra:
+            assert plain.read() == extra.read()
+
+
+def test_compare_results():
+    baseline = {"fast": {"best": 0.001}, "slow": {"best": 1.0}, "stable": {"best": 1.0}}
+    results = {"fast": {"best": 0.002}, "slow": {"best": 1.5}, "stable": {"best": 1.1}, "new": {"best": 5.0}}
+    assert compare_results(results, baseline, tolerance=0.25) == ["slow"]
+
+
+def test_run_suite(tmp_path):
+    lib_dict = {"os": {"function": ["listdir", "getcwd"], "method": [], "class": [], "attribute": [], "exception": []}}
+    generate_corpus(str(tmp_path), n_repos=2, files_per_repo=3, notebooks_per_repo=1, syntax_error_files=1)
+    results = run_suite(str(tmp_path), lib_dict, repeat=1, workers=1, cases=["process_file_full", "convert_notebook_to_python", "build_cube"])
+    assert list(results) == ["process_file_full", "convert_notebook_to_python", "build_cube"]
+    assert all(result["best"] <= result["median"] for result in results.values())
@@ -0,0 +1,84 @@
+import os
+import logging
+
+import pytest
+
+from benchmarks.synthetic_corpus import generate_corpus
+from src.analysis_cache import AnalysisCache
+from src.corpus_archives import pack_repositories, find_archives, iter_archive_members
+from src.lib_elements_counter import process_file, process_files_in_parallel
+from src.utils import SKIP_TOO_LARGE, SKIP_UNREADABLE, find_python_files
+
+
+LIB_DICT = {"os": {"function": ["listdir", "getcwd"], "method": [], "class": [], "attribute": [], "exception": []},
+            "json": {"function": ["loads", "dumps"], "method": [], "class": [], "attribute": [], "exception": ["JSONDecodeError"]}}
+SUFFIXES = (".py", ".ipynb")
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    root = str(tmp_path / "repos")
+    generate_corpus(root, n_repos=5, files_per_repo=4, notebooks_per_repo=1, syntax_error_files=2)
+    with open(os.path.join(root, "repo_0000", "windows.py"), "wb") as f:
+        f.write(b"import os\r\nos.listdir('.')\r\n\xff\r\n")
+    return root
+
+
+def run_counter(code_files, **kwargs):
+    counter = {}
+    for batch_counter in process_files_in_parallel(process_file, LIB_DICT, code_files, logging.getLogger("test"), "both", workers=2, **kwargs):
+        counter.update(batch_counter)
+    return counter
+
+
+@pytest.mark.parametrize("archive_format", ["tar.gz", "zip"])
+def test_archives_give_the_output_of_the_checkouts(corpus, tmp_path, archive_format):
+    archive_directory = str(tmp_path / "archives")
+    archive_paths = pack_repositories(corpus, archive_directory, repos_per_archive=2, archive_format=archive_format)
+    assert len(archive_paths) == 3
+    assert list(find_archives(archive_directory)) == archive_paths
+    assert list(find_archives(archive_directory, (1, 1))) == archive_paths[1:2]
+
+    code_files = find_python_files(corpus, SUFFIXES)
+    members = [filename for archive_path in archive_paths for filename, _, _ in iter_archive_members(archive_path, corpus, SUFFIXES)]
+    assert sorted(members) == sorted(code_files)
+
+    expected = run_counter(code_files)
+    assert any(key[0].endswith("windows.py") for key in expected)
+    assert run_counter(archive_paths, archive_root=corpus, suffixes=SUFFIXES) == expected
+
+
+def test_archive_members_share_the_cache_and_limits(corpus, tmp_path):
+    archive_paths = pack_repositories(corpus, str(tmp_path / "archives"), repos_per_archive=5)
+    cache = AnalysisCache(str(tmp_path / "cache.sqlite"))
+    expected = run_counter(find_python_files(corpus, SUFFIXES), cache=cache)
+    assert run_counter(archive_paths, archive_root=corpus, suffixes=SUFFIXES, cache=cache) == expected
+    cache.close()
+
+    with open(tmp_path / "archives" / "broken.zip", "wb") as f:
+        f.write(b"not a zip")
+    skipped_files = []
+    run_counter(archive_paths + [str(tmp_path / "archives" / "broken.zip")], archive_root=corpus, suffixes=SUFFIXES, max_file_bytes=500, skipped_files=skipped_files)
+    reasons = {reason for _, reason, _ in skipped_files}
+    assert reasons == {SKIP_TOO_LARGE, SKIP_UNREADABLE}
+    assert (str(tmp_path / "archives" / "broken.zip"), SKIP_UNREADABLE) in {(filename, reason) for filename, reason, _ in skipped_files}
+
+
+def test_corrupt_member_is_skipped(tmp_path):
+    root = str(tmp_path / "repos")
+    for repo in ("a", "b"):
+        os.makedirs(os.path.join(root, repo))
+        with open(os.path.join(root, repo, "main.py"), "w") as f:
+            f.write("import os\nos.listdir('.')\n" * 50)
+    archive_path = pack_repositories(root, str(tmp_path / "archives"))[0]
+    with open(archive_path, "rb") as f:
+        data = bytearray(f.read())
+    # The compressed data of the first member starts after its local header (30 bytes, the name, no extra field).
+    data[30 + len("a/main.py") + 5] ^= 0xFF
+    with open(archive_path, "wb") as f:
+        f.write(data)
+
+    skipped_files = []
+    counter = run_counter([archive_path], archive_root=root, suffixes=(".py",), skipped_files=skipped_files)
+    assert [(filename, reason) for filename, reason, _ in skipped_files] == [(os.path.join(root, "a", "main.py"), SKIP_UNREADABLE)]
+    assert {key[0] for key in counter} == {os.path.join(root, "b", "main.py")}
@@ -0,0 +1,165 @@
+import re
+import json
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+SEARCH_RESULTS_CAP = 1000
+REPOSITORY_PATTERN = re.compile(r'(r\d+): repository\(owner: ("(?:[^"\\]|\\.)*"), name: ("(?:[^"\\]|\\.)*")\)')
+SEARCH_PATTERN = re.compile(r'(r\d+): search\(query: ("(?:[^"\\]|\\.)*"), type: REPOSITORY, first: 1\)')
+
+
+def fake_repo(repo_id, created_at, stars=100):
+    timestamp = created_at.strftime("%Y-%m-%dT%H:%M:%SZ")
+    html_url = f"https://github.com/owner{repo_id}/repo{repo_id}"
+    return {"id": repo_id, "node_id": f"R_{repo_id}", "name": f"repo{repo_id}", "full_name": f"owner{repo_id}/repo{repo_id}", "private": False,
+            "owner": {"login": f"owner{repo_id}", "html_url": f"https://github.com/owner{repo_id}", "type": "User"}, "html_url": html_url, "description": f"Repository {repo_id}",
+            "fork": False, "created_at": timestamp, "updated_at": timestamp, "pushed_at": timestamp, "homepage": None, "size": 10, "stargazers_count": stars, "watchers_count": stars,
+            "language": "Python" if repo_id % 5 else None, "has_issues": True, "has_projects": True, "has_wiki": False, "forks_count": repo_id % 7, "mirror_url": None,
+            "archived": repo_id % 11 == 0, "disabled": False, "open_issues_count": repo_id % 3,
+            "license": {"key": "mit", "name": "MIT License", "spdx_id": "MIT"} if repo_id % 2 else None, "allow_forking": True, "is_template": False, "topics": [],
+            "visibility": "public", "forks": repo_id % 7, "open_issues": repo_id % 3, "watchers": stars, "default_branch": "main", "clone_url": f"{html_url}.git",
+            "ssh_url": f"git@github.com:owner{repo_id}/repo{repo_id}.git", "svn_url": html_url}
+
+
+def graphql_node(repo):
+    license_info = repo["license"]
+    return {"databaseId": repo["id"], "id": repo["node_id"], "name": repo["name"], "nameWithOwner": repo["full_name"],
+            "owner": {"login": repo["owner"]["login"], "url": repo["owner"]["html_url"], "__typename": repo["owner"]["type"]}, "isPrivate": repo["private"], "url": repo["html_url"],
+            "description": repo["description"], "isFork": repo["fork"], "createdAt": repo["created_at"], "updatedAt": repo["updated_at"], "pushedAt": repo["pushed_at"],
+            "homepageUrl": repo["homepage"], "diskUsage": repo["size"], "stargazerCount": repo["stargazers_count"], "primaryLanguage": {"name": repo["language"]} if repo["language"] else None,
+            "hasIssuesEnabled": repo["has_issues"], "hasProjectsEnabled": repo["has_projects"], "hasWikiEnabled": repo["has_wiki"], "forkCount": repo["forks_count"],
+            "mirrorUrl": repo["mirror_url"], "isArchived": repo["archived"], "isDisabled": repo["disabled"], "issues": {"totalCount": repo["open_issues_count"]},
+            "pullRequests": {"totalCount": 0}, "licenseInfo": {"key": license_info["key"], "name": license_info["name"], "spdxId": license_info["spdx_id"]} if license_info else None,
+            "forkingAllowed": repo["allow_forking"], "isTemplate": repo["is_template"], "repositoryTopics": {"nodes": [{"topic": {"name": topic}} for topic in repo["topics"]]},
+            "visibility": repo["visibility"].upper(), "defaultBranchRef": {"name": repo["default_branch"]}, "sshUrl": repo["ssh_url"]}
+
+
+def parse_created_range(query):
+    created = next(term for term in query.split() if term.startswith("created:"))[len("created:"):]
+    start, _, end = created.partition("..")
+    end = end or start
+    parse = lambda value: datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc) if "T" in value else datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    return parse(start), parse(end) + (timedelta(days=1) - timedelta(seconds=1) if "T" not in end else timedelta())
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class MockGitHub:
+    """
+    A local HTTP server answering GitHub search requests from a list of fake repositories, with the 1000 result cap
+    of the search API and a rate limit of rate_limit requests per window_seconds reported in X-RateLimit-* headers.
+    GraphQL queries of repository and search fields are answered too, failing with 502 above max_aliases fields per query.
+    Each response is delayed by latency seconds.
+    """
+
+    def __init__(self, repos, rate_limit=1000, window_seconds=60.0, latency=0.0, max_aliases=100):
+        self.repos = repos
+        self.latency = latency
+        self.max_aliases = max_aliases
+        self.by_full_name = {repo["full_name"]: repo for repo in repos}
+        self.rate_limit = rate_limit
+        self.window_seconds = window_seconds
+        self.window_start = time.time()
+        self.window_requests = 0
+        self.requests = []
+        self.rejected = 0
+        self.created = [datetime.strptime(repo["created_at"], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc) for repo in repos]
+        self.lock = threading.Lock()
+        self.server = _Server(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _rate_limit_headers(self):
+        with self.lock:
+            now = time.time()
+            if now - self.window_start >= self.window_seconds:
+                self.window_start, self.window_requests = now, 0
+            self.window_requests += 1
+            remaining = self.rate_limit - self.window_requests
+            if remaining < 0:
+                self.rejected += 1
+            return remaining, {"X-RateLimit-Limit": str(self.rate_limit), "X-RateLimit-Remaining": str(max(remaining, 0)), "X-RateLimit-Reset": str(self.window_start + self.window_seconds)}
+
+    def search(self, params):
+        start, end = parse_created_range(params["q"][0])
+        matching = sorted((repo for repo, created in zip(self.repos, self.created) if start <= created <= end),
+                          key=lambda repo: (-repo["stargazers_count"], repo["id"]))
+        per_page, page = int(params.get("per_page", ["30"])[0]), int(params.get("page", ["1"])[0])
+        if page * per_page > SEARCH_RESULTS_CAP:
+            return 422, {"message": "Only the first 1000 search results are available"}
+        return 200, {"total_count": len(matching), "incomplete_results": False, "items": matching[(page - 1) * per_page:page * per_page]}
+
+    def graphql(self, query):
+        repositories, searches = REPOSITORY_PATTERN.findall(query), SEARCH_PATTERN.findall(query)
+        if len(repositories) + len(searches) > self.max_aliases:
+            return 502, {"message": "Query timed out"}
+        data, errors = {}, []
+        for alias, owner, name in repositories:
+            repo = self.by_full_name.get(f"{json.loads(owner)}/{json.loads(name)}")
+            data[alias] = graphql_node(repo) if repo else None
+            if repo is None:
+                errors.append({"type": "NOT_FOUND", "path": [alias]})
+        for alias, search_query in searches:
+            matching = [repo for repo in self.repos if repo["name"] == json.loads(search_query)]
+            data[alias] = {"nodes": [graphql_node(repo) for repo in matching[:1]]}
+        return 200, {"data": data, **({"errors": errors} if errors else {})}
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keeps connections open between requests, as the API does.
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, body, headers):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                time.sleep(mock.latency)
+                remaining, headers = mock._rate_limit_headers()
+                url = urlparse(self.path)
+                with mock.lock:
+                    mock.requests.append(self.path)
+                if remaining < 0:
+                    return self.reply(403, {"message": "API rate limit exceeded"}, headers)
+                if url.path != "/search/repositories":
+                    return self.reply(404, {"message": "Not Found"}, headers)
+                self.reply(*mock.search(parse_qs(url.query)), headers)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                time.sleep(mock.latency)
+                remaining, headers = mock._rate_limit_headers()
+                with mock.lock:
+                    mock.requests.append(self.path)
+                if remaining < 0:
+                    return self.reply(403, {"message": "API rate limit exceeded"}, headers)
+                if self.path != "/graphql":
+                    return self.reply(404, {"message": "Not Found"}, headers)
+                self.reply(*mock.graphql(body["query"]), headers)
+
+        return Handler
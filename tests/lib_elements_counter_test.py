@@ -1,9 +1,17 @@
+import os
 import ast
+import glob
+import signal
+import logging
 import pytest
+import pandas as pd
 from collections import Counter
 from typing import List, Dict
 
-from src.lib_elements_counter import get_imported_modules, check_node
+from src.utils import SKIP_TOO_LARGE, SKIP_TIMEOUT
+from src.lib_elements_counter import get_imported_modules, extract_imports_fast, check_node, ComponentVisitor, init_worker, process_guarded, process_batch_in_worker, process_file, process_files_in_parallel, build_reference_prefilter, concatenate_and_save, reference_output_path
+from src import lib_elements_counter
+from src.analysis_cache import AnalysisCache
 
 
 @pytest.mark.parametrize(
@@ -26,6 +34,58 @@ def test_get_imported_modules(code, max_depth, expected):
     assert get_imported_modules(tree, max_depth) == expected
 
 
+IMPORTS_PARITY_CODE = [
+    "import os",
+    "import os, sys",
+    "import os as operating_system",
+    "from os import path",
+    "from os import path as os_path",
+    "from os import path, environ",
+    "import xml.etree.ElementTree",
+    "import xml.etree.ElementTree as elementtree",
+    "from xml.etree import ElementTree",
+    'print("Hello, world!")',
+    "from . import sibling\nfrom ..package import module",
+    "from os import (\n    path,  # comment\n    sep,\n)",
+    "from os import path, \\\n    sep",
+    "from os \\\n    import path",
+    "import os, \\\n    sys\nfrom xml \\\nimport etree",
+    "def f():\n    if x:\n        from os \\\n            import path\n    import sys",
+    'x = """\nimport not_imported\n"""\nimport os',
+    "s = 'import not_imported'  # import not_imported\nimport os",
+    "try:\n    import json\nexcept ImportError:\n    import simplejson as json\nelse:\n    import csv\nfinally:\n    import io",
+    "if a:\n    import os\nelif b:\n    import sys\nelse:\n    import re",
+    "if a:\n    import os\nelse:\n    import re",
+    "for x in y:\n    pass\nelse:\n    import re",
+    "def f():\n    import os\n    if x:\n        import sys\n    return os",
+    "class A(\n        Base,\n):\n    import os\n\n    def f(self):\n        import sys",
+    "@decorator\ndef f():\n\timport os",
+    "match x:\n    case 1:\n        import os",
+    "with open(f) as g:\n    from os import path",
+    "import os; import sys",
+    "if x: import os",
+    "def f():\n    raise ValueError() \\\n        from error",
+]
+
+
+@pytest.mark.parametrize("code", IMPORTS_PARITY_CODE)
+def test_extract_imports_fast_matches_get_imported_modules(code):
+    imports = extract_imports_fast(code)
+    # None asks the caller to fall back to the AST, which is only expected for imports after ':' or ';' and 'from' continuing a statement.
+    if imports is None:
+        assert ":" in code or ";" in code or "raise" in code
+    else:
+        assert imports == get_imported_modules(ast.parse(code))
+
+
+def test_extract_imports_fast_matches_get_imported_modules_on_this_repository():
+    source_files = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "..", "src", "*.py")))
+    for source_file in source_files:
+        with open(source_file) as f:
+            code = f.read()
+        assert extract_imports_fast(code) == get_imported_modules(ast.parse(code)), source_file
+
+
 @pytest.fixture
 def setup_data():
     components = {"math": {"function": ["sqrt", "pow"], "attribute": ["pi"], "method": [], "class": []}}
@@ -75,3 +135,171 @@ def test_check_node_no_match(setup_data):
     components, component_counter, code_file, module, module_direct_imports = setup_data
     node = ast.parse('print("Hello, World!")').body[0].value
     check_node(node, components["math"], component_counter, code_file, module, module_direct_imports)
+
+
+PARITY_CODE = """
+import os
+import math as m
+from math import sqrt, pi
+from os import listdir, getcwd
+from json import JSONDecodeError, loads
+
+sqrt(4)
+math.sqrt(9)
+m.sqrt(9)
+os.listdir(".")
+listdir(getcwd())
+print(os.getcwd())
+sorted(data, key=sqrt)
+map(sqrt, values)
+map(str, os.listdir("."))
+open(getcwd(), mode="r")
+print(x, file=os.sep)
+data.append(os.path)
+os.path.join("a", "b")
+os.DirEntry()
+math.pi
+pi
+try:
+    loads("{}")
+except JSONDecodeError:
+    raise json.JSONDecodeError
+except os.error:
+    raise JSONDecodeError
+"""
+
+
+def test_component_visitor_matches_check_node():
+    lib_dict = {
+        "os": {"function": ["listdir", "getcwd", "open"], "method": ["append"], "class": ["DirEntry"], "attribute": ["path", "sep"], "exception": ["error"]},
+        "math": {"function": ["sqrt", "pow"], "method": [], "class": [], "attribute": ["pi"], "exception": []},
+        "json": {"function": ["loads"], "method": ["append"], "class": [], "attribute": [], "exception": ["JSONDecodeError"]},
+        "re": {"function": ["compile"], "method": [], "class": [], "attribute": [], "exception": []},
+    }
+    tree = ast.parse(PARITY_CODE)
+    imported_modules, direct_imports = get_imported_modules(tree)
+
+    expected = Counter()
+    for node in ast.walk(tree):
+        for module, components in lib_dict.items():
+            if module in imported_modules:
+                check_node(node, components, expected, "test.py", module, direct_imports[module])
+
+    result = Counter()
+    ComponentVisitor(lib_dict, imported_modules, direct_imports, result, "test.py").visit(tree)
+
+    assert result == expected
+    assert result[("test.py", "os", "function", "listdir")] == 3
+    assert ("test.py", "re", "function", "compile") not in result
+
+
+def test_traversal_of_deeply_nested_tree():
+    expression = ast.Attribute(value=ast.Name(id="math", ctx=ast.Load()), attr="pi", ctx=ast.Load())
+    for _ in range(5000):
+        expression = ast.UnaryOp(op=ast.USub(), operand=expression)
+    tree = ast.Module(body=[ast.Import(names=[ast.alias(name="math")]), ast.Expr(value=expression)], type_ignores=[])
+    lib_dict = {"math": {"function": [], "method": [], "class": [], "attribute": ["pi"], "exception": []}}
+
+    imported_modules, direct_imports = get_imported_modules(tree, max_depth=None)
+    component_counter = Counter()
+    ComponentVisitor(lib_dict, imported_modules, direct_imports, component_counter, "test.py").visit(tree)
+
+    assert imported_modules == {"math"}
+    assert component_counter == Counter({("test.py", "math", "attribute", "pi"): 1})
+
+
+def test_process_guarded_skips_large_and_slow_files(tmp_path):
+    def slow_process_file(logger, lib_dict, code_file, mode):
+        while True:
+            pass
+
+    small_file, large_file = tmp_path / "small.py", tmp_path / "large.py"
+    small_file.write_text("x = 1")
+    large_file.write_text("x = 1" * 100)
+
+    init_worker(slow_process_file, {}, logging.getLogger("test"), "full", max_file_bytes=100, file_timeout=0.1)
+    try:
+        assert process_guarded(str(large_file)) == (Counter(), (str(large_file), SKIP_TOO_LARGE, "500 bytes"))
+        assert process_guarded(str(small_file)) == (Counter(), (str(small_file), SKIP_TIMEOUT, "0.1 s"))
+    finally:
+        signal.signal(signal.SIGALRM, signal.SIG_DFL)
+
+
+def test_build_reference_prefilter():
+    prefilter = build_reference_prefilter({"xml.etree.ElementTree": {}, "os.path": {}, "os": {}})
+    assert prefilter.search(b"from xml.etree import ElementTree")
+    assert prefilter.search(b"import os")
+    assert not prefilter.search(b"import xmlrpc, osmnx")
+    assert build_reference_prefilter({}) is None
+
+
+def test_process_batch_in_worker_skips_files_without_reference_modules(tmp_path):
+    lib_dict = {"math": {"function": ["sqrt"], "method": [], "class": [], "attribute": [], "exception": []}}
+    with_math, without_math = tmp_path / "with_math.py", tmp_path / "without_math.py"
+    with_math.write_text("import math\nmath.sqrt(4)")
+    without_math.write_text("import os\nos.getcwd()")
+
+    init_worker(process_file, lib_dict, logging.getLogger("test"), "full", prefilter=build_reference_prefilter(lib_dict))
+    counter, hit_keys, new_entries, skipped, n_prefiltered, batch_metrics, profile_stats = process_batch_in_worker([str(with_math), str(without_math)])
+    assert counter == Counter({(str(with_math), "math", "function", "sqrt"): 1})
+    assert n_prefiltered == 1
+
+
+def test_concatenate_and_save_with_references(tmp_path):
+    module_references = {"os": ("stdlib",), "json": ("stdlib", "other")}
+    counters = [Counter({("a.py", "os", "function", "getcwd"): 2}), Counter({("b.py", "json", "function", "dumps"): 1})]
+
+    output_file = str(tmp_path / "counts.parquet")
+    concatenate_and_save(counters, output_file, module_references=module_references)
+    assert sorted(pd.read_parquet(output_file).itertuples(index=False, name=None)) == [
+        ("other", "b.py", "json", "function", "dumps", 1), ("stdlib", "a.py", "os", "function", "getcwd", 2), ("stdlib", "b.py", "json", "function", "dumps", 1)]
+
+    concatenate_and_save(counters, output_file, module_references=module_references, output_per_reference=True)
+    assert len(pd.read_parquet(reference_output_path(output_file, "stdlib"))) == 2
+    assert list(pd.read_parquet(reference_output_path(output_file, "other")).itertuples(index=False, name=None)) == [("b.py", "json", "function", "dumps", 1)]
+
+
+def test_process_file_both_modes_from_one_parse(tmp_path):
+    lib_dict = {"math": {"function": ["sqrt"], "method": [], "class": [], "attribute": [], "exception": []}}
+    code_file = tmp_path / "a.py"
+    code_file.write_text("import os\nimport math\nmath.sqrt(4)")
+    logger = logging.getLogger("test")
+    both = process_file(logger, lib_dict, str(code_file), "both")
+    assert both == process_file(logger, lib_dict, str(code_file), "full") + process_file(logger, lib_dict, str(code_file), "imports")
+
+    output_file, imports_output_file = str(tmp_path / "counts.parquet"), str(tmp_path / "imports.parquet")
+    concatenate_and_save([both], output_file, imports_output_file=imports_output_file)
+    assert list(pd.read_parquet(output_file).itertuples(index=False, name=None)) == [(str(code_file), "math", "function", "sqrt", 1)]
+    assert sorted(pd.read_parquet(imports_output_file)["module"]) == ["math", "os"]
+
+
+@pytest.mark.parametrize("mode", ["imports", "both"])
+def test_files_that_dont_parse_have_imports_only_with_lenient_imports(tmp_path, mode):
+    code_file = tmp_path / "python2.py"
+    code_file.write_text("import os\nprint 'old'\n")
+    logger = logging.getLogger("test")
+    assert process_file(logger, {}, str(code_file), mode) == Counter()
+    assert process_file(logger, {}, str(code_file), mode, lenient_imports=True) == Counter({(str(code_file), "os"): 1})
+
+    # Workers get the setting through the initializer, and it is part of the cache key.
+    for lenient_imports in (False, True):
+        cache = AnalysisCache(str(tmp_path / "cache.sqlite"))
+        counters = list(process_files_in_parallel(process_file, {}, [str(code_file)], logger, mode, workers=1, cache=cache, lenient_imports=lenient_imports))
+        cache.close()
+        assert sum(counters, Counter()) == (Counter({(str(code_file), "os"): 1}) if lenient_imports else Counter())
+
+
+def test_large_files_are_skipped_before_computing_their_cache_key(tmp_path, monkeypatch):
+    small_file, large_file = tmp_path / "small.py", tmp_path / "large.py"
+    small_file.write_text("import os")
+    large_file.write_text("import os\n" * 100)
+    cache_path = str(tmp_path / "cache.sqlite")
+    AnalysisCache(cache_path).close()
+    hashed = []
+    monkeypatch.setattr(lib_elements_counter, "file_cache_key", lambda code_file, *args: hashed.append(code_file))
+
+    init_worker(process_file, {}, logging.getLogger("test"), "imports", cache_path=cache_path, max_file_bytes=100)
+    counter, hit_keys, new_entries, skipped, n_prefiltered, batch_metrics, profile_stats = process_batch_in_worker([str(small_file), str(large_file)])
+    assert skipped == [(str(large_file), SKIP_TOO_LARGE, "1000 bytes")]
+    assert hashed == [str(small_file)]
+    assert counter == Counter({(str(small_file), "os"): 1})
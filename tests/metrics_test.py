@@ -0,0 +1,53 @@
+import json
+import logging
+from collections import Counter
+
+from src.metrics import Metrics, save_metrics, merge_profile_stats
+from src.lib_elements_counter import process_file, init_worker, process_batch_in_worker
+
+
+LIB_DICT = {"math": {"function": ["sqrt"], "method": [], "class": [], "attribute": [], "exception": []}}
+
+
+def test_merge_keeps_slowest_files():
+    first, second = Metrics(slowest_files=2), Metrics(slowest_files=2)
+    first.add_file("a.py", 1.0, {"parse": 0.5})
+    first.add_file("b.py", 3.0, {"parse": 2.0})
+    second.add_file("c.py", 2.0, {"parse": 1.0, "visit": 1.0})
+    second.count("skipped")
+    first.merge(second)
+    assert [code_file for _, code_file, _ in first.slowest()] == ["b.py", "c.py"]
+    assert first.stage_seconds == {"parse": 3.5, "visit": 1.0, "file_total": 6.0}
+    assert first.counters == Counter({"files_processed": 3, "skipped": 1})
+
+
+def test_process_file_timings_and_results_match(tmp_path):
+    code_file = tmp_path / "a.py"
+    code_file.write_text("import math\nmath.sqrt(4)\n")
+    timings = {}
+    logger = logging.getLogger("test")
+    assert process_file(logger, LIB_DICT, str(code_file), "full", timings) == process_file(logger, LIB_DICT, str(code_file), "full")
+    assert list(timings) == ["read", "parse", "find_imports", "visit"]
+
+
+def test_worker_returns_metrics_and_profile(tmp_path):
+    code_files = []
+    for i in range(3):
+        code_file = tmp_path / f"{i}.py"
+        code_file.write_text("import math\n" + "math.sqrt(4)\n" * (10 ** i))
+        code_files.append(str(code_file))
+    init_worker(process_file, LIB_DICT, logging.getLogger("test"), "full", slowest_files=2, profile=True)
+    counter, _, _, _, _, metrics, profile_stats = process_batch_in_worker(code_files)
+    assert counter[(code_files[2], "math", "function", "sqrt")] == 100
+    assert metrics.counters["files_processed"] == 3
+    assert len(metrics.slowest()) == 2
+    stats = merge_profile_stats(merge_profile_stats(None, profile_stats), profile_stats)
+    assert any(function == "process_file" for _, _, function in stats.stats)
+
+    save_metrics(metrics, str(tmp_path / "metrics.json"), {"mode": "full"})
+    with open(tmp_path / "metrics.json") as f:
+        saved = json.load(f)
+    assert saved["mode"] == "full" and saved["counters"]["files_processed"] == 3 and len(saved["slowest_files"]) == 2
+
+    init_worker(process_file, LIB_DICT, logging.getLogger("test"), "full")
+    assert process_batch_in_worker(code_files)[5:] == (None, None)
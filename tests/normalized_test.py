@@ -0,0 +1,41 @@
+import os
+import tempfile
+from collections import Counter
+
+import pytest
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.utils import save_dict_as_parquet
+from src.normalized import split_repo_path, normalize_tables, normalized_table_path
+from notebooks.analysis_utils import load_normalized
+
+
+def test_split_repo_path():
+    assert split_repo_path("/data/repos/repo_a/pkg/mod.py", "/data/repos") == ("repo_a", "pkg/mod.py")
+    assert split_repo_path("/data/repos/repo_a/repo_a/mod.py", "/data/repos/") == ("repo_a", "repo_a/mod.py")
+    with pytest.raises(ValueError):
+        split_repo_path("/elsewhere/repo_a/mod.py", "/data/repos")
+
+
+def test_normalize_tables_round_trip():
+    components = Counter({("/data/repos/repo_a/a.py", "os", "function", "getcwd"): 3, ("/data/repos/repo_a/a.py", "os.path", "function", "join"): 1,
+                          ("/data/repos/repo_b/pkg/a.py", "os", "function", "getcwd"): 2})
+    imports = Counter({("/data/repos/repo_b/pkg/a.py", "os"): 1, ("/data/repos/repo_b/b.py", "json"): 1})
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        save_dict_as_parquet(components, os.path.join(tmpdirname, "components.flat.parquet"))
+        save_dict_as_parquet(imports, os.path.join(tmpdirname, "imports.flat.parquet"))
+        normalized_directory = os.path.join(tmpdirname, "normalized")
+        rows_written = normalize_tables({"components": os.path.join(tmpdirname, "components.flat.parquet"), "imports": os.path.join(tmpdirname, "imports.flat.parquet")},
+                                        normalized_directory, "/data/repos", row_group_size=2)
+        assert rows_written == {"components": 3, "imports": 2, "repos": 2, "files": 3}
+
+        schema = pq.read_schema(normalized_table_path(normalized_directory, "components"))
+        assert schema.field("component_type").type == pa.dictionary(pa.int8(), pa.string())
+        assert schema.field("count").type == pa.int32()
+
+        df = load_normalized(normalized_directory)
+        assert sorted(df[["repo", "filename", "module", "component_type", "component_name", "count", "library"]].astype({"count": int}).itertuples(index=False, name=None)) == [
+            ("repo_a", "a.py", "os", "function", "getcwd", 3, "os"), ("repo_a", "a.py", "os.path", "function", "join", 1, "os"), ("repo_b", "pkg/a.py", "os", "function", "getcwd", 2, "os")]
+        assert sorted(load_normalized(normalized_directory, "imports")[["repo", "filename", "module"]].itertuples(index=False, name=None)) == [
+            ("repo_b", "b.py", "json"), ("repo_b", "pkg/a.py", "os")]
@@ -0,0 +1,36 @@
+import os
+import tempfile
+from collections import Counter
+
+import pytest
+import pandas as pd
+
+from src.utils import save_dict_as_parquet
+from src.partitioned import partition_tables
+from notebooks.analysis_utils import PartitionedDataset, transform_df, libraries_in_repos, libraries_in_files, modules_in_repos, modules_in_files, module_component_counts, \
+    component_in_files, component_counts, specific_component_type_in_files, specific_component_type_counts
+
+
+COMPONENTS = Counter({("/data/repos/repo_a/a.py", "os", "function", "getcwd"): 3, ("/data/repos/repo_a/a.py", "os.path", "function", "join"): 1,
+                      ("/data/repos/repo_a/b.py", "os.path", "attribute", "sep"): 2, ("/data/repos/repo_b/pkg/a.py", "os", "function", "getcwd"): 2,
+                      ("/data/repos/repo_b/pkg/a.py", "json", "function", "dumps"): 4, ("/data/repos/repo_c/a.py", "os.path", "function", "join"): 5})
+
+
+@pytest.mark.parametrize("partition_by", ["library", "module"])
+def test_partitioned_helpers_match_frame(partition_by):
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        flat_path = os.path.join(tmpdirname, "components.parquet")
+        save_dict_as_parquet(COMPONENTS, flat_path)
+        partitioned_directory = os.path.join(tmpdirname, "partitioned")
+        assert partition_tables({"components": flat_path}, partitioned_directory, "/data/repos", partition_by, row_group_size=2) == {"components": len(COMPONENTS)}
+        assert sorted(os.listdir(os.path.join(partitioned_directory, "components"))) == (["library=json", "library=os"] if partition_by == "library" else ["module=json", "module=os", "module=os.path"])
+
+        df = transform_df(pd.read_parquet(flat_path), root="/data/repos")
+        dataset = PartitionedDataset(partitioned_directory)
+        for helper in (libraries_in_repos, libraries_in_files, modules_in_repos, modules_in_files, module_component_counts):
+            pd.testing.assert_frame_equal(helper(dataset), helper(df), check_dtype=False)
+        for module in ("os", "os.path", "json", "missing"):
+            for helper in (component_in_files, component_counts):
+                pd.testing.assert_frame_equal(helper(dataset, module), helper(df, module), check_dtype=False, check_index_type=False)
+            for helper in (specific_component_type_in_files, specific_component_type_counts):
+                pd.testing.assert_frame_equal(helper(dataset, module, "function"), helper(df, module, "function"), check_dtype=False, check_index_type=False)
@@ -0,0 +1,100 @@
+import os
+import pickle
+import subprocess
+
+from src.corpus_archives import iter_archive_members
+from src.repo_acquisition.repo_cloner import _clone_or_log, clone_repo, clone_repos
+
+
+def git(*args, cwd=None):
+    subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args], cwd=cwd, check=True, capture_output=True)
+
+
+def make_bare_repo(base_directory, full_name, files):
+    work_directory = os.path.join(base_directory, "work", full_name)
+    for path, content in files.items():
+        os.makedirs(os.path.dirname(os.path.join(work_directory, path)), exist_ok=True)
+        with open(os.path.join(work_directory, path), "w") as f:
+            f.write(content)
+    git("init", "--quiet", cwd=work_directory)
+    git("add", "--all", cwd=work_directory)
+    git("commit", "--quiet", "-m", "first", cwd=work_directory)
+    with open(os.path.join(work_directory, "old.py"), "w") as f:
+        f.write("removed = True\n")
+    git("add", "--all", cwd=work_directory)
+    git("commit", "--quiet", "-m", "second", cwd=work_directory)
+    git("rm", "--quiet", "old.py", cwd=work_directory)
+    git("commit", "--quiet", "-m", "third", cwd=work_directory)
+    bare_directory = os.path.join(base_directory, "bare", f"{full_name}.git")
+    git("clone", "--quiet", "--bare", work_directory, bare_directory)
+    # Hosts like GitHub accept partial clone filters, a local bare repository has to enable them.
+    git("config", "uploadpack.allowFilter", "true", cwd=bare_directory)
+    return f"file://{os.path.join(base_directory, 'bare')}"
+
+
+FILES = {"main.py": "import os\n", "notebook.ipynb": "{}\n", "requirements.txt": "pandas\n", "pkg/module.py": "x = 1\n", "assets/logo.png": "png" * 1000, "README.md": "# readme\n"}
+
+
+def test_clone_repo_checks_out_only_kept_suffixes(tmp_path):
+    base_url = make_bare_repo(str(tmp_path), "owner/project", FILES)
+    repo_dir = str(tmp_path / "clone")
+    files = clone_repo(f"{base_url}/owner/project.git", repo_dir)
+
+    assert sorted(files) == sorted(os.path.basename(path) for path in FILES)
+    checked_out = sorted(os.path.relpath(os.path.join(root, file), repo_dir) for root, _, names in os.walk(repo_dir) for file in names)
+    assert checked_out == ["main.py", "notebook.ipynb", "pkg/module.py", "requirements.txt"]
+
+
+def test_clone_repos_in_parallel(tmp_path):
+    names = [f"owner{i}/project{i}" for i in range(6)]
+    for name in names:
+        base_url = make_bare_repo(str(tmp_path), name, FILES)
+    with open(tmp_path / "repos.pickle", "wb") as f:
+        pickle.dump(names + ["owner/missing"], f)
+    directory = tmp_path / "repos"
+    os.makedirs(directory / "project0")
+
+    repo_files_pickle = str(tmp_path / "repo_files.pickle")
+    repo_files = clone_repos(str(tmp_path / "repos.pickle"), str(directory), workers=3, base_url=base_url, repo_files_pickle=repo_files_pickle)
+
+    assert sorted(repo_files) == [f"project{i}" for i in range(1, 6)]
+    assert sorted(os.listdir(directory)) == [f"project{i}" for i in range(6)]
+    assert os.listdir(directory / "project0") == []
+    assert not os.path.exists(directory / "project1" / ".git")
+    with open(repo_files_pickle, "rb") as f:
+        assert pickle.load(f) == repo_files
+
+
+def test_clone_repos_keeps_the_first_of_repos_with_the_same_name(tmp_path):
+    make_bare_repo(str(tmp_path), "alice/notebooks", {"alice.py": "x = 1\n"})
+    base_url = make_bare_repo(str(tmp_path), "bob/notebooks", {"bob.py": "x = 2\n"})
+    with open(tmp_path / "repos.pickle", "wb") as f:
+        pickle.dump(["alice/notebooks", "bob/notebooks"], f)
+    directory = tmp_path / "repos"
+
+    repo_files = clone_repos(str(tmp_path / "repos.pickle"), str(directory), workers=2, base_url=base_url, repo_files_pickle=str(tmp_path / "repo_files.pickle"))
+
+    assert repo_files == {"notebooks": ["alice.py"]}
+    assert os.listdir(directory / "notebooks") == ["alice.py"]
+
+
+def test_failed_clone_keeps_an_existing_directory(tmp_path):
+    repo_dir = tmp_path / "project"
+    os.makedirs(repo_dir)
+    (repo_dir / "kept.py").write_text("x = 1\n")
+    assert _clone_or_log("owner/missing", f"file://{tmp_path}/missing.git", str(repo_dir), (".py",)) is None
+    assert os.listdir(repo_dir) == ["kept.py"]
+
+
+def test_clone_repos_into_archives(tmp_path):
+    base_url = make_bare_repo(str(tmp_path), "owner/project", FILES)
+    with open(tmp_path / "repos.pickle", "wb") as f:
+        pickle.dump(["owner/project"], f)
+    archive_directory = tmp_path / "archives"
+
+    repo_files = clone_repos(str(tmp_path / "repos.pickle"), str(tmp_path / "repos"), base_url=base_url, repo_files_pickle=str(tmp_path / "repo_files.pickle"), archive_directory=str(archive_directory), archive_format="tar.gz")
+
+    assert list(repo_files) == ["project"]
+    assert os.listdir(tmp_path / "repos") == []
+    members = [filename for filename, _, _ in iter_archive_members(str(archive_directory / "project.tar.gz"), "/corpus", (".py", ".ipynb", ".txt"))]
+    assert sorted(members) == ["/corpus/project/main.py", "/corpus/project/notebook.ipynb", "/corpus/project/pkg/module.py", "/corpus/project/requirements.txt"]
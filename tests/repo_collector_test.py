@@ -0,0 +1,72 @@
+import time
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+from src.repo_acquisition.repo_collector import MIN_RATE_LIMIT_WAIT, RateLimiter, collect_repositories, created_query, request_json
+from tests.github_mock_server import MockGitHub, fake_repo
+
+
+START = datetime(2021, 1, 1, tzinfo=timezone.utc)
+
+
+def test_created_query():
+    assert created_query("stars:>50", START, START + timedelta(days=1)) == "stars:>50 created:2021-01-01T00:00:00Z..2021-01-01T23:59:59Z"
+
+
+def test_collects_every_repo_above_the_search_cap():
+    # A single day with 2500 repositories needs splitting below a day, the rest is one range with pagination.
+    repos = [fake_repo(i, START + timedelta(days=3, seconds=i * 30), stars=i % 97) for i in range(2500)]
+    repos += [fake_repo(10_000 + i, START + timedelta(days=10 + i % 20, hours=i % 24)) for i in range(450)]
+    with MockGitHub(repos) as mock:
+        collected = asyncio.run(collect_repositories(START, START + timedelta(days=31), None, "stars:>50", api_url=mock.url))
+        assert mock.rejected == 0
+    assert set(collected) == {repo["id"] for repo in repos}
+    assert collected[3]["full_name"] == "owner3/repo3"
+    # Split ranges fit under the cap and are paged, so far fewer requests are made than one per result page of each day.
+    assert len(mock.requests) < 60
+
+
+def test_waits_for_the_rate_limit_window():
+    repos = [fake_repo(i, START + timedelta(hours=i)) for i in range(24 * 20)]
+    checkpoints = []
+    with MockGitHub(repos, rate_limit=3, window_seconds=0.5) as mock:
+        # The window is used up before the first request, which is rejected and retried after the reset.
+        mock.window_requests = 3
+        collected = asyncio.run(collect_repositories(START, START + timedelta(days=20), None, "stars:>50", api_url=mock.url, checkpoint=lambda repos: checkpoints.append(len(repos)), checkpoint_every=1))
+    assert set(collected) == {repo["id"] for repo in repos}
+    assert checkpoints == [len(repos)]
+    # Five pages fill two windows after the rejected request, the limiter holds the fourth page back instead of being rejected.
+    assert mock.rejected == 1
+    assert len(mock.requests) == 5 + 1
+
+
+def test_backs_off_when_the_rate_limit_reset_is_past():
+    requests = []
+
+    def handler(request):
+        requests.append(time.monotonic())
+        if len(requests) <= 2:
+            return httpx.Response(403, json={"message": "API rate limit exceeded"}, headers={"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(int(time.time()) - 30)})
+        return httpx.Response(200, json={"total_count": 0, "items": []})
+
+    async def request(max_rate_limit_retries):
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="https://api.test") as client:
+            return await request_json(client, RateLimiter(), "GET", "/search/repositories", max_rate_limit_retries=max_rate_limit_retries)
+
+    # The retries wait 1 then 2 seconds instead of following the past reset time.
+    assert asyncio.run(request(2)) == {"total_count": 0, "items": []}
+    assert [later - earlier >= MIN_RATE_LIMIT_WAIT * 2 ** i for i, (earlier, later) in enumerate(zip(requests, requests[1:]))] == [True, True]
+    requests.clear()
+    assert asyncio.run(request(1)) is None
+    assert len(requests) == 2
+
+
+@pytest.mark.parametrize("existing", [{}, {-1: {"name": "kept"}}])
+def test_updates_existing_repos(existing):
+    repos = [fake_repo(i, START + timedelta(hours=i)) for i in range(5)]
+    with MockGitHub(repos) as mock:
+        collected = asyncio.run(collect_repositories(START, START + timedelta(days=1), None, "stars:>50", repos=dict(existing), api_url=mock.url))
+    assert set(collected) == set(existing) | set(range(5))
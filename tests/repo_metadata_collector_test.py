@@ -0,0 +1,50 @@
+import asyncio
+from datetime import datetime, timezone
+
+from src.repo_acquisition.repo_collector import repo_record
+from src.repo_acquisition.repo_metadata_collector import collect_metadata, batch_query, metadata_record
+from tests.github_mock_server import MockGitHub, fake_repo, graphql_node
+
+
+REPOS = [fake_repo(i, datetime(2021, 1, 1, tzinfo=timezone.utc), stars=i) for i in range(230)]
+
+
+def test_batch_query_escapes_names():
+    query = batch_query(["owner/name", 'odd"name'])
+    assert query.startswith('query { r0: repository(owner: "owner", name: "name") {')
+    assert 'r1: search(query: "odd\\"name", type: REPOSITORY, first: 1)' in query
+
+
+def test_records_have_the_fields_of_rest_search_items():
+    # Those the previous REST collector stored, without the API URLs and the search score.
+    for repo in REPOS[:12]:
+        record = metadata_record(graphql_node(repo))
+        assert record == repo
+        assert set(repo_record(repo)) <= set(record)
+
+
+def test_collects_in_batches_and_skips_known_repos():
+    names = [repo["full_name"] for repo in REPOS[:200]] + [repo["name"] for repo in REPOS[200:]] + ["owner/missing", "missing"]
+    collected_repos = {repo["id"]: repo_record(repo) for repo in REPOS[:20]}
+    repo_data = {REPOS[20]["full_name"]: {"name": "resumed"}}
+    checkpoints = []
+    with MockGitHub(REPOS) as mock:
+        result = asyncio.run(collect_metadata(names, "token", repo_data, collected_repos, api_url=mock.url, batch_size=50, checkpoint=lambda data: checkpoints.append(len(data)), checkpoint_every=1))
+
+    assert result is repo_data
+    assert sorted(result) == sorted(names[:-2])
+    assert result[REPOS[20]["full_name"]] == {"name": "resumed"}
+    assert result[REPOS[10]["full_name"]] == repo_record(REPOS[10])
+    assert result[REPOS[30]["full_name"]] == REPOS[30]
+    assert result[REPOS[210]["name"]] == REPOS[210]
+    # 209 names were not known before: five batches of at most 50.
+    assert len(mock.requests) == 5
+    assert checkpoints == sorted(checkpoints) and len(checkpoints) == 5
+
+
+def test_splits_batches_the_api_rejects():
+    names = [repo["full_name"] for repo in REPOS[:40]]
+    with MockGitHub(REPOS, max_aliases=10) as mock:
+        result = asyncio.run(collect_metadata(names, "token", api_url=mock.url, batch_size=40))
+    assert sorted(result) == sorted(names)
+    assert all(record == repo for record, repo in zip((result[name] for name in names), REPOS))
@@ -0,0 +1,70 @@
+import os
+import json
+import tempfile
+from collections import Counter
+
+import pytest
+import pandas as pd
+
+from src.utils import save_dict_as_parquet
+from src.main import local_state_directory
+from src.shards import IMPORTS_TABLE, plan_shards, load_or_create_shard_plan, claim_shard, complete_shard, is_shard_done, merge_shards, shard_name
+
+
+def test_plan_shards():
+    assert plan_shards(7, 3) == [(0, 2), (3, 5), (6, 6)]
+    assert plan_shards(7, 3, dir_range=(2, 4)) == [(2, 4)]
+    assert plan_shards(0, 3) == []
+
+
+def test_claim_shard():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        assert claim_shard(tmpdirname, (0, 2))
+        assert not claim_shard(tmpdirname, (0, 2))
+        assert claim_shard(tmpdirname, (0, 2), stale_lock_seconds=-1)
+
+        with open(os.path.join(tmpdirname, f"{shard_name((3, 5))}.lock"), "w") as f:
+            json.dump({"host": os.uname().nodename, "pid": 2 ** 22 + 1, "time": 0}, f)
+        assert claim_shard(tmpdirname, (3, 5))
+
+
+def test_sharded_run_and_merge():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        shards = load_or_create_shard_plan(tmpdirname, [(0, 0), (1, 1)], {"mode": "full"})
+        assert load_or_create_shard_plan(tmpdirname, [(0, 5)], {"mode": "full"}) == shards
+        with pytest.raises(ValueError):
+            load_or_create_shard_plan(tmpdirname, shards, {"mode": "imports"})
+
+        for i, shard in enumerate(shards):
+            assert claim_shard(tmpdirname, shard)
+            temporary_output_path = os.path.join(tmpdirname, f"{i}.tmp")
+            save_dict_as_parquet(Counter({(f"repo{i}/a.py", "os", "function", "listdir"): i + 1}), temporary_output_path)
+            with pytest.raises(ValueError):
+                merge_shards(tmpdirname, os.path.join(tmpdirname, "merged.parquet"))
+            complete_shard(tmpdirname, shard, temporary_output_path, {"files": 1})
+            assert is_shard_done(tmpdirname, shard)
+
+        assert merge_shards(tmpdirname, os.path.join(tmpdirname, "merged.parquet")) == 2
+        assert pd.read_parquet(os.path.join(tmpdirname, "merged.parquet"))["count"].tolist() == [1, 2]
+
+
+def test_merge_shards_with_imports_table():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        shards = load_or_create_shard_plan(tmpdirname, [(0, 0), (1, 1)], {"mode": "both"})
+        for i, shard in enumerate(shards):
+            temporary_output_path, temporary_imports_output_path = os.path.join(tmpdirname, f"{i}.tmp"), os.path.join(tmpdirname, f"{i}.imports.tmp")
+            save_dict_as_parquet(Counter({(f"repo{i}/a.py", "os", "function", "listdir"): 1}), temporary_output_path)
+            save_dict_as_parquet(Counter({(f"repo{i}/a.py", "os"): 1, (f"repo{i}/a.py", "sys"): 1}), temporary_imports_output_path)
+            complete_shard(tmpdirname, shard, temporary_output_path, {"files": 1}, temporary_imports_output_path)
+
+        assert merge_shards(tmpdirname, os.path.join(tmpdirname, "merged.parquet")) == 2
+        assert merge_shards(tmpdirname, os.path.join(tmpdirname, "imports.parquet"), table=IMPORTS_TABLE) == 4
+        assert list(pd.read_parquet(os.path.join(tmpdirname, "imports.parquet")).columns) == ["filename", "module"]
+
+
+def test_sharded_runs_keep_cache_and_manifest_on_local_disk(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    directory = local_state_directory(str(tmp_path / "shared" / "shards"))
+    assert directory.startswith(str(tmp_path / "cache"))
+    assert directory == local_state_directory(str(tmp_path / "shared" / "shards" / ""))
+    assert directory != local_state_directory(str(tmp_path / "shared" / "other_shards"))
@@ -1,10 +1,18 @@
 import os
+import ast
+import json
+import pickle
+import logging
 import tempfile
 from collections import Counter
 
+import pytest
 import pandas as pd
+import pyarrow.parquet as pq
 
-from src.utils import find_python_files, save_dict_as_parquet
+from src import utils
+from src.lib_elements_counter import get_imported_modules
+from src.utils import discover_files, extract_notebook_code, cell_index_for_line, convert_notebook_to_python, find_python_files, batch_files_by_size, save_dict_as_parquet, save_counters_as_parquet, compile_library_reference, save_compiled_reference, load_library_reference, combine_library_references, reference_name
 
 
 def test_find_python_files():
@@ -65,3 +73,154 @@ def test_save_dict_as_parquet():
             reformed_counter[(filename, module, component_type, component_name)] = count
 
         assert test_counter == reformed_counter, f"Expected {test_counter}, got {reformed_counter}"
+
+
+def test_compiled_library_reference_round_trip():
+    lib_dict = {"math": {"function": ["sqrt", "pow"], "attribute": ["pi"], "method": [], "class": [], "exception": []}}
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        raw_path = os.path.join(tmpdirname, "raw.pickle")
+        compiled_path = os.path.join(tmpdirname, "raw.compiled.pickle")
+        with open(raw_path, "wb") as f:
+            pickle.dump(lib_dict, f)
+
+        save_compiled_reference(load_library_reference(raw_path), compiled_path)
+
+        assert load_library_reference(compiled_path) == load_library_reference(raw_path)
+        assert load_library_reference(compiled_path) == compile_library_reference(lib_dict)
+        assert load_library_reference(compiled_path)["math"]["function"] == frozenset({"sqrt", "pow"})
+
+
+def test_save_counters_as_parquet_row_groups():
+    counters = [
+        Counter({("file1", "math", "function", "sin"): 2, ("file1", "math", "function", "cos"): 1}),
+        Counter(),
+        Counter({("file2", "os", "function", "listdir"): 3}),
+    ]
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        parquet_file_path = os.path.join(tmpdirname, "test.parquet")
+
+        rows_written = save_counters_as_parquet(iter(counters), parquet_file_path, row_group_size=2)
+
+        assert rows_written == 3
+        assert pq.ParquetFile(parquet_file_path).num_row_groups == 2
+        df_read = pd.read_parquet(parquet_file_path)
+        assert list(df_read.columns) == ["filename", "module", "component_type", "component_name", "count"]
+        assert df_read["count"].sum() == 6
+
+        save_counters_as_parquet([Counter({("file1", "os"): 1, ("file1", "sys"): 1})], parquet_file_path)
+        assert list(pd.read_parquet(parquet_file_path).columns) == ["filename", "module"]
+
+
+def test_batch_files_by_size():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        sizes = {"big.py": 500, "a.py": 100, "b.py": 100, "c.py": 100, "d.py": 50}
+        for filename, size in sizes.items():
+            with open(os.path.join(tmpdirname, filename), "w") as f:
+                f.write("#" * size)
+        code_files = [os.path.join(tmpdirname, filename) for filename in sizes]
+
+        batches = batch_files_by_size(code_files, chunk_bytes=200)
+
+        assert batches[0] == [os.path.join(tmpdirname, "big.py")]
+        assert sorted(f for batch in batches for f in batch) == sorted(code_files)
+        assert all(sum(sizes[os.path.basename(f)] for f in batch) <= 200 for batch in batches[1:])
+
+        assert len(batch_files_by_size(code_files, chunk_bytes=10_000, min_batches=3)) >= 3
+
+
+def test_extract_notebook_code():
+    notebook = {
+        "cells": [
+            {"cell_type": "markdown", "source": ["# Title"]},
+            {"cell_type": "code", "source": ["%matplotlib inline\n", "import os\n", "for name in names:\n", "    !echo $name\n", "files = !ls\n", "x = a != b"]},
+            {"cell_type": "code", "source": "%%bash\necho 1"},
+            {"cell_type": "code", "source": ["os.path?"]},
+        ]
+    }
+
+    code, cell_offsets = extract_notebook_code(json.dumps(notebook))
+
+    tree = ast.parse(code)
+    assert get_imported_modules(tree) == ({"os"}, {})
+    assert code.splitlines()[3] == "    pass  # !echo $name"
+    assert "x = a != b" in code
+    assert "# echo 1" in code
+    assert cell_offsets == [(1, 1), (2, 8), (3, 11)]
+    assert cell_index_for_line(cell_offsets, 6) == 1
+    assert cell_index_for_line(cell_offsets, 9) == 2
+
+
+def test_convert_notebook_to_python_malformed():
+    logger = logging.getLogger("test")
+
+    assert convert_notebook_to_python('{"cells": [{"source": "x = 1"}]', logger) == ""
+
+
+def test_discover_files_with_manifest():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        root = os.path.join(tmpdirname, "repos")
+        os.makedirs(os.path.join(root, "a", "b"))
+        os.makedirs(os.path.join(root, "c"))
+        for path in ("a/file1.py", "a/b/notebook.ipynb", "a/b/notes.txt", "c/file2.py"):
+            with open(os.path.join(root, path), "w") as f:
+                f.write("import os")
+        manifest_path = os.path.join(tmpdirname, "manifest.pickle")
+
+        result = discover_files(root, (".py", ".ipynb"), manifest_path=manifest_path)
+
+        assert set(result) == {os.path.join(root, path) for path in ("a/file1.py", "a/b/notebook.ipynb", "c/file2.py")}
+        assert result[os.path.join(root, "c", "file2.py")][0] == len("import os")
+        assert set(discover_files(root, (".py", ".ipynb"), dir_range=(1, 1))) == {os.path.join(root, "c", "file2.py")}
+
+        directory_stat = os.stat(os.path.join(root, "c"))
+        with open(os.path.join(root, "c", "file3.py"), "w") as f:
+            f.write("import sys")
+        os.utime(os.path.join(root, "c"), ns=(directory_stat.st_atime_ns, directory_stat.st_mtime_ns))
+
+        assert os.path.join(root, "c", "file3.py") not in discover_files(root, (".py", ".ipynb"), manifest_path=manifest_path)
+        assert os.path.join(root, "c", "file3.py") in discover_files(root, (".py", ".ipynb"))
+
+
+def test_discover_files_ignores_unreadable_manifest(tmp_path):
+    os.makedirs(tmp_path / "repos" / "a")
+    (tmp_path / "repos" / "a" / "file.py").write_text("import os")
+    manifest_path = tmp_path / "manifest.pickle"
+    manifest_path.write_bytes(b"\x80\x05truncated")
+
+    assert set(discover_files(str(tmp_path / "repos"), manifest_path=str(manifest_path))) == {str(tmp_path / "repos" / "a" / "file.py")}
+    with open(manifest_path, "rb") as f:
+        assert str(tmp_path / "repos" / "a") in pickle.load(f)["directories"]
+
+
+def test_discover_files_keeps_listings_written_during_the_scan(tmp_path, monkeypatch):
+    os.makedirs(tmp_path / "repos" / "a")
+    manifest_path = str(tmp_path / "manifest.pickle")
+    scan_directory = utils._scan_directory
+
+    def scan_while_another_shard_saves(directory, suffixes, manifest, new_manifest):
+        with open(manifest_path, "wb") as f:
+            pickle.dump({"suffixes": suffixes, "directories": {"/other/shard": (1, [], [])}}, f)
+        return scan_directory(directory, suffixes, manifest, new_manifest)
+
+    monkeypatch.setattr(utils, "_scan_directory", scan_while_another_shard_saves)
+    discover_files(str(tmp_path / "repos"), manifest_path=manifest_path)
+    with open(manifest_path, "rb") as f:
+        assert set(pickle.load(f)["directories"]) == {"/other/shard", str(tmp_path / "repos" / "a")}
+
+
+def test_combine_library_references():
+    stdlib = {"os": {"function": ["getcwd"]}, "json": {"function": ["dumps"]}}
+    pandas = {"pandas": {"function": ["read_csv"], "class": ["DataFrame"]}, "json": {"function": ["dumps"]}}
+    lib_dict, module_references = combine_library_references({"stdlib": stdlib, "pandas": pandas})
+    assert lib_dict == compile_library_reference({**stdlib, **pandas})
+    assert module_references == {"os": ("stdlib",), "json": ("stdlib", "pandas"), "pandas": ("pandas",)}
+
+    with pytest.raises(ValueError):
+        combine_library_references({"stdlib": stdlib, "other": {"os": {"function": ["getpid"]}}})
+
+
+def test_reference_name():
+    assert reference_name("./api_reference_pickles/pandas.pickle") == "pandas"
+    assert reference_name("/tmp/standard_library.compiled.pickle") == "standard_library"